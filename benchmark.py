@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+"""
+    Offline benchmark of event dispatch: feeds synthetic messages and reactions through Callbacks into the loaded plugins,
+    using a stand-in for AsyncClient that records the requests instead of sending them
+
+    bin/python benchmark.py --events 2000 --rooms 10 --mix "echo hi=3,oracle yes=2,reaction=1,message=2"
+
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import random
+import sys
+import tempfile
+import tracemalloc
+from os import path
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Set, Tuple
+
+from nio import JoinedMembersResponse, MatrixRoom, RoomMember, RoomMessageText, RoomSendResponse, RoomTypingResponse, UnknownEvent
+
+from callbacks import Callbacks
+from chat_functions import set_send_queue
+from dispatcher import Dispatcher
+from metrics import metrics
+from plugin import Plugin
+from plugin_storage import PluginDataBackend
+from pluginloader import PluginLoader
+from process_pool import process_pool
+from send_queue import SendQueue
+from storage import Storage
+from typing_notifications import typing_manager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIX: str = "echo benchmark=3,oracle will it be fast=2,meter speed=2,spruch=1,roll 2d6=1,help=1,reaction=2,message=3"
+
+
+class FakeClient:
+
+    def __init__(self, user_id: str, latency: float = 0):
+        """
+        Stands in for nio.AsyncClient, answering the requests used by the bot and its plugins without a homeserver
+        :param user_id: the bot's user id
+        :param latency: seconds each request takes, simulating the round trip to the homeserver
+        """
+
+        self.user: str = user_id
+        self.user_id: str = user_id
+        self.latency: float = latency
+        self.rooms: Dict[str, MatrixRoom] = {}
+        self.members: Dict[str, List[Tuple[str, str]]] = {}
+        """all members of each room: (user_id, display_name), returned by joined_members"""
+
+        self.calls: Dict[str, int] = {"room_send": 0, "room_typing": 0, "joined_members": 0}
+        self.sent: Dict[str, int] = {}
+        """number of messages sent to each room"""
+
+    def add_room(self, room_id: str, members: List[Tuple[str, str]]):
+        """
+        Add a joined room, with its members being lazy-loaded (only the bot is known until joined_members is called)
+        :param room_id: the room's id
+        :param members: (user_id, display_name) of all other members
+        :return:
+        """
+
+        room: MatrixRoom = MatrixRoom(room_id, self.user_id)
+        room.add_member(self.user_id, "bot", None)
+        self.rooms[room_id] = room
+        self.members[room_id] = [(self.user_id, "bot")] + members
+
+    async def __request(self, method: str):
+
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def room_send(self, room_id: str, message_type: str, content: Dict[str, Any], tx_id: str = None,
+                        ignore_unverified_devices: bool = False) -> RoomSendResponse:
+
+        await self.__request("room_send")
+        self.sent[room_id] = self.sent.get(room_id, 0) + 1
+        return RoomSendResponse(f"$sent{self.calls['room_send']}", room_id)
+
+    async def room_typing(self, room_id: str, typing_state: bool = True, timeout: int = 30000) -> RoomTypingResponse:
+
+        await self.__request("room_typing")
+        return RoomTypingResponse(room_id)
+
+    async def joined_members(self, room_id: str) -> JoinedMembersResponse:
+
+        await self.__request("joined_members")
+        room: MatrixRoom = self.rooms[room_id]
+        for user_id, display_name in self.members[room_id]:
+            if user_id not in room.users:
+                room.add_member(user_id, display_name, None)
+        room.members_synced = True
+        return JoinedMembersResponse([RoomMember(user_id, display_name, None) for user_id, display_name in self.members[room_id]],
+                                     room_id)
+
+
+class MemoryBackend(PluginDataBackend):
+
+    """Keeps plugin data in memory only, so benchmarks never touch the plugins' real data"""
+
+    def __init__(self):
+
+        self.data: Dict[str, Any] = {}
+
+    def read(self, name: str) -> Any:
+
+        return self.data[name]
+
+    def store(self, name: str, data: Any, keys: Iterable[Hashable] = None) -> bool:
+
+        self.data[name] = data
+        return True
+
+    def clear(self, name: str) -> bool:
+
+        return self.data.pop(name, None) is not None
+
+    def load_all(self) -> Dict[str, Any]:
+
+        return dict(self.data)
+
+    async def write(self, changes: Dict[str, Any], keys: Dict[str, Set[Hashable]] = None) -> int:
+
+        return 0
+
+
+class BenchmarkConfig:
+
+    def __init__(self, command_prefix: str = "!", botmasters: List[str] = None):
+        """
+        The configuration values used while dispatching events
+        """
+
+        self.command_prefix: str = command_prefix
+        self.botmasters: List[str] = botmasters or []
+
+
+class TimingDispatcher(Dispatcher):
+
+    def __init__(self, *args, **kwargs):
+        """
+        Dispatcher recording when each job submitted during the current event has been completed
+        """
+
+        super().__init__(*args, **kwargs)
+        self.completions: List[float] = []
+        """completion times of the jobs submitted for the event currently being fed, replaced for every event"""
+        self.jobs: int = 0
+
+    def begin_event(self) -> List[float]:
+
+        self.completions = []
+        self.jobs = 0
+        return self.completions
+
+    def submit(self, room_id: str, job: Callable[[], Awaitable]):
+
+        completions: List[float] = self.completions
+        self.jobs += 1
+
+        async def timed_job():
+            try:
+                await job()
+            finally:
+                completions.append(monotonic())
+
+        super().submit(room_id, timed_job)
+
+
+class MixEntry:
+
+    def __init__(self, text: str, weight: float):
+        """
+        One kind of event fed into the bot
+        :param text: "reaction", "message" (a message without command prefix) or a command with its arguments
+        :param weight: relative frequency of this kind of event
+        """
+
+        self.text: str = text
+        self.weight: float = weight
+        self.label: str = text if text in ["reaction", "message"] else text.split()[0]
+
+
+def parse_mix(mix: str) -> List[MixEntry]:
+    """
+    Parse a command mix like "echo hi=3,reaction=1,message=2"
+    :param mix: comma separated entries, each optionally followed by =weight
+    :return: the entries
+    """
+
+    entries: List[MixEntry] = []
+    for item in mix.split(","):
+        text, _, weight = item.strip().rpartition("=") if "=" in item else ("", "", "1")
+        entries.append(MixEntry((text or item).strip(), float(weight)))
+    return entries
+
+
+def percentile(values: List[float], quantile: float) -> float:
+
+    """Nearest-rank percentile of a list of values"""
+
+    if not values:
+        return 0.0
+    ordered: List[float] = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(quantile * len(ordered))) - 1))]
+
+
+class Benchmark:
+
+    def __init__(self, rooms: int = 10, members: int = 20, mix: str = DEFAULT_MIX, rate: float = 0, latency: float = 0,
+                 seed: int = 0, send_rate: float = 0):
+        """
+        Feeds synthetic events into the bot's Callbacks and measures how fast they are processed
+        :param rooms: number of rooms the events are spread across
+        :param members: number of members (besides the bot) of each room
+        :param mix: kinds and relative frequencies of events, see parse_mix
+        :param rate: events per second fed into the bot, 0 to feed them as fast as possible
+        :param latency: seconds each request to the (fake) homeserver takes
+        :param seed: seed of the random choice of rooms, senders and events
+        :param send_rate: messages per second and room of the send queue, 0 for no limit
+        """
+
+        self.rate: float = rate
+        self.mix: List[MixEntry] = parse_mix(mix)
+        self.random: random.Random = random.Random(seed)
+        self.counter: int = 0
+
+        self.client: FakeClient = FakeClient("@bot:benchmark.local", latency)
+        self.room_ids: List[str] = [f"!room{number}:benchmark.local" for number in range(rooms)]
+        for room_id in self.room_ids:
+            self.client.add_room(room_id, [(f"@user{number}:benchmark.local", f"User {number}") for number in range(members)])
+        self.members: int = members
+        self.last_event: Dict[str, str] = {}
+        """id of the latest message in each room, reactions relate to it"""
+
+        self.config: BenchmarkConfig = BenchmarkConfig()
+        self.temp_dir: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.store: Storage = Storage(path.join(self.temp_dir.name, "benchmark.db"))
+        set_send_queue(SendQueue(rate=send_rate, burst=max(1, int(send_rate))))
+
+        self.dispatcher: TimingDispatcher = TimingDispatcher()
+        self.plugin_loader: PluginLoader = PluginLoader(self.dispatcher, data_backend="pickle")
+        for plugin in self.plugin_loader.get_plugins().values():
+            if isinstance(plugin, Plugin):
+                plugin.set_data_backend(MemoryBackend())
+        if "sampleplugin" in self.plugin_loader.get_plugins():
+            # its reaction hook expects a message tracked by sample_reaction_test, reactions relate to other messages
+            self.plugin_loader.get_plugins()["sampleplugin"].store_data("tracked_message", "$tracked:benchmark.local")
+        self.callbacks: Callbacks = Callbacks(self.client, self.store, self.config, self.plugin_loader, self.dispatcher)
+
+    def make_event(self, entry: MixEntry, room_id: str) -> RoomMessageText or UnknownEvent:
+        """
+        Build a synthetic event
+        :param entry: the kind of event
+        :param room_id: the room the event is sent to
+        :return: the event
+        """
+
+        self.counter += 1
+        event_id: str = f"$event{self.counter}"
+        sender: str = f"@user{self.random.randrange(self.members)}:benchmark.local" if self.members else "@user:benchmark.local"
+        source: Dict[str, Any] = {"event_id": event_id, "sender": sender, "origin_server_ts": self.counter, "room_id": room_id}
+
+        if entry.text == "reaction":
+            source.update(type="m.reaction", content={"m.relates_to": {
+                "rel_type": "m.annotation", "event_id": self.last_event.get(room_id, "$event0"), "key": "👍"}})
+            return UnknownEvent(source, "m.reaction")
+
+        body: str = f"just chatting {self.counter}" if entry.text == "message" else self.config.command_prefix + entry.text
+        source.update(type="m.room.message", content={"msgtype": "m.text", "body": body})
+        self.last_event[room_id] = event_id
+        return RoomMessageText.from_dict(source)
+
+    async def feed(self, entry: MixEntry, room_id: str) -> Tuple[float, List[float], int]:
+        """
+        Hand a synthetic event to the callbacks
+        :return: (time the event was fed, completion times of its jobs (filled in while they complete), number of jobs)
+        """
+
+        event = self.make_event(entry, room_id)
+        completions: List[float] = self.dispatcher.begin_event()
+        start: float = monotonic()
+        if isinstance(event, UnknownEvent):
+            await self.callbacks.event_unknown(self.client.rooms[room_id], event)
+        else:
+            await self.callbacks.message(self.client.rooms[room_id], event)
+        return start, completions, self.dispatcher.jobs
+
+    async def run_throughput(self, events: int) -> Dict[str, Any]:
+        """
+        Feed events at the configured rate, spread randomly across rooms and the command mix
+        :param events: number of events to feed
+        :return: events/sec and latencies from feeding an event to the completion of all of its jobs, per mix entry
+        """
+
+        weights: List[float] = [entry.weight for entry in self.mix]
+        fed: List[Tuple[MixEntry, float, List[float], int]] = []
+
+        start: float = monotonic()
+        for number in range(events):
+            if self.rate > 0:
+                await asyncio.sleep(max(0.0, start + number / self.rate - monotonic()))
+            entry: MixEntry = self.random.choices(self.mix, weights)[0]
+            fed.append((entry, *await self.feed(entry, self.random.choice(self.room_ids))))
+            if number % 100 == 99:
+                # let the workers process events in between, as they would while waiting for the next sync
+                await asyncio.sleep(0)
+
+        await self.dispatcher.join()
+        end: float = max([start] + [max(completions) for _, _, completions, _ in fed if completions])
+
+        latencies: Dict[str, List[float]] = {}
+        for entry, fed_at, completions, jobs in fed:
+            samples: List[float] = latencies.setdefault(entry.label, [])
+            if jobs and len(completions) == jobs:
+                samples.append(max(completions) - fed_at)
+
+        return {
+            "events": events,
+            "failures": self.count_failures(),
+            "seconds": end - start,
+            "events_per_second": events / (end - start) if end > start else 0.0,
+            "labels": {label: {"events": sum(1 for entry, *_ in fed if entry.label == label),
+                               "dispatched": len(samples),
+                               "p50_ms": percentile(samples, .5) * 1000,
+                               "p99_ms": percentile(samples, .99) * 1000} for label, samples in latencies.items()},
+        }
+
+    @staticmethod
+    def count_failures() -> Dict[str, int]:
+        """
+        :return: number of commands (by command name) and hooks (by event type) that raised an exception or timed out
+        """
+
+        failures: Dict[str, int] = {}
+        for (plugin_name, command, room_class, outcome), count in metrics.commands.values.items():
+            if outcome != "ok":
+                failures[command] = failures.get(command, 0) + int(count)
+        for (plugin_name, event_type, room_class, outcome), count in metrics.hooks.values.items():
+            if outcome != "ok":
+                label: str = "reaction" if event_type == "m.reaction" else "message"
+                failures[label] = failures.get(label, 0) + int(count)
+        return failures
+
+    async def run_allocations(self, events: int) -> Dict[str, Dict[str, float]]:
+        """
+        Feed each kind of event separately, tracing memory allocations of the bot and its plugins
+        :param events: number of events of each kind
+        :return: {label: memory retained and allocation peak per event}
+        """
+
+        ignored: List[tracemalloc.Filter] = [tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)]
+        results: Dict[str, Dict[str, float]] = {}
+        tracemalloc.start()
+        try:
+            for entry in self.mix:
+                # fill caches and lazily loaded data first, they are not allocated per event
+                for room_id in self.room_ids:
+                    await self.feed(entry, room_id)
+                await self.dispatcher.join()
+
+                gc.collect()
+                before: tracemalloc.Snapshot = tracemalloc.take_snapshot().filter_traces(ignored)
+                baseline: int = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+
+                for number in range(events):
+                    await self.feed(entry, self.room_ids[number % len(self.room_ids)])
+                    await self.dispatcher.join()
+
+                peak: int = tracemalloc.get_traced_memory()[1]
+                gc.collect()
+                after: tracemalloc.Snapshot = tracemalloc.take_snapshot().filter_traces(ignored)
+                differences = after.compare_to(before, "filename")
+                results[entry.label] = {
+                    "retained_bytes_per_event": sum(stat.size_diff for stat in differences) / events,
+                    "retained_blocks_per_event": sum(stat.count_diff for stat in differences) / events,
+                    "peak_kib": (peak - baseline) / 1024,
+                }
+        finally:
+            tracemalloc.stop()
+        return results
+
+    async def close(self):
+        """
+        Wait for delayed replies, shut down worker processes and remove the temporary database
+        :return:
+        """
+
+        await typing_manager.join()
+        await self.plugin_loader.flush_data()
+        process_pool.shutdown()
+        self.temp_dir.cleanup()
+
+
+def print_results(results: Dict[str, Any]):
+
+    throughput: Dict[str, Any] = results["throughput"]
+    print(f"{throughput['events']} events in {throughput['seconds']:.2f}s: {throughput['events_per_second']:.1f} events/sec")
+    traced: bool = "allocations" in results
+    print(f"{'event':<16}{'events':>8}{'failed':>8}{'p50 ms':>10}{'p99 ms':>10}"
+          + (f"{'KiB peak':>10}{'retained B':>12}{'blocks':>8}" if traced else ""))
+    for label, stats in sorted(throughput["labels"].items()):
+        line: str = (f"{label:<16}{stats['events']:>8}{throughput['failures'].get(label, 0):>8}"
+                     f"{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+        if traced:
+            allocations: Dict[str, float] = results["allocations"][label]
+            line += (f"{allocations['peak_kib']:>10.1f}{allocations['retained_bytes_per_event']:>12.0f}"
+                     f"{allocations['retained_blocks_per_event']:>8.1f}")
+        print(line)
+    print("client calls: " + ", ".join(f"{method}: {count}" for method, count in results["client_calls"].items()))
+
+
+def find_regressions(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Compare results with those of an earlier run
+    :param results: results of this run
+    :param baseline: results of the earlier run
+    :param tolerance: allowed relative slowdown, e.g. 0.2 for 20%
+    :return: descriptions of all regressions found
+    """
+
+    regressions: List[str] = []
+    current: Dict[str, Any] = results["throughput"]
+    previous: Dict[str, Any] = baseline["throughput"]
+    if current["events_per_second"] < previous["events_per_second"] * (1 - tolerance):
+        regressions.append(f"events/sec dropped from {previous['events_per_second']:.1f} to {current['events_per_second']:.1f}")
+
+    for label, stats in current["labels"].items():
+        if label in previous["labels"] and stats["p99_ms"] > previous["labels"][label]["p99_ms"] * (1 + tolerance):
+            regressions.append(f"p99 of {label} rose from {previous['labels'][label]['p99_ms']:.2f}ms to {stats['p99_ms']:.2f}ms")
+    return regressions
+
+
+async def main() -> int:
+
+    parser = argparse.ArgumentParser(description="Benchmark the dispatch of events to plugins without a homeserver")
+    parser.add_argument("--events", type=int, default=2000, help="number of events fed for the throughput run")
+    parser.add_argument("--rate", type=float, default=0, help="events per second, 0 to feed them as fast as possible")
+    parser.add_argument("--rooms", type=int, default=10, help="number of rooms")
+    parser.add_argument("--members", type=int, default=20, help="members of each room besides the bot")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"events and their weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--latency", type=float, default=0, help="simulated homeserver latency in ms")
+    parser.add_argument("--send-rate", type=float, default=0, help="messages per second and room, 0 for no limit")
+    parser.add_argument("--alloc-events", type=int, default=100, help="events of each kind traced for allocations, 0 to skip")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--baseline", help="json file of an earlier run, exit with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown compared to the baseline")
+    parser.add_argument("--verbose", action="store_true", help="log plugin output")
+    args = parser.parse_args()
+
+    # failures of plugins are counted in the results, their log output would only slow the benchmark down
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL + 1)
+
+    benchmark: Benchmark = Benchmark(args.rooms, args.members, args.mix, args.rate, args.latency / 1000, args.seed, args.send_rate)
+    try:
+        # worker processes take a while to start, which would be measured as latency of the first commands
+        await process_pool.start()
+        results: Dict[str, Any] = {"throughput": await benchmark.run_throughput(args.events)}
+        if args.alloc_events > 0:
+            results["allocations"] = await benchmark.run_allocations(args.alloc_events)
+        results["client_calls"] = benchmark.client.calls
+    finally:
+        await benchmark.close()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions: List[str] = find_regressions(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.get_event_loop().run_until_complete(main()))
@@ -1,11 +1,14 @@
 from bot_commands import Command
 from nio import (
-    JoinError, MatrixRoom, UnknownEvent,
+    JoinError, MatrixRoom, RoomMemberEvent, SyncResponse, UnknownEvent,
 )
 from message_responses import Message
+from functools import partial
 
 import logging
 
+from dispatcher import Dispatcher
+from member_cache import member_cache
 from pluginloader import PluginLoader
 
 logger = logging.getLogger(__name__)
@@ -13,7 +16,7 @@ logger = logging.getLogger(__name__)
 
 class Callbacks(object):
 
-    def __init__(self, client, store, config, plugin_loader):
+    def __init__(self, client, store, config, plugin_loader, dispatcher):
         """
         Args:
             client (nio.AsyncClient): nio client used to interact with matrix
@@ -21,12 +24,17 @@ class Callbacks(object):
             store (Storage): Bot storage
 
             config (Config): Bot configuration parameters
+
+            plugin_loader (PluginLoader): Loader holding all plugins
+
+            dispatcher (Dispatcher): Scheduler processing events per room
         """
         self.client = client
         self.store = store
         self.config = config
         self.command_prefix = config.command_prefix
         self.plugin_loader: PluginLoader = plugin_loader
+        self.dispatcher: Dispatcher = dispatcher
 
     async def message(self, room, event):
         """Callback for when a message event is received
@@ -52,13 +60,18 @@ class Callbacks(object):
         # process each line as separate message to check for commands
         messages = msg.split("\n\n")
 
+        # Only build Message objects if any plugin actually hooks into messages of this room
+        has_message_hooks: bool = self.plugin_loader.has_hooks("m.room.message", room.room_id)
+
         for split_message in messages:
             # Process as message if in a public room without command prefix
             has_command_prefix = split_message.startswith(self.command_prefix)
             if not has_command_prefix and not room.is_group:
+                if not has_message_hooks:
+                    continue
                 # General message listener
                 message = Message(self.client, self.store, self.config, split_message, room, event, self.plugin_loader)
-                await message.process()
+                self.dispatcher.submit(room.room_id, message.process)
                 continue
 
             # Otherwise if this is in a 1-1 with the bot or features a command prefix,
@@ -71,7 +84,7 @@ class Callbacks(object):
 
             if split_message != "":
                 command = Command(self.client, self.store, self.config, split_message, room, event, self.plugin_loader)
-                await command.process()
+                self.dispatcher.submit(room.room_id, command.process)
 
     async def event_unknown(self, room: MatrixRoom, event: UnknownEvent):
         """
@@ -82,7 +95,32 @@ class Callbacks(object):
         """
 
         if event.type == "m.reaction":
-            await self.plugin_loader.run_hooks(self.client, event.type, room, event)
+            self.dispatcher.submit(room.room_id, partial(self.plugin_loader.run_hooks, self.client, event.type, room, event))
+
+    async def member(self, room: MatrixRoom, event: RoomMemberEvent):
+        """
+        Keeps the member cache current: the client has already applied the membership change to the room's state
+        :param room: nio.rooms.MatrixRoom: the room the event came from
+        :param event: nio.events.room_events.RoomMemberEvent: a join, leave or displayname change
+        :return:
+        """
+
+        member_cache.invalidate(room.room_id)
+
+    async def sync_members(self, response: SyncResponse):
+        """
+        Keeps the member cache current for membership changes that only reach the client as room state, e.g. in the
+        state section of a limited (gappy) sync, which are not passed to the event callbacks
+        :param response: nio.responses.SyncResponse: the sync, already applied to the client's rooms
+        :return:
+        """
+
+        for room_id, room_info in response.rooms.join.items():
+            if any(isinstance(event, RoomMemberEvent) for event in room_info.state):
+                member_cache.invalidate(room_id)
+
+        for room_id in response.rooms.leave.keys():
+            member_cache.invalidate(room_id)
 
     async def invite(self, room, event):
         """Callback for when an invite is received. Join the room specified in the invite"""
@@ -1,20 +1,35 @@
 import logging
-from asyncio import sleep
 
 from nio import (
     SendRetryError, RoomSendResponse
 )
-from markdown import markdown
+from rendering import renderer
+from send_queue import SendQueue
+from typing_notifications import typing_manager
 
 logger = logging.getLogger(__name__)
 
+send_queue: SendQueue or None = None
+"""outbound pipeline all messages are sent through, if set"""
+
+
+def set_send_queue(queue: SendQueue or None):
+    """Send all messages through the given SendQueue (None to send them directly)
+
+    Args:
+        queue (SendQueue): The queue to use
+    """
+    global send_queue
+    send_queue = queue
+
 
 async def send_text_to_room(
     client,
     room_id,
     message,
     notice=True,
-    markdown_convert=True
+    markdown_convert=True,
+    format=None,
 ) -> RoomSendResponse or None:
     """Send text to a matrix room
 
@@ -30,18 +45,28 @@ async def send_text_to_room(
 
         markdown_convert (bool): Whether to convert the message content to markdown.
             Defaults to true.
+
+        format (str): How to render the message: "markdown", "html" (sent as is, no conversion) or "plain"
+            (no formatted body). Overrides markdown_convert.
     """
     # Determine whether to ping room members or not
     msgtype = "m.notice" if notice else "m.text"
 
+    if format is None:
+        format = "markdown" if markdown_convert else "plain"
+    body, formatted_body = renderer.render(message, format)
+
     content = {
         "msgtype": msgtype,
-        "format": "org.matrix.custom.html",
-        "body": message,
+        "body": body,
     }
 
-    if markdown_convert:
-        content["formatted_body"] = markdown(message)
+    if formatted_body is not None:
+        content["format"] = "org.matrix.custom.html"
+        content["formatted_body"] = formatted_body
+
+    if send_queue is not None:
+        return await send_queue.send(client, room_id, content)
 
     response: RoomSendResponse
 
@@ -60,6 +85,7 @@ async def send_text_to_room(
 
 async def send_typing(client, room_id, message, notice=False, markdown_convert=True):
     """DEPRECATED by plugin.message(): Send text to a room after displaying a typing notification for .2s
+    The message is sent in the background, without waiting for it
     Args:
         client (nio.AsyncClient): The client to communicate to matrix with
 
@@ -74,7 +100,5 @@ async def send_typing(client, room_id, message, notice=False, markdown_convert=T
         markdown_convert (bool): Whether to convert the message content to markdown.
             Defaults to True.
     """
-    await client.room_typing(room_id, timeout=200)
-    await sleep(.2)
-    await client.room_typing(room_id, typing_state=False)
-    await send_text_to_room(client, room_id, message, notice, markdown_convert)
+    typing_manager.schedule(client, room_id, .2,
+                            lambda: send_text_to_room(client, room_id, message, notice, markdown_convert))
@@ -66,6 +66,49 @@ class Config(object):
 
         self.command_prefix = self._get_cfg(["command_prefix"], default="!c ")
 
+        # Event dispatching setup
+        self.dispatch_max_concurrency = self._get_cfg(["dispatch", "max_concurrency"], default=16)
+        self.dispatch_plugin_concurrency = self._get_cfg(["dispatch", "plugin_concurrency"], default=4)
+        self.dispatch_plugin_limits = self._get_cfg(["dispatch", "plugin_limits"], default={})
+        self.dispatch_hook_timeout = self._get_cfg(["dispatch", "hook_timeout"], default=10)
+        self.dispatch_shutdown_timeout = self._get_cfg(["dispatch", "shutdown_timeout"], default=10)
+
+        # Process pool for CPU-heavy commands
+        self.process_pool_max_workers = self._get_cfg(["process_pool", "max_workers"], default=2)
+        self.process_pool_cpu_budget = self._get_cfg(["process_pool", "cpu_budget"], default=5)
+        self.thread_pool_max_workers = self._get_cfg(["thread_pool", "max_workers"], default=4)
+
+        # Outbound message setup
+        self.send_rate = self._get_cfg(["send_queue", "rate"], default=1)
+        self.send_burst = self._get_cfg(["send_queue", "burst"], default=5)
+        self.send_coalesce_notices = self._get_cfg(["send_queue", "coalesce_notices"], default=0)
+        self.send_max_retries = self._get_cfg(["send_queue", "max_retries"], default=3)
+
+        # Shared HTTP client setup
+        self.http_timeout = self._get_cfg(["http", "timeout"], default=10)
+        self.http_connect_timeout = self._get_cfg(["http", "connect_timeout"], default=5)
+        self.http_retries = self._get_cfg(["http", "retries"], default=2)
+        self.http_max_connections = self._get_cfg(["http", "max_connections"], default=100)
+        self.http_max_connections_per_host = self._get_cfg(["http", "max_connections_per_host"], default=10)
+
+        # Plugin loading setup
+        self.plugins_lazy_loading = self._get_cfg(["plugins", "lazy_loading"], default=False)
+        self.plugins_manifest_filepath = self._get_cfg(["plugins", "manifest_filepath"], default="plugins/manifest.yaml")
+        self.plugins_watch = self._get_cfg(["plugins", "watch"], default=False)
+        self.plugins_watch_interval = self._get_cfg(["plugins", "watch_interval"], default=5)
+
+        # Plugin data setup
+        self.plugin_data_backend = self._get_cfg(["plugin_data", "backend"], default="sqlite")
+        if self.plugin_data_backend not in ["sqlite", "pickle", "journal"]:
+            raise ConfigError("plugin_data.backend must be one of sqlite, pickle or journal")
+        self.plugin_data_backend_overrides = self._get_cfg(["plugin_data", "plugin_backends"], default={})
+        self.plugin_data_write_behind = self._get_cfg(["plugin_data", "write_behind"], default=2)
+
+        # Metrics setup
+        self.metrics_enabled = self._get_cfg(["metrics", "enabled"], default=False)
+        self.metrics_host = self._get_cfg(["metrics", "host"], default="127.0.0.1")
+        self.metrics_port = self._get_cfg(["metrics", "port"], default=9090)
+
     def _get_cfg(
             self,
             path: List[str],
@@ -86,8 +129,8 @@ class Config(object):
 
             # If at any point we don't get our expected option...
             if config is None:
-                # Raise an error if it was required
-                if required or not default:
+                # Raise an error if it was required and there is no default
+                if required and default is None:
                     raise ConfigError(f"Config option {'.'.join(path)} is required")
 
                 # or return the default value
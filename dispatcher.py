@@ -0,0 +1,203 @@
+"""
+    Schedules processing of received events: sequential per room, concurrent across rooms
+
+"""
+
+import asyncio
+from collections import deque
+from time import monotonic
+from typing import Awaitable, Callable, Deque, Dict, List, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Dispatcher:
+
+    def __init__(self, max_concurrency: int = 16, plugin_concurrency: int = 4, plugin_limits: Dict[str, int] = None):
+        """
+        One queue and worker per room, so events of a room are processed in order while rooms don't wait for each other
+        :param max_concurrency: maximum number of events being processed at the same time (across all rooms)
+        :param plugin_concurrency: maximum number of concurrently running commands or hooks of a single plugin
+        :param plugin_limits: per-plugin overrides of plugin_concurrency, {plugin_name: limit}
+        """
+
+        self.max_concurrency: int = max_concurrency
+        self.plugin_concurrency: int = plugin_concurrency
+        self.plugin_limits: Dict[str, int] = plugin_limits or {}
+
+        self.__queues: Dict[str, asyncio.Queue] = {}
+        self.__workers: Dict[str, asyncio.Task] = {}
+        self.__global_slots: asyncio.Semaphore or None = None
+        self.__plugin_slots: Dict[str, asyncio.Semaphore] = {}
+        self.closed: bool = False
+
+        self.__sequence: int = 0
+        self.__unprocessed: Dict[int, None] = {}
+        """sequence numbers of all queued and running jobs, in the order they were submitted"""
+        self.__processed_callbacks: Deque[Tuple[int, Callable[[], None]]] = deque()
+        """callbacks waiting for all jobs up to a sequence number, see call_when_processed()"""
+
+        self.submitted: int = 0
+        self.completed: int = 0
+        self.failed: int = 0
+        self.dropped: int = 0
+        self.in_flight: int = 0
+        self.max_queue_depth: int = 0
+        self.queue_wait_total: float = 0.0
+
+    def submit(self, room_id: str, job: Callable[[], Awaitable]):
+        """
+        Queue a job for processing in a room, start the room's worker if it's not running yet
+        :param room_id: the room the job belongs to
+        :param job: a callable returning an awaitable, e.g. Command.process
+        :return:
+        """
+
+        if self.closed:
+            self.dropped += 1
+            logger.debug(f"Dispatcher closed, dropping event in {room_id}")
+            return
+
+        if room_id not in self.__queues:
+            self.__queues[room_id] = asyncio.Queue()
+
+        queue: asyncio.Queue = self.__queues[room_id]
+        self.__sequence += 1
+        self.__unprocessed[self.__sequence] = None
+        queue.put_nowait((self.__sequence, monotonic(), job))
+        self.submitted += 1
+        if queue.qsize() > self.max_queue_depth:
+            self.max_queue_depth = queue.qsize()
+
+        if room_id not in self.__workers:
+            self.__workers[room_id] = asyncio.ensure_future(self.__work(room_id, queue))
+
+    async def __work(self, room_id: str, queue: asyncio.Queue):
+        """
+        Process all jobs queued for a room, one after another. The worker ends as soon as the queue is empty.
+        :param room_id: the room to process jobs for
+        :param queue: the room's queue
+        :return:
+        """
+
+        if self.__global_slots is None:
+            self.__global_slots = asyncio.Semaphore(self.max_concurrency)
+
+        try:
+            while not queue.empty():
+                sequence: int
+                queued_at: float
+                job: Callable[[], Awaitable]
+                sequence, queued_at, job = queue.get_nowait()
+
+                async with self.__global_slots:
+                    self.queue_wait_total += monotonic() - queued_at
+                    self.in_flight += 1
+                    try:
+                        await job()
+                        self.completed += 1
+                    except Exception as err:
+                        self.failed += 1
+                        logger.critical(f"Failed to process event in {room_id}: {err}")
+                    finally:
+                        self.in_flight -= 1
+                        queue.task_done()
+                    # not reached by jobs cancelled on close(), so they stay unprocessed
+                    del self.__unprocessed[sequence]
+                    self.__run_processed_callbacks()
+        finally:
+            # no await between the final empty()-check and removal, so submit() can not miss a finished worker
+            del self.__workers[room_id]
+            if queue.empty():
+                del self.__queues[room_id]
+
+    def call_when_processed(self, callback: Callable[[], None]):
+        """
+        Call a function once all jobs submitted so far have been processed (or failed), e.g. to store the sync token
+        of a sync response once all of its events have been handled. Jobs dropped on close() are never processed.
+        :param callback: function without arguments, called immediately if there are no unprocessed jobs
+        :return:
+        """
+
+        self.__processed_callbacks.append((self.__sequence, callback))
+        self.__run_processed_callbacks()
+
+    def __run_processed_callbacks(self):
+
+        oldest_unprocessed: int = next(iter(self.__unprocessed), self.__sequence + 1)
+        while self.__processed_callbacks and self.__processed_callbacks[0][0] < oldest_unprocessed:
+            try:
+                self.__processed_callbacks.popleft()[1]()
+            except Exception as err:
+                logger.critical(f"Failed to run callback after processing events: {err}")
+
+    def plugin_slot(self, plugin_name: str) -> asyncio.Semaphore:
+        """
+        Get the semaphore limiting concurrent executions of a plugin's commands and hooks
+        :param plugin_name: name of the plugin
+        :return: the plugin's semaphore, to be used as `async with dispatcher.plugin_slot(name):`
+        """
+
+        try:
+            return self.__plugin_slots[plugin_name]
+        except KeyError:
+            slot = asyncio.Semaphore(self.plugin_limits.get(plugin_name, self.plugin_concurrency))
+            self.__plugin_slots[plugin_name] = slot
+            return slot
+
+    async def join(self):
+        """
+        Wait until all currently queued jobs have been processed
+        :return:
+        """
+
+        while self.__workers:
+            await asyncio.gather(*self.__workers.values(), return_exceptions=True)
+
+    async def close(self, timeout: float = 10):
+        """
+        Stop accepting jobs and wait until the queued jobs have been processed, e.g. before shutting down
+        Jobs still queued or running after timeout seconds are cancelled
+        :param timeout: seconds to wait for the queued jobs
+        :return:
+        """
+
+        self.closed = True
+        deadline: float = monotonic() + timeout
+        while self.__workers and deadline > monotonic():
+            await asyncio.wait(list(self.__workers.values()), timeout=deadline - monotonic())
+
+        if self.__workers:
+            dropped: int = sum(self.get_queue_depths().values()) + self.in_flight
+            self.dropped += dropped
+            logger.warning(f"Cancelling {dropped} events not processed within {timeout}s")
+            workers: List[asyncio.Task] = list(self.__workers.values())
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self.__queues.clear()
+
+    def get_queue_depths(self) -> Dict[str, int]:
+        """
+        :return: number of queued jobs for each room with a running worker
+        """
+
+        return {room_id: queue.qsize() for room_id, queue in self.__queues.items()}
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        :return: queue and processing statistics
+        """
+
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "in_flight": self.in_flight,
+            "queued": sum(self.get_queue_depths().values()),
+            "active_rooms": len(self.__workers),
+            "max_queue_depth": self.max_queue_depth,
+            "queue_wait_total": self.queue_wait_total,
+        }
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+    Minimal stand-in for a Matrix homeserver to load test the bot end-to-end (main.py, AsyncClient and all plugins)
+    on a single machine: implements login, filters, long-polling /sync, sending, typing, joined_members and relations,
+    injects events at configurable rates and simulates rate limits (429) and dropped connections
+
+    bin/python fake_homeserver.py --port 8008 --rooms 10 --rate 20 --rate-limit 5
+    (point homeserver_url of the bot's config.yaml to http://127.0.0.1:8008, any user_id/password is accepted)
+
+"""
+
+import argparse
+import asyncio
+import json
+import random
+from collections import deque
+from time import monotonic, time
+from typing import Any, Deque, Dict, List, Set, Tuple
+
+from aiohttp import web
+
+from benchmark import DEFAULT_MIX, MixEntry, parse_mix, percentile
+from send_queue import TokenBucket
+
+import logging
+logger = logging.getLogger(__name__)
+
+CLIENT_PATHS: Tuple[str, ...] = ("/_matrix/client/r0", "/_matrix/client/v3", "/_matrix/client/v1", "/_matrix/client/unstable")
+"""prefixes of the client-server API, older versions of matrix-nio use r0, newer ones v3 (and v1 for relations)"""
+
+
+class FakeRoom:
+
+    def __init__(self, room_id: str, name: str, members: Dict[str, str]):
+        """
+        A room the bot has joined
+        :param room_id: the room's id
+        :param name: the room's name
+        :param members: {user_id: display_name} of all joined members, including the bot
+        """
+
+        self.room_id: str = room_id
+        self.name: str = name
+        self.members: Dict[str, str] = members
+        self.pending_commands: Deque[float] = deque()
+        """points in time commands have been injected, which have not been answered yet"""
+
+    def member_event(self, user_id: str) -> Dict[str, Any]:
+
+        return {"type": "m.room.member", "state_key": user_id, "sender": user_id, "event_id": f"$member-{user_id}-{self.room_id}",
+                "origin_server_ts": 0, "content": {"membership": "join", "displayname": self.members[user_id]}}
+
+    def state_events(self, bot_user_id: str) -> List[Dict[str, Any]]:
+        """
+        :return: the room's state as sent on initial syncs, only including the bot's membership (lazy loading members)
+        """
+
+        return [
+            {"type": "m.room.create", "state_key": "", "sender": bot_user_id, "event_id": f"$create-{self.room_id}",
+             "origin_server_ts": 0, "content": {"creator": bot_user_id}},
+            {"type": "m.room.name", "state_key": "", "sender": bot_user_id, "event_id": f"$name-{self.room_id}",
+             "origin_server_ts": 0, "content": {"name": self.name}},
+            self.member_event(bot_user_id),
+        ]
+
+
+class FakeHomeserver:
+
+    def __init__(self, user_id: str = "@bot:localhost", password: str or None = None, rooms: int = 10, members: int = 20):
+        """
+        Keeps all events in memory, in a single stream shared by all rooms
+        :param user_id: the bot's user id, returned on login when the client does not log in with a full user id
+        :param password: the accepted password, None to accept any
+        :param rooms: number of rooms the bot is in
+        :param members: number of members of each room besides the bot
+        """
+
+        self.user_id: str = user_id
+        self.password: str or None = password
+        self.access_tokens: Set[str] = set()
+
+        self.rooms: Dict[str, FakeRoom] = {}
+        for number in range(rooms):
+            room_id: str = f"!room{number}:localhost"
+            room_members: Dict[str, str] = {user_id: "bot"}
+            room_members.update({f"@user{member}:localhost": f"User {member}" for member in range(members)})
+            self.rooms[room_id] = FakeRoom(room_id, f"Room {number}", room_members)
+
+        self.stream: List[Tuple[str, Dict[str, Any]]] = []
+        """all timeline events as (room_id, event), the position in this list is the sync token"""
+        self.relations: Dict[str, List[Dict[str, Any]]] = {}
+        """events relating to an event, by the id of the related event"""
+        self.filters: Dict[str, Dict[str, Any]] = {}
+        self.__new_events: asyncio.Event or None = None
+        self.__syncs: Set[asyncio.Transport] = set()
+        """connections of the sync requests currently waiting for events"""
+
+        self.rate_limit: TokenBucket or None = None
+        self.rate_limit_probability: float = 0
+        self.retry_after_ms: int = 1000
+
+        self.stats: Dict[str, int] = {"logins": 0, "syncs": 0, "sends": 0, "rate_limited": 0, "typing": 0,
+                                      "joined_members": 0, "relations": 0, "injected": 0, "disconnects": 0}
+        self.reply_latencies: Deque[float] = deque(maxlen=10000)
+        """seconds from injecting a command to the bot's next message in the room"""
+
+    def set_rate_limit(self, rate: float = 0, burst: int = 10, probability: float = 0, retry_after_ms: int = 1000):
+        """
+        Reject sent messages with M_LIMIT_EXCEEDED
+        :param rate: messages per second accepted from the bot, 0 for no limit
+        :param burst: messages accepted at once before the rate applies
+        :param probability: probability of rejecting any message regardless of the rate, 0..1
+        :param retry_after_ms: retry_after_ms sent with each rejection
+        :return:
+        """
+
+        self.rate_limit = TokenBucket(rate, burst) if rate > 0 else None
+        self.rate_limit_probability = probability
+        self.retry_after_ms = retry_after_ms
+
+    def publish(self, room_id: str, event: Dict[str, Any]) -> str:
+        """
+        Add an event to a room's timeline and wake up waiting syncs
+        :param room_id: the room
+        :param event: the event, event_id and origin_server_ts are added if missing
+        :return: the event's id
+        """
+
+        event.setdefault("event_id", f"$fake{len(self.stream)}")
+        event.setdefault("origin_server_ts", int(time() * 1000))
+        self.stream.append((room_id, event))
+
+        relates_to: Dict[str, Any] = event.get("content", {}).get("m.relates_to", {})
+        if "event_id" in relates_to:
+            self.relations.setdefault(relates_to["event_id"], []).append(event)
+
+        if self.__new_events is not None:
+            self.__new_events.set()
+            self.__new_events = None
+        return event["event_id"]
+
+    def inject_message(self, room_id: str, sender: str, body: str, command_prefix: str = "!") -> str:
+        """
+        Inject a text message sent by a member of a room
+        :return: the event's id
+        """
+
+        self.stats["injected"] += 1
+        if body.startswith(command_prefix):
+            self.rooms[room_id].pending_commands.append(monotonic())
+        return self.publish(room_id, {"type": "m.room.message", "sender": sender, "content": {"msgtype": "m.text", "body": body}})
+
+    def inject_reaction(self, room_id: str, sender: str, event_id: str, key: str = "👍") -> str:
+        """
+        Inject a reaction to an event
+        :return: the reaction's id
+        """
+
+        self.stats["injected"] += 1
+        return self.publish(room_id, {"type": "m.reaction", "sender": sender, "content": {
+            "m.relates_to": {"rel_type": "m.annotation", "event_id": event_id, "key": key}}})
+
+    async def inject_load(self, rate: float, count: int or None = None, mix: str = DEFAULT_MIX, command_prefix: str = "!",
+                          seed: int = 0):
+        """
+        Inject messages and reactions into random rooms
+        :param rate: events per second
+        :param count: number of events, None to inject until cancelled
+        :param mix: kinds and relative frequencies of events, see benchmark.parse_mix
+        :param command_prefix: prefix of injected commands
+        :param seed: random seed
+        :return:
+        """
+
+        entries: List[MixEntry] = parse_mix(mix)
+        weights: List[float] = [entry.weight for entry in entries]
+        generator: random.Random = random.Random(seed)
+        last_message: Dict[str, str] = {}
+        start: float = monotonic()
+        number: int = 0
+
+        while count is None or number < count:
+            await asyncio.sleep(max(0.0, start + number / rate - monotonic()))
+            room: FakeRoom = generator.choice(list(self.rooms.values()))
+            sender: str = generator.choice([user_id for user_id in room.members if user_id != self.user_id] or [self.user_id])
+            entry: MixEntry = generator.choices(entries, weights)[0]
+
+            if entry.text == "reaction":
+                if room.room_id in last_message:
+                    self.inject_reaction(room.room_id, sender, last_message[room.room_id])
+            else:
+                body: str = f"just chatting {number}" if entry.text == "message" else command_prefix + entry.text
+                last_message[room.room_id] = self.inject_message(room.room_id, sender, body, command_prefix)
+            number += 1
+
+    async def disconnect_periodically(self, interval: float):
+        """
+        Drop all waiting syncs every interval seconds
+        :param interval: seconds between disconnects
+        :return:
+        """
+
+        while True:
+            await asyncio.sleep(interval)
+            self.disconnect()
+
+    def disconnect(self) -> int:
+        """
+        Drop the connections of all waiting syncs without a response (the client sees a ServerDisconnectedError)
+        :return: number of dropped connections
+        """
+
+        dropped: int = len(self.__syncs)
+        for transport in list(self.__syncs):
+            transport.close()
+        self.stats["disconnects"] += dropped
+        return dropped
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        :return: request counts and the latency of replies to injected commands
+        """
+
+        latencies: List[float] = list(self.reply_latencies)
+        return dict(self.stats, events=len(self.stream), waiting_syncs=len(self.__syncs),
+                    reply_p50_ms=percentile(latencies, .5) * 1000, reply_p99_ms=percentile(latencies, .99) * 1000)
+
+    # client-server API
+
+    @staticmethod
+    def error(status: int, errcode: str, message: str, **fields) -> web.Response:
+
+        return web.json_response(dict(errcode=errcode, error=message, **fields), status=status)
+
+    def authorized(self, request: web.Request) -> bool:
+
+        token: str = request.headers.get("Authorization", "").replace("Bearer ", "") or request.query.get("access_token", "")
+        return token in self.access_tokens
+
+    async def handle_login(self, request: web.Request) -> web.Response:
+
+        body: Dict[str, Any] = await request.json()
+        if self.password is not None and body.get("password") != self.password:
+            return self.error(403, "M_FORBIDDEN", "Invalid password")
+
+        user: str = body.get("identifier", {}).get("user") or body.get("user") or self.user_id
+        if user.startswith("@") and user != self.user_id:
+            # the rooms are set up for the configured user
+            return self.error(403, "M_FORBIDDEN", f"Only {self.user_id} can log in")
+
+        self.stats["logins"] += 1
+        access_token: str = f"token{len(self.access_tokens)}"
+        self.access_tokens.add(access_token)
+        return web.json_response({"user_id": self.user_id, "access_token": access_token,
+                                  "device_id": body.get("device_id") or "FAKEDEVICE"})
+
+    async def handle_filter(self, request: web.Request) -> web.Response:
+
+        filter_id: str = str(len(self.filters))
+        self.filters[filter_id] = await request.json()
+        return web.json_response({"filter_id": filter_id})
+
+    async def handle_sync(self, request: web.Request) -> web.Response:
+
+        if not self.authorized(request):
+            return self.error(401, "M_UNKNOWN_TOKEN", "Unknown access token")
+
+        self.stats["syncs"] += 1
+        since: int or None = int(request.query["since"]) if request.query.get("since", "").isdigit() else None
+        full_state: bool = since is None or request.query.get("full_state") == "true"
+        timeout: float = int(request.query.get("timeout", 0)) / 1000
+
+        if since is not None and since >= len(self.stream) and timeout > 0 and not full_state:
+            # long polling: wait for new events or the timeout
+            if self.__new_events is None:
+                self.__new_events = asyncio.Event()
+            transport: asyncio.Transport = request.transport
+            self.__syncs.add(transport)
+            try:
+                await asyncio.wait_for(self.__new_events.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.__syncs.discard(transport)
+
+        position: int = len(self.stream)
+        timelines: Dict[str, List[Dict[str, Any]]] = {room_id: [] for room_id in self.rooms} if full_state else {}
+        for room_id, event in self.stream[position if since is None else since:position]:
+            timelines.setdefault(room_id, []).append(event)
+
+        join: Dict[str, Any] = {}
+        for room_id, events in timelines.items():
+            room: FakeRoom = self.rooms[room_id]
+            # lazy loading members: only the senders of the timeline's events are included in the state
+            state: List[Dict[str, Any]] = room.state_events(self.user_id) if full_state else []
+            state.extend(room.member_event(sender) for sender in {event["sender"] for event in events}
+                         if sender in room.members and sender != self.user_id)
+            join[room_id] = {
+                "timeline": {"events": events, "limited": False, "prev_batch": str(since or 0)},
+                "state": {"events": state},
+                "ephemeral": {"events": []},
+                "account_data": {"events": []},
+                "summary": {"m.joined_member_count": len(room.members), "m.invited_member_count": 0},
+                "unread_notifications": {"highlight_count": 0, "notification_count": 0},
+            }
+
+        return web.json_response({
+            "next_batch": str(position),
+            "rooms": {"join": join, "invite": {}, "leave": {}},
+            "presence": {"events": []},
+            "account_data": {"events": []},
+            "to_device": {"events": []},
+            "device_lists": {"changed": [], "left": []},
+            "device_one_time_keys_count": {},
+        })
+
+    async def handle_send(self, request: web.Request) -> web.Response:
+
+        if not self.authorized(request):
+            return self.error(401, "M_UNKNOWN_TOKEN", "Unknown access token")
+
+        room: FakeRoom or None = self.rooms.get(request.match_info["room_id"])
+        if room is None:
+            return self.error(403, "M_FORBIDDEN", "Not a member of this room")
+
+        if (self.rate_limit is not None and self.rate_limit.take() > 0) or random.random() < self.rate_limit_probability:
+            self.stats["rate_limited"] += 1
+            return self.error(429, "M_LIMIT_EXCEEDED", "Too many requests", retry_after_ms=self.retry_after_ms)
+
+        self.stats["sends"] += 1
+        if room.pending_commands:
+            self.reply_latencies.append(monotonic() - room.pending_commands.popleft())
+
+        event_id: str = self.publish(room.room_id, {"type": request.match_info["event_type"], "sender": self.user_id,
+                                                    "content": await request.json(),
+                                                    "unsigned": {"transaction_id": request.match_info["txn_id"]}})
+        return web.json_response({"event_id": event_id})
+
+    async def handle_typing(self, request: web.Request) -> web.Response:
+
+        self.stats["typing"] += 1
+        return web.json_response({})
+
+    async def handle_joined_members(self, request: web.Request) -> web.Response:
+
+        room: FakeRoom or None = self.rooms.get(request.match_info["room_id"])
+        if room is None:
+            return self.error(403, "M_FORBIDDEN", "Not a member of this room")
+
+        self.stats["joined_members"] += 1
+        return web.json_response({"joined": {user_id: {"display_name": display_name, "avatar_url": None}
+                                             for user_id, display_name in room.members.items()}})
+
+    async def handle_relations(self, request: web.Request) -> web.Response:
+
+        self.stats["relations"] += 1
+        events: List[Dict[str, Any]] = self.relations.get(request.match_info["event_id"], [])
+        rel_type: str or None = request.match_info.get("rel_type")
+        event_type: str or None = request.match_info.get("event_type")
+        chunk: List[Dict[str, Any]] = [
+            dict(event, room_id=request.match_info["room_id"]) for event in reversed(events)
+            if (rel_type is None or event["content"]["m.relates_to"].get("rel_type") == rel_type)
+            and (event_type is None or event["type"] == event_type)
+        ]
+        return web.json_response({"chunk": chunk})
+
+    async def handle_join(self, request: web.Request) -> web.Response:
+
+        return web.json_response({"room_id": request.match_info["room_id"]})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+
+        return web.json_response(self.get_stats())
+
+    async def handle_inject(self, request: web.Request) -> web.Response:
+
+        """POST {"room_id", "sender", "body"} or {"room_id", "sender", "reacts_to", "key"}"""
+
+        body: Dict[str, Any] = await request.json()
+        room_id: str = body.get("room_id") or next(iter(self.rooms))
+        sender: str = body.get("sender") or next(user_id for user_id in self.rooms[room_id].members if user_id != self.user_id)
+        if "reacts_to" in body:
+            event_id: str = self.inject_reaction(room_id, sender, body["reacts_to"], body.get("key", "👍"))
+        else:
+            event_id = self.inject_message(room_id, sender, body["body"])
+        return web.json_response({"event_id": event_id})
+
+    async def handle_disconnect(self, request: web.Request) -> web.Response:
+
+        return web.json_response({"dropped": self.disconnect()})
+
+    async def handle_rate_limit(self, request: web.Request) -> web.Response:
+
+        """POST {"rate", "burst", "probability", "retry_after_ms"}, all optional, {} to disable rate limiting"""
+
+        self.set_rate_limit(**await request.json())
+        return web.json_response({})
+
+    def create_app(self) -> web.Application:
+        """
+        :return: the aiohttp application serving the client-server API and the /_fake control endpoints
+        """
+
+        app: web.Application = web.Application()
+        for prefix in CLIENT_PATHS:
+            app.router.add_post(f"{prefix}/login", self.handle_login)
+            app.router.add_post(f"{prefix}/user/{{user_id}}/filter", self.handle_filter)
+            app.router.add_get(f"{prefix}/sync", self.handle_sync)
+            app.router.add_put(f"{prefix}/rooms/{{room_id}}/send/{{event_type}}/{{txn_id}}", self.handle_send)
+            app.router.add_put(f"{prefix}/rooms/{{room_id}}/typing/{{user_id}}", self.handle_typing)
+            app.router.add_get(f"{prefix}/rooms/{{room_id}}/joined_members", self.handle_joined_members)
+            app.router.add_get(f"{prefix}/rooms/{{room_id}}/relations/{{event_id}}", self.handle_relations)
+            app.router.add_get(f"{prefix}/rooms/{{room_id}}/relations/{{event_id}}/{{rel_type}}", self.handle_relations)
+            app.router.add_get(f"{prefix}/rooms/{{room_id}}/relations/{{event_id}}/{{rel_type}}/{{event_type}}",
+                               self.handle_relations)
+            app.router.add_post(f"{prefix}/join/{{room_id}}", self.handle_join)
+
+        app.router.add_get("/_fake/stats", self.handle_stats)
+        app.router.add_post("/_fake/inject", self.handle_inject)
+        app.router.add_post("/_fake/disconnect", self.handle_disconnect)
+        app.router.add_post("/_fake/rate_limit", self.handle_rate_limit)
+        return app
+
+
+async def main():
+
+    parser = argparse.ArgumentParser(description="Fake homeserver to load test the bot")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8008)
+    parser.add_argument("--user-id", default="@bot:localhost", help="the bot's user id")
+    parser.add_argument("--password", help="accepted password (default: any)")
+    parser.add_argument("--rooms", type=int, default=10, help="number of rooms the bot is in")
+    parser.add_argument("--members", type=int, default=20, help="members of each room besides the bot")
+    parser.add_argument("--rate", type=float, default=0, help="events per second injected, 0 to only inject via /_fake/inject")
+    parser.add_argument("--count", type=int, help="number of events injected (default: until stopped)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"events and their weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--command-prefix", default="!")
+    parser.add_argument("--rate-limit", type=float, default=0, help="messages per second accepted from the bot, 0 for no limit")
+    parser.add_argument("--rate-limit-burst", type=int, default=10)
+    parser.add_argument("--rate-limit-probability", type=float, default=0, help="probability of rejecting any message")
+    parser.add_argument("--retry-after", type=int, default=1000, help="retry_after_ms of rejected messages")
+    parser.add_argument("--disconnect-every", type=float, default=0, help="drop waiting syncs every n seconds, 0 to never")
+    parser.add_argument("--stats-every", type=float, default=10, help="print statistics every n seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    homeserver: FakeHomeserver = FakeHomeserver(args.user_id, args.password, args.rooms, args.members)
+    homeserver.set_rate_limit(args.rate_limit, args.rate_limit_burst, args.rate_limit_probability, args.retry_after)
+
+    runner: web.AppRunner = web.AppRunner(homeserver.create_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    logger.info(f"Fake homeserver listening on http://{args.host}:{args.port}, bot user {args.user_id}")
+
+    tasks: List[asyncio.Task] = []
+    if args.rate > 0:
+        tasks.append(asyncio.ensure_future(homeserver.inject_load(args.rate, args.count, args.mix, args.command_prefix)))
+    if args.disconnect_every > 0:
+        tasks.append(asyncio.ensure_future(homeserver.disconnect_periodically(args.disconnect_every)))
+
+    try:
+        while True:
+            await asyncio.sleep(args.stats_every)
+            logger.info(json.dumps(homeserver.get_stats()))
+    finally:
+        for task in tasks:
+            task.cancel()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.get_event_loop().run_until_complete(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,326 @@
+"""
+    Helpers for fuzzy matching of command names (and other short strings)
+
+"""
+
+from collections import Counter, OrderedDict, defaultdict
+from functools import lru_cache
+from typing import Any, Dict, Hashable, Iterable, List, Tuple
+
+from fuzzywuzzy import fuzz
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def ratio_upper_bound(length_a: int, length_b: int, overlap: int) -> int:
+    """
+    Calculate the highest value fuzz.ratio() could possibly return for two strings
+    :param length_a: length of the first string
+    :param length_b: length of the second string
+    :param overlap: number of characters both strings have in common (counting duplicates)
+    :return: upper bound for fuzz.ratio(), rounded the same way fuzz.ratio() rounds its result
+    """
+
+    if length_a + length_b == 0:
+        # fuzz.ratio() considers two empty strings identical
+        return 100
+
+    # fuzz.ratio() is 2*M/T, where M (matching characters) can never exceed the character overlap
+    return int(round(200 * overlap / (length_a + length_b)))
+
+
+def bigrams(string: str) -> Counter:
+    """
+    Count the pairs of adjacent characters of a string
+    :param string: the string
+    :return: Counter of all bigrams, empty for strings shorter than two characters
+    """
+
+    return Counter(string[i:i + 2] for i in range(len(string) - 1))
+
+
+@lru_cache(maxsize=4096)
+def min_shared_bigrams(length_a: int, length_b: int, min_ratio: int) -> int or None:
+    """
+    Calculate how many bigrams (counting duplicates) two strings share at least if fuzz.ratio() reaches min_ratio
+    The M matching characters form a common subsequence of both strings. Its M - 1 bigrams are bigrams of both
+    strings, except for those split by the characters one of the strings has in between, and every such gap
+    splits one bigram
+    :param length_a: length of the first string
+    :param length_b: length of the second string
+    :param min_ratio: lowest fuzz.ratio() still accepted
+    :return:    the number of bigrams both strings have in common at least, 0 if they need not share any
+                None, if strings of these lengths can't reach min_ratio at all
+    """
+
+    required: int or None = None
+    for matches in range(min(length_a, length_b) + 1):
+        if ratio_upper_bound(length_a, length_b, matches) < min_ratio:
+            continue
+        gaps: int = min(length_a - matches, matches - 1) + min(length_b - matches, matches - 1)
+        shared: int = max(matches - 1 - max(gaps, 0), 0)
+        required = shared if required is None else min(required, shared)
+    return required
+
+
+def _character_overlap(counts_a: Dict[str, int], counts_b: Dict[str, int]) -> int:
+    """
+    :return: number of characters two strings have in common (counting duplicates), given their character counts
+    """
+
+    overlap: int = 0
+    for char, count in counts_a.items():
+        count_b: int = counts_b.get(char, 0)
+        overlap += count if count < count_b else count_b
+    return overlap
+
+
+def _bigram_candidates(postings: Dict[str, List[Tuple[Hashable, int, int]]], lengths: Dict[int, List[Hashable]],
+                       name: str, min_ratio: int) -> List[Hashable]:
+    """
+    Select the indexed strings able to reach min_ratio with name: those sharing enough bigrams with name, and all
+    strings of lengths that need not share any
+    :param postings: bigram -> list of (key of a string, length of the string, occurrences of the bigram in the string)
+    :param lengths: length -> keys of all strings of that length
+    :param name: the string to match
+    :param min_ratio: lowest fuzz.ratio() still accepted
+    :return: keys of the candidate strings, in no particular order
+    """
+
+    name_length: int = len(name)
+    required: Dict[int, int or None] = {length: min_shared_bigrams(name_length, length, min_ratio) for length in lengths}
+
+    candidates: List[Hashable] = []
+    for length, keys in lengths.items():
+        if required[length] == 0:
+            candidates.extend(keys)
+
+    overlaps: Dict[Tuple[Hashable, int], int] = defaultdict(int)
+    for gram, count in bigrams(name).items():
+        for key, length, key_count in postings.get(gram, ()):
+            if required[length]:
+                overlaps[(key, length)] += min(count, key_count)
+
+    for (key, length), overlap in overlaps.items():
+        if overlap >= required[length]:
+            candidates.append(key)
+
+    return candidates
+
+
+class CommandIndex:
+
+    def __init__(self, commands: Iterable[str], threshold: int = 60, cache_size: int = 512):
+        """
+        Resolution index for command names, built once and queried for every received command
+        :param commands: all registered command names, in order of registration
+        :param threshold: fuzz.ratio() a command needs to exceed to be considered a match
+        :param cache_size: number of resolved (mis-)spellings to keep
+        """
+
+        self.threshold: int = threshold
+        self.cache_size: int = cache_size
+
+        self.__exact: Dict[str, str] = {}
+        """exact command names"""
+
+        self.__order: Dict[str, int] = {}
+        """position of each command in order of registration, used to break ties between equal ratios"""
+
+        self.__postings: Dict[str, List[Tuple[str, int, int]]] = defaultdict(list)
+        """bigram -> list of (command, length of command, number of occurrences of the bigram in command)"""
+
+        self.__lengths: Dict[int, List[str]] = defaultdict(list)
+        """length -> commands of that length"""
+
+        self.__characters: Dict[str, Counter] = {}
+        """command -> number of occurrences of each of its characters"""
+
+        self.__cache: OrderedDict = OrderedDict()
+        """LRU of already resolved names -> command (or None, if nothing matched)"""
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+        self.rebuild(commands)
+
+    def rebuild(self, commands: Iterable[str]):
+        """
+        (Re-)build the index from scratch, e.g. after the set of registered commands changed
+        :param commands: all registered command names, in order of registration
+        :return:
+        """
+
+        self.__exact.clear()
+        self.__order.clear()
+        self.__postings.clear()
+        self.__lengths.clear()
+        self.__characters.clear()
+        self.__cache.clear()
+
+        command: str
+        for command in commands:
+            if command in self.__exact:
+                continue
+            self.__exact[command] = command
+            self.__order[command] = len(self.__order)
+            self.__lengths[len(command)].append(command)
+            self.__characters[command] = Counter(command)
+            for gram, count in bigrams(command).items():
+                self.__postings[gram].append((command, len(command), count))
+
+    def resolve(self, name: str) -> str or None:
+        """
+        Find the registered command matching name, either exactly or by fuzzy matching
+        :param name: the (possibly misspelled) command name
+        :return:    the name of the matching command
+                    None, if no command matches closely enough
+        """
+
+        if name in self.__exact:
+            return name
+
+        if name in self.__cache:
+            self.hits += 1
+            self.__cache.move_to_end(name)
+            return self.__cache[name]
+
+        self.misses += 1
+        resolved: str or None = self.__resolve_fuzzy(name)
+
+        self.__cache[name] = resolved
+        if len(self.__cache) > self.cache_size:
+            self.__cache.popitem(last=False)
+
+        return resolved
+
+    def __resolve_fuzzy(self, name: str) -> str or None:
+        """
+        Find the best fuzzy match for name, only calculating fuzz.ratio() for commands able to exceed the threshold
+        :param name: the command name to resolve
+        :return:    the command with the highest ratio, earliest registered command on ties
+                    None, if no command exceeds the threshold
+        """
+
+        if name == "":
+            return None
+
+        name_length: int = len(name)
+        name_counts: Dict[str, int] = Counter(name)
+
+        best_command: str or None = None
+        best_ratio: int = self.threshold
+        for command in _bigram_candidates(self.__postings, self.__lengths, name, self.threshold + 1):
+            overlap: int = _character_overlap(name_counts, self.__characters[command])
+            if ratio_upper_bound(name_length, len(command), overlap) < best_ratio:
+                continue
+
+            ratio: int = fuzz.ratio(name, command)
+            if ratio > best_ratio or (ratio == best_ratio and best_command is not None
+                                      and self.__order[command] < self.__order[best_command]):
+                best_command = command
+                best_ratio = ratio
+
+        return best_command
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return: number of indexed commands and cache statistics
+        """
+
+        return {"commands": len(self.__exact), "cache_size": len(self.__cache), "cache_hits": self.hits, "cache_misses": self.misses}
+
+
+class NameIndex:
+
+    def __init__(self, entries: List[Tuple[str, Any]], memo_size: int = 1024):
+        """
+        Index of normalized (lowercased) names for matching many, possibly misspelled, names against them
+        :param entries: (name, value) pairs, e.g. (displayname, RoomMember), in a stable order
+        :param memo_size: number of matched names to remember
+        """
+
+        self.memo_size: int = memo_size
+
+        self.__names: List[str] = [name.lower() for name, _ in entries]
+        self.__values: List[Any] = [value for _, value in entries]
+
+        self.__postings: Dict[str, List[Tuple[int, int, int]]] = defaultdict(list)
+        """bigram -> list of (position of the name, length of the name, number of occurrences of the bigram in the name)"""
+
+        self.__lengths: Dict[int, List[int]] = defaultdict(list)
+        """length -> positions of the names of that length"""
+
+        self.__characters: List[Counter] = [Counter(name) for name in self.__names]
+        """number of occurrences of each character of each name"""
+
+        for position, name in enumerate(self.__names):
+            self.__lengths[len(name)].append(position)
+            for gram, count in bigrams(name).items():
+                self.__postings[gram].append((position, len(name), count))
+
+        self.__memo: Dict[Tuple[str, int], Any] = {}
+        """(normalized name, threshold) -> best matching value (or None)"""
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def best_match(self, name: str, threshold: int) -> Any or None:
+        """
+        Find the value whose name has the highest fuzz.ratio() with name
+        :param name: the name to match, compared case-insensitively
+        :param threshold: fuzz.ratio() a name needs to reach to be considered a match
+        :return:    the value of the best matching name, the last one in order on ties
+                    None, if no name reaches the threshold
+        """
+
+        normalized: str = name.lower()
+        key: Tuple[str, int] = (normalized, threshold)
+        if key in self.__memo:
+            self.hits += 1
+            return self.__memo[key]
+
+        self.misses += 1
+        if len(self.__memo) >= self.memo_size:
+            self.__memo.clear()
+        self.__memo[key] = match = self.__match(normalized, threshold)
+        return match
+
+    def best_matches(self, names: Iterable[str], threshold: int) -> Dict[str, Any]:
+        """
+        Match a batch of names, each distinct name is only matched once
+        :param names: the names to match
+        :param threshold: fuzz.ratio() a name needs to reach to be considered a match
+        :return: {name: value of the best matching name or None}
+        """
+
+        return {name: self.best_match(name, threshold) for name in dict.fromkeys(names)}
+
+    def __match(self, name: str, threshold: int) -> Any or None:
+
+        name_length: int = len(name)
+        name_counts: Dict[str, int] = Counter(name)
+
+        best_position: int or None = None
+        best_ratio: int = threshold
+        for position in sorted(_bigram_candidates(self.__postings, self.__lengths, name, threshold)):
+            candidate: str = self.__names[position]
+            overlap: int = _character_overlap(name_counts, self.__characters[position])
+            # later names win ties, so names only able to reach the current best ratio still have to be scored
+            if ratio_upper_bound(name_length, len(candidate), overlap) < best_ratio:
+                continue
+
+            ratio: int = fuzz.ratio(name, candidate)
+            if ratio >= best_ratio:
+                best_position = position
+                best_ratio = ratio
+
+        return self.__values[best_position] if best_position is not None else None
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return: number of indexed names, memo hits and misses
+        """
+
+        return {"names": len(self.__names), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,193 @@
+"""
+    Shared HTTP client for plugins talking to external APIs, without blocking the event loop
+
+"""
+
+import asyncio
+import random
+from json import loads
+from time import monotonic
+from typing import Any, Dict, Tuple
+
+import aiohttp
+from multidict import CIMultiDictProxy
+
+import logging
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS: Tuple[str, ...] = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+"""methods retried after failures, other requests might have been processed already"""
+
+RETRY_STATUSES: Tuple[int, ...] = (429, 500, 502, 503, 504)
+"""statuses of transient failures (rate limits and server errors) worth retrying"""
+
+
+class HttpRequestError(Exception):
+    """Raised when a request failed on all attempts, because of connection errors or timeouts"""
+    pass
+
+
+class HttpResponse:
+
+    def __init__(self, status: int, headers: CIMultiDictProxy, body: bytes, url: str):
+        """
+        A completely read response, the connection has already been returned to the pool
+        :param status: HTTP status code
+        :param headers: response headers
+        :param body: response body
+        :param url: the requested url
+        """
+
+        self.status: int = status
+        self.headers: CIMultiDictProxy = headers
+        self.body: bytes = body
+        self.url: str = url
+
+    @property
+    def ok(self) -> bool:
+
+        return self.status < 400
+
+    def text(self, encoding: str = "utf-8") -> str:
+
+        return self.body.decode(encoding, errors="replace")
+
+    def json(self) -> Any:
+
+        return loads(self.body)
+
+
+class HttpClient:
+
+    def __init__(self, max_connections: int = 100, max_connections_per_host: int = 10, timeout: float = 10,
+                 connect_timeout: float = 5, retries: int = 2, backoff: float = 0.5, keepalive_timeout: float = 30):
+        """
+        A single, lazily created aiohttp session shared by all plugins, keeping connections alive between requests
+        :param max_connections: maximum number of open connections
+        :param max_connections_per_host: maximum number of open connections to a single host
+        :param timeout: default seconds a request (including reading the response) may take
+        :param connect_timeout: seconds to wait for a connection
+        :param retries: default number of retries of idempotent requests after connection errors, timeouts or 429/5xx
+        :param backoff: seconds to wait before the first retry, doubled for every further retry
+        :param keepalive_timeout: seconds idle connections are kept open
+        """
+
+        self.max_connections: int = max_connections
+        self.max_connections_per_host: int = max_connections_per_host
+        self.timeout: float = timeout
+        self.connect_timeout: float = connect_timeout
+        self.retries: int = retries
+        self.backoff: float = backoff
+        self.keepalive_timeout: float = keepalive_timeout
+        self.__session: aiohttp.ClientSession or None = None
+
+        self.requests: int = 0
+        self.retried: int = 0
+        self.failures: int = 0
+        self.request_time_total: float = 0.0
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """
+        The shared session, for plugins needing more than request() offers (e.g. streaming responses)
+        """
+
+        if self.__session is None or self.__session.closed:
+            connector: aiohttp.TCPConnector = aiohttp.TCPConnector(limit=self.max_connections,
+                                                                   limit_per_host=self.max_connections_per_host,
+                                                                   keepalive_timeout=self.keepalive_timeout)
+            self.__session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout),
+                headers={"User-Agent": "nio-smith"},
+            )
+        return self.__session
+
+    async def request(self, method: str, url: str, params: Dict[str, Any] = None, headers: Dict[str, str] = None,
+                      json: Any = None, data: Any = None, timeout: float = None, retries: int = None) -> HttpResponse:
+        """
+        Send a request and read the full response
+        :param method: HTTP method
+        :param url: the url
+        :param params: query parameters
+        :param headers: additional request headers
+        :param json: body to send as json
+        :param data: body to send as is (or form-encoded, if it is a dict)
+        :param timeout: seconds the request may take, overriding the default
+        :param retries: number of retries, overriding the default (only idempotent methods are retried)
+        :return: the response, also for error statuses (after retrying 429 and 5xx responses)
+        :raises HttpRequestError: if there was no response on any attempt
+        """
+
+        attempts: int = 1 + (self.retries if retries is None else retries) if method.upper() in IDEMPOTENT_METHODS else 1
+        request_timeout: aiohttp.ClientTimeout or None = \
+            aiohttp.ClientTimeout(total=timeout, connect=self.connect_timeout) if timeout is not None else None
+
+        attempt: int = 0
+        while True:
+            attempt += 1
+            self.requests += 1
+            start: float = monotonic()
+            retry_after: float or None = None
+            try:
+                kwargs: Dict[str, Any] = {"params": params, "headers": headers, "json": json, "data": data}
+                if request_timeout is not None:
+                    kwargs["timeout"] = request_timeout
+                async with self.session.request(method, url, **kwargs) as response:
+                    body: bytes = await response.read()
+                    result: HttpResponse = HttpResponse(response.status, response.headers, body, str(response.url))
+
+                if result.status not in RETRY_STATUSES or attempt >= attempts:
+                    return result
+                if result.headers.get("Retry-After", "").isdigit():
+                    retry_after = int(result.headers["Retry-After"])
+                logger.debug(f"{method} {url} returned {result.status}, retrying")
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                if attempt >= attempts:
+                    self.failures += 1
+                    raise HttpRequestError(f"{method} {url} failed: {err.__class__.__name__} {err}") from err
+                logger.debug(f"{method} {url} failed ({err.__class__.__name__} {err}), retrying")
+
+            finally:
+                self.request_time_total += monotonic() - start
+
+            self.retried += 1
+            delay: float = self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            await asyncio.sleep(min(retry_after, self.timeout) if retry_after is not None else delay)
+
+    async def get(self, url: str, **kwargs) -> HttpResponse:
+        """
+        Send a GET request, see request()
+        """
+
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> HttpResponse:
+        """
+        Send a POST request (not retried), see request()
+        """
+
+        return await self.request("POST", url, **kwargs)
+
+    async def close(self):
+        """
+        Close all pooled connections
+        :return:
+        """
+
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        :return: number of requests (including retries), retries, requests failed on all attempts and time spent
+        """
+
+        return {"requests": self.requests, "retried": self.retried, "failures": self.failures,
+                "request_time_total": self.request_time_total}
+
+
+http_client: HttpClient = HttpClient()
+"""the client shared by all plugins, configured in main.py"""
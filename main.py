@@ -2,18 +2,34 @@
 
 import logging
 import asyncio
-from time import time
+import json
+import signal
 from asyncio import sleep
+from hashlib import sha256
+from time import monotonic
 
 from nio import (
     AsyncClient,
     AsyncClientConfig,
     RoomMessageText,
     InviteEvent,
-    LocalProtocolError, LoginError, UnknownEvent)
+    RoomMemberEvent,
+    LocalProtocolError, LoginError, UnknownEvent, SyncResponse, UploadFilterResponse)
 from callbacks import Callbacks
+from chat_functions import set_send_queue
 from config import Config
+from dispatcher import Dispatcher
+from http_client import http_client
+from member_cache import member_cache
+from metrics import metrics
+from process_pool import process_pool
+from profiler import profiler
+from rendering import renderer
+from response_cache import response_cache
+from send_queue import SendQueue
+from typing_notifications import typing_manager
 from storage import Storage
+from thread_pool import thread_pool
 from aiohttp.client_exceptions import (
     ServerDisconnectedError,
     ClientConnectionError)
@@ -21,27 +37,35 @@ from aiohttp.client_exceptions import (
 from pluginloader import PluginLoader
 
 logger = logging.getLogger(__name__)
-client: AsyncClient
-plugin_loader: PluginLoader
-timestamp: float = time()
 
 
-async def run_plugins(response):
+async def upload_sync_filter(client: AsyncClient, store: Storage, sync_filter: dict) -> str or dict:
+    """
+    Upload a sync filter once and remember its id
+    :param client: the logged in client
+    :param store: bot storage holding the ids of uploaded filters
+    :param sync_filter: the filter definition
+    :return:    the filter_id, if the filter has been uploaded (now or before)
+                the filter definition itself, if the upload failed
+    """
 
-    global plugin_loader
-    global client
-    global timestamp
+    filter_hash: str = sha256(json.dumps([client.user_id, sync_filter], sort_keys=True).encode()).hexdigest()
+    filter_id: str or None
+    if filter_id := store.get_filter_id(filter_hash):
+        return filter_id
 
-    timestamp = await plugin_loader.run_timers(client, timestamp)
+    response = await client.upload_filter(user_id=client.user_id, **sync_filter)
+    if isinstance(response, UploadFilterResponse):
+        store.set_filter_id(filter_hash, response.filter_id)
+        logger.info(f"Uploaded sync filter {response.filter_id}")
+        return response.filter_id
+    else:
+        logger.warning(f"Could not upload sync filter, sending it with every sync: {response}")
+        return sync_filter
 
 
 async def main():
 
-    # TODO: this really needs to be replaced
-    # probably using https://docs.python.org/3.8/library/functools.html#functools.partial
-    global client
-    global plugin_loader
-
     # Read config file
     config = Config("config.yaml")
 
@@ -49,6 +73,7 @@ async def main():
     store = Storage(config.database_filepath)
 
     # Configuration options for the AsyncClient
+    # (rate limited messages are retried by the SendQueue, not by the client)
     client_config = AsyncClientConfig(
         max_limit_exceeded=0,
         max_timeouts=0,
@@ -65,73 +90,212 @@ async def main():
         config=client_config,
     )
 
+    # Worker processes for CPU-heavy commands, started on first use
+    process_pool.max_workers = config.process_pool_max_workers
+    process_pool.cpu_budget = config.process_pool_cpu_budget
+
+    # Worker threads for blocking plugin code, started on first use
+    thread_pool.max_workers = config.thread_pool_max_workers
+
+    # HTTP client shared by plugins, its session is created on first use
+    http_client.timeout = config.http_timeout
+    http_client.connect_timeout = config.http_connect_timeout
+    http_client.retries = config.http_retries
+    http_client.max_connections = config.http_max_connections
+    http_client.max_connections_per_host = config.http_max_connections_per_host
+
+    # Send all messages through a rate limited queue per room
+    send_queue = SendQueue(
+        rate=config.send_rate,
+        burst=config.send_burst,
+        coalesce_window=config.send_coalesce_notices,
+        max_retries=config.send_max_retries,
+    )
+    set_send_queue(send_queue)
+
+    # Process events sequentially per room, but concurrently across rooms
+    dispatcher = Dispatcher(
+        max_concurrency=config.dispatch_max_concurrency,
+        plugin_concurrency=config.dispatch_plugin_concurrency,
+        plugin_limits=config.dispatch_plugin_limits,
+    )
+
     # instantiate the pluginLoader
-    plugin_loader = PluginLoader()
+    plugin_loader = PluginLoader(
+        dispatcher,
+        hook_timeout=config.dispatch_hook_timeout,
+        lazy_loading=config.plugins_lazy_loading,
+        manifest_filename=config.plugins_manifest_filepath,
+        store=store,
+        data_backend=config.plugin_data_backend,
+        data_backend_overrides=config.plugin_data_backend_overrides,
+        write_behind=config.plugin_data_write_behind,
+    )
+
+    # Export the statistics of all components along with the metrics
+    metrics.add_collector("dispatcher", dispatcher.get_stats)
+    metrics.add_collector("send_queue", send_queue.get_stats)
+    metrics.add_collector("process_pool", process_pool.get_stats)
+    metrics.add_collector("thread_pool", thread_pool.get_stats)
+    metrics.add_collector("http", http_client.get_stats)
+    metrics.add_collector("member_cache", member_cache.get_stats)
+    metrics.add_collector("renderer", renderer.get_stats)
+    metrics.add_collector("response_cache", response_cache.get_stats)
+    metrics.add_collector("typing", typing_manager.get_stats)
+    metrics.add_collector("plugin_data", plugin_loader.get_data_stats)
+    metrics.add_collector("hook", plugin_loader.get_hook_stats)
+    metrics.add_collector("timer", plugin_loader.get_timer_stats)
+    if config.metrics_enabled:
+        await metrics.start_server(config.metrics_host, config.metrics_port)
+
+    # Start the worker processes in the background, so the first CPU-heavy commands don't wait for them
+    asyncio.ensure_future(process_pool.start())
+
+    # Reload plugins when their files are modified
+    if config.plugins_watch:
+        plugin_loader.start_watching(config.plugins_watch_interval)
 
     # Set up event callbacks
-    callbacks = Callbacks(client, store, config, plugin_loader)
+    callbacks = Callbacks(client, store, config, plugin_loader, dispatcher)
     client.add_event_callback(callbacks.message, (RoomMessageText,))
     client.add_event_callback(callbacks.invite, (InviteEvent,))
     client.add_event_callback(callbacks.event_unknown, (UnknownEvent,))
-    client.add_response_callback(run_plugins)
+    client.add_event_callback(callbacks.member, (RoomMemberEvent,))
+    client.add_response_callback(callbacks.sync_members, SyncResponse)
+
+    # Remember the last processed sync to resume from it after reconnects or restarts
+    last_sync: float or None = None
+
+    async def store_sync_token(response: SyncResponse):
+        nonlocal last_sync
+        # the events of this sync have only been queued yet, a restart has to receive them again until they are processed
+        next_batch: str = response.next_batch
+        dispatcher.call_when_processed(lambda: store.set_sync_token(next_batch))
+
+        metrics.syncs.inc()
+        now: float = monotonic()
+        if last_sync is not None:
+            metrics.sync_interval.observe(now - last_sync)
+        last_sync = now
 
-    # Keep trying to reconnect on failure (with some time in-between)
-    error_retries: int = 0
-    while True:
-        try:
-            # Try to login with the configured username/password
+    client.add_response_callback(store_sync_token, SyncResponse)
+
+    # Restart syncing with a new filter when plugins hooking other event types are (re-)loaded or activated
+    sync_filter_changed: asyncio.Event = asyncio.Event()
+    plugin_loader.on_sync_filter_change = sync_filter_changed.set
+
+    # Shut down cleanly on SIGINT/SIGTERM, persisting pending plugin data
+    main_task: asyncio.Task = asyncio.current_task()
+    for signal_number in [signal.SIGINT, signal.SIGTERM]:
+        asyncio.get_event_loop().add_signal_handler(signal_number, main_task.cancel)
+
+    try:
+        # Keep trying to reconnect on failure (with some time in-between)
+        error_retries: int = 0
+        while True:
             try:
-                login_response = await client.login(
-                    password=config.user_password,
-                    device_name=config.device_name,
-                )
-
-                # Check if login failed
-                if type(login_response) == LoginError:
-                    logger.error(f"Failed to login: {login_response.message}, retrying in 15s... ({error_retries})")
-                    # try logging in a few times to work around temporary login errors during homeserver restarts
-                    if error_retries < 3:
-                        error_retries += 1
-                        await sleep(15)
-                        continue
+                # Try to login with the configured username/password
+                try:
+                    login_response = await client.login(
+                        password=config.user_password,
+                        device_name=config.device_name,
+                    )
+
+                    # Check if login failed
+                    if type(login_response) == LoginError:
+                        logger.error(f"Failed to login: {login_response.message}, retrying in 15s... ({error_retries})")
+                        # try logging in a few times to work around temporary login errors during homeserver restarts
+                        if error_retries < 3:
+                            error_retries += 1
+                            await sleep(15)
+                            continue
+                        else:
+                            return False
                     else:
+                        error_retries = 0
+
+                except LocalProtocolError as e:
+                    # There's an edge case here where the user enables encryption but hasn't installed
+                    # the correct C dependencies. In that case, a LocalProtocolError is raised on login.
+                    # Warn the user if these conditions are met.
+                    if config.enable_encryption:
+                        logger.fatal(
+                            "Failed to login and encryption is enabled. Have you installed the correct dependencies? "
+                            "https://github.com/poljar/matrix-nio#installation"
+                        )
                         return False
-                else:
-                    error_retries = 0
-
-            except LocalProtocolError as e:
-                # There's an edge case here where the user enables encryption but hasn't installed
-                # the correct C dependencies. In that case, a LocalProtocolError is raised on login.
-                # Warn the user if these conditions are met.
-                if config.enable_encryption:
-                    logger.fatal(
-                        "Failed to login and encryption is enabled. Have you installed the correct dependencies? "
-                        "https://github.com/poljar/matrix-nio#installation"
-                    )
-                    return False
-                else:
-                    # We don't know why this was raised. Throw it at the user
-                    logger.fatal(f"Error logging in: {e}")
+                    else:
+                        # We don't know why this was raised. Throw it at the user
+                        logger.fatal(f"Error logging in: {e}")
+
+                # Login succeeded!
+
+                # Sync encryption keys with the server
+                # Required for participating in encrypted rooms
+                if client.should_upload_keys:
+                    await client.keys_upload()
+
+                logger.info(f"Logged in as {config.user_id}")
+
+                # Run plugin timers in the background (keeps running across reconnects)
+                plugin_loader.start_timers(client)
+
+                while True:
+                    # Only sync what the loaded plugins actually use
+                    sync_filter_changed.clear()
+                    sync_filter: str or dict = await upload_sync_filter(
+                        client, store, plugin_loader.get_sync_filter(config.enable_encryption))
+
+                    if client.next_batch:
+                        # Reconnect: continue from nio's own sync token, keeping the room state it already knows
+                        sync_task: asyncio.Task = asyncio.ensure_future(
+                            client.sync_forever(timeout=30000, sync_filter=sync_filter))
+                    else:
+                        # (Re-)start: continue from the last processed sync, but fetch the current state of all rooms
+                        # (without their full member lists), as it is not persisted
+                        sync_task = asyncio.ensure_future(
+                            client.sync_forever(timeout=30000, sync_filter=sync_filter, since=store.get_sync_token(), full_state=True))
 
-            # Login succeeded!
+                    filter_task: asyncio.Task = asyncio.ensure_future(sync_filter_changed.wait())
+                    try:
+                        await asyncio.wait([sync_task, filter_task], return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        filter_task.cancel()
+                        if not sync_task.done():
+                            sync_task.cancel()
+                            await asyncio.gather(sync_task, return_exceptions=True)
 
-            # Sync encryption keys with the server
-            # Required for participating in encrypted rooms
-            if client.should_upload_keys:
-                await client.keys_upload()
+                    if not sync_task.cancelled():
+                        # sync_forever only returns by raising (e.g. on connection errors)
+                        sync_task.result()
+                    logger.info("Hooked event types changed, restarting sync with a new filter")
 
-            logger.info(f"Logged in as {config.user_id}")
-            await client.sync_forever(timeout=30000, full_state=True)
+            except (ClientConnectionError, ServerDisconnectedError, AttributeError, asyncio.TimeoutError) as err:
+                logger.debug(err)
+                logger.warning(f"Unable to connect to homeserver, retrying in 15s...")
 
-        except (ClientConnectionError, ServerDisconnectedError, AttributeError, asyncio.TimeoutError) as err:
-            logger.debug(err)
-            logger.warning(f"Unable to connect to homeserver, retrying in 15s...")
+                # Sleep so we don't bombard the server with login requests
+                await sleep(15)
+            finally:
+                # Make sure to close the client connection on disconnect
+                await client.close()
 
-            # Sleep so we don't bombard the server with login requests
-            await sleep(15)
-        finally:
-            # Make sure to close the client connection on disconnect
-            await client.close()
+    finally:
+        logger.info("Shutting down, writing pending plugin data")
+        profiler.stop()
+        await dispatcher.close(config.dispatch_shutdown_timeout)
+        await plugin_loader.stop_timers()
+        await typing_manager.join()
+        await plugin_loader.flush_data()
+        process_pool.shutdown()
+        thread_pool.shutdown()
+        await http_client.close()
+        await metrics.stop_server()
 
 
-asyncio.get_event_loop().run_until_complete(main())
+if __name__ == "__main__":
+    # the guard keeps worker processes of the process pool from starting the bot when they import this module
+    try:
+        asyncio.get_event_loop().run_until_complete(main())
+    except asyncio.CancelledError:
+        pass
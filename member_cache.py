@@ -0,0 +1,133 @@
+"""
+    Local cache of room members, built from the client's room state instead of requesting the member list every time
+
+"""
+
+from fuzzy_matching import NameIndex
+
+from nio import AsyncClient, JoinedMembersResponse, MatrixRoom, RoomMember
+from typing import Dict, Iterable, List
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class MemberCache:
+
+    def __init__(self):
+        """
+        Joined members of each room, indexed by their lowercased displayname
+        A room's entry is built on first use and dropped whenever a membership event is received for the room, be it in
+        the timeline or in the state section of a sync
+        """
+
+        self.__members: Dict[str, List[RoomMember]] = {}
+        self.__names: Dict[str, Dict[str, List[RoomMember]]] = {}
+        self.__name_indexes: Dict[str, NameIndex] = {}
+        """fuzzy matching index (and memo of matched names) of each room, built on first fuzzy lookup"""
+
+        self.hits: int = 0
+        self.builds: int = 0
+        self.requests: int = 0
+
+    def invalidate(self, room_id: str):
+        """
+        Drop the cached members of a room, e.g. after a member joined, left or changed their displayname
+        :param room_id: the room to invalidate
+        :return:
+        """
+
+        self.__members.pop(room_id, None)
+        self.__names.pop(room_id, None)
+        self.__name_indexes.pop(room_id, None)
+
+    async def __build(self, client: AsyncClient, room_id: str):
+
+        """Build a room's entry from the client's room state, requesting the full member list only once per room"""
+
+        room: MatrixRoom or None = client.rooms.get(room_id)
+        if room is None or not room.members_synced:
+            # members are lazy-loaded during sync, the client's room state only knows some of them
+            self.requests += 1
+            response = await client.joined_members(room_id)
+            if not isinstance(response, JoinedMembersResponse):
+                logger.warning(f"Could not fetch members of {room_id}: {response}")
+            room = client.rooms.get(room_id)
+
+        members: List[RoomMember] = []
+        if room is not None:
+            members = [RoomMember(user.user_id, user.display_name or user.user_id, user.avatar_url)
+                       for user_id, user in room.users.items() if user_id not in room.invited_users]
+
+        names: Dict[str, List[RoomMember]] = {}
+        for member in members:
+            names.setdefault(member.display_name.lower(), []).append(member)
+
+        self.builds += 1
+        self.__members[room_id] = members
+        self.__names[room_id] = names
+
+    async def get_members(self, client: AsyncClient, room_id: str) -> List[RoomMember]:
+        """
+        Get the joined members of a room
+        :param client: the client holding the room state
+        :param room_id: the room
+        :return: all joined members of the room
+        """
+
+        if room_id in self.__members:
+            self.hits += 1
+        else:
+            await self.__build(client, room_id)
+        return self.__members[room_id]
+
+    async def find(self, client: AsyncClient, room_id: str, display_name: str) -> RoomMember or None:
+        """
+        Look up a member of a room by displayname, case-insensitively
+        :param client: the client holding the room state
+        :param room_id: the room
+        :param display_name: displayname of the member
+        :return:    the first member with that displayname,
+                    None if there is no such member
+        """
+
+        await self.get_members(client, room_id)
+        members: List[RoomMember] = self.__names[room_id].get(display_name.lower(), [])
+        return members[0] if members else None
+
+    async def fuzzy_find_many(self, client: AsyncClient, room_id: str, display_names: Iterable[str],
+                              threshold: int) -> Dict[str, RoomMember or None]:
+        """
+        Fuzzy match a batch of displaynames against the members of a room, case-insensitively
+        Results are remembered until the room's members change
+        :param client: the client holding the room state
+        :param room_id: the room
+        :param display_names: the displaynames to match
+        :param threshold: fuzz.ratio() a member's displayname needs to reach to be considered a match
+        :return: {display_name: the best matching member (the last one in the member list on ties) or None}
+        """
+
+        members: List[RoomMember] = await self.get_members(client, room_id)
+        if room_id not in self.__name_indexes:
+            self.__name_indexes[room_id] = NameIndex([(member.display_name, member) for member in members])
+
+        return self.__name_indexes[room_id].best_matches(display_names, threshold)
+
+    async def fuzzy_find(self, client: AsyncClient, room_id: str, display_name: str, threshold: int) -> RoomMember or None:
+        """
+        Fuzzy match a single displayname against the members of a room, see fuzzy_find_many
+        :return: the best matching member or None
+        """
+
+        return (await self.fuzzy_find_many(client, room_id, [display_name], threshold))[display_name]
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return: number of cached rooms, cache hits, entries built and member lists requested from the homeserver
+        """
+
+        return {"rooms": len(self.__members), "hits": self.hits, "builds": self.builds, "requests": self.requests}
+
+
+member_cache: MemberCache = MemberCache()
+"""the cache shared by all plugins, kept current by Callbacks.member and Callbacks.sync_members"""
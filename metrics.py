@@ -0,0 +1,293 @@
+"""
+    Counters and latency histograms of commands, hooks, timers, sent messages and syncs,
+    exported in Prometheus' text format
+
+"""
+
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+"""upper bounds of the histogram buckets in seconds"""
+
+
+def room_class(room) -> str:
+    """
+    Classify a room for use as a label, keeping the number of label values small
+    :param room: nio.rooms.MatrixRoom or None
+    :return: "direct" for rooms with up to two members, "group" for other rooms, "unknown" without a room
+    """
+
+    if room is None:
+        return "unknown"
+    return "direct" if room.member_count <= 2 else "group"
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+
+    pairs: List[str] = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricCounter:
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        """
+        A monotonically increasing value per combination of label values
+        :param name: name of the metric
+        :param help_text: description of the metric
+        :param label_names: names of the labels
+        """
+
+        self.name: str = name
+        self.help_text: str = help_text
+        self.label_names: Tuple[str, ...] = label_names
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        """
+        Increase the counter
+        :param label_values: values of the labels, in the order of label_names
+        :param amount: amount to increase the counter by
+        :return:
+        """
+
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+
+        lines: List[str] = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Distribution of observed values (e.g. latencies in seconds) per combination of label values
+        :param name: name of the metric
+        :param help_text: description of the metric
+        :param label_names: names of the labels
+        :param buckets: upper bounds of the buckets, in increasing order
+        """
+
+        self.name: str = name
+        self.help_text: str = help_text
+        self.label_names: Tuple[str, ...] = label_names
+        self.buckets: Tuple[float, ...] = buckets
+
+        self.counts: Dict[LabelValues, List[int]] = {}
+        """number of observations per bucket (not cumulative), the last one counting values above all bounds"""
+        self.sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, *label_values: str):
+        """
+        Record an observation
+        :param value: the observed value
+        :param label_values: values of the labels, in the order of label_names
+        :return:
+        """
+
+        if label_values not in self.counts:
+            self.counts[label_values] = [0] * (len(self.buckets) + 1)
+            self.sums[label_values] = 0.0
+
+        self.counts[label_values][bisect_left(self.buckets, value)] += 1
+        self.sums[label_values] += value
+
+    def quantile(self, quantile: float, *label_values: str) -> float:
+        """
+        Estimate a quantile from the buckets, the way Prometheus' histogram_quantile() does
+        :param quantile: the quantile, 0..1
+        :param label_values: values of the labels
+        :return: the estimated value, 0 without observations
+        """
+
+        counts: List[int] = self.counts.get(label_values, [])
+        total: int = sum(counts)
+        if total == 0:
+            return 0.0
+
+        rank: float = quantile * total
+        cumulative: int = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count > 0:
+                if index >= len(self.buckets):
+                    return self.buckets[-1]
+                lower: float = self.buckets[index - 1] if index > 0 else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+
+        lines: List[str] = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, counts in sorted(self.counts.items()):
+            cumulative: int = 0
+            bucket_labels: str
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.label_names, label_values, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            cumulative += counts[-1]
+            bucket_labels = _format_labels(self.label_names, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels: str = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {self.sums[label_values]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Metrics:
+
+    def __init__(self, prefix: str = "nio_smith"):
+        """
+        All metrics of the bot, plus collectors exporting the statistics kept by its components as gauges
+        :param prefix: prefix of all metric names
+        """
+
+        self.prefix: str = prefix
+
+        self.commands: MetricCounter = MetricCounter(f"{prefix}_commands_total", "Commands run",
+                                                     ("plugin", "command", "room_class", "outcome"))
+        self.command_duration: Histogram = Histogram(f"{prefix}_command_duration_seconds", "Time spent running commands",
+                                                     ("plugin", "command", "room_class"))
+        self.hooks: MetricCounter = MetricCounter(f"{prefix}_hooks_total", "Hooks run",
+                                                  ("plugin", "event_type", "room_class", "outcome"))
+        self.hook_duration: Histogram = Histogram(f"{prefix}_hook_duration_seconds", "Time spent running hooks",
+                                                  ("plugin", "event_type", "room_class"))
+        self.timers: MetricCounter = MetricCounter(f"{prefix}_timers_total", "Timer executions",
+                                                   ("plugin", "timer", "outcome"))
+        self.timer_duration: Histogram = Histogram(f"{prefix}_timer_duration_seconds", "Time spent running timers",
+                                                   ("plugin", "timer"))
+        self.sends: MetricCounter = MetricCounter(f"{prefix}_sends_total", "Messages sent to rooms",
+                                                  ("room_class", "outcome"))
+        self.send_duration: Histogram = Histogram(f"{prefix}_send_duration_seconds", "Time spent sending messages",
+                                                  ("room_class",))
+        self.blocking_wait: Histogram = Histogram(f"{prefix}_blocking_wait_seconds",
+                                                  "Time blocking calls waited for a worker thread", ("plugin",))
+        self.blocking_duration: Histogram = Histogram(f"{prefix}_blocking_duration_seconds",
+                                                      "Time spent running blocking calls in worker threads", ("plugin",))
+        self.syncs: MetricCounter = MetricCounter(f"{prefix}_syncs_total", "Sync responses processed")
+        self.sync_interval: Histogram = Histogram(f"{prefix}_sync_interval_seconds",
+                                                  "Time between two sync responses (long polling included)")
+
+        self.__collectors: Dict[str, Callable[[], Dict]] = {}
+        self.__server = None
+
+    def add_collector(self, name: str, collect: Callable[[], Dict]):
+        """
+        Export the statistics returned by a get_stats()-like method as gauges
+        :param name: name of the component, part of the gauges' names
+        :param collect: callable returning {stat: value} or {key: {stat: value}} (exported with a "key"-label)
+        :return:
+        """
+
+        self.__collectors[name] = collect
+
+    def __render_collectors(self) -> List[str]:
+
+        gauges: Dict[str, List[str]] = {}
+        for name, collect in self.__collectors.items():
+            try:
+                stats: Dict = collect()
+            except Exception as err:
+                logger.warning(f"Could not collect {name} statistics: {err}")
+                continue
+
+            for key, value in stats.items():
+                if isinstance(value, dict):
+                    for stat, stat_value in value.items():
+                        if isinstance(stat_value, (int, float)):
+                            key_label: str = _format_labels(("key",), (key,))
+                            gauges.setdefault(f"{self.prefix}_{name}_{stat}", []).append(
+                                f"{self.prefix}_{name}_{stat}{key_label} {stat_value}")
+                elif isinstance(value, (int, float)):
+                    gauges.setdefault(f"{self.prefix}_{name}_{key}", []).append(f"{self.prefix}_{name}_{key} {value}")
+
+        lines: List[str] = []
+        for gauge, samples in gauges.items():
+            lines.append(f"# TYPE {gauge} gauge")
+            lines.extend(samples)
+        return lines
+
+    def render(self) -> str:
+        """
+        :return: all metrics in Prometheus' text exposition format
+        """
+
+        lines: List[str] = []
+        for metric in [self.commands, self.command_duration, self.hooks, self.hook_duration, self.timers,
+                       self.timer_duration, self.sends, self.send_duration, self.blocking_wait, self.blocking_duration,
+                       self.syncs, self.sync_interval]:
+            lines.extend(metric.render())
+        lines.extend(self.__render_collectors())
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """
+        :return: short markdown overview of command and hook latencies, e.g. for a chat command
+        """
+
+        lines: List[str] = []
+        for title, histogram in [("Commands", self.command_duration), ("Hooks", self.hook_duration),
+                                 ("Timers", self.timer_duration), ("Sends", self.send_duration),
+                                 ("Blocking calls (waiting for a thread)", self.blocking_wait)]:
+            if not histogram.counts:
+                continue
+            lines.append(f"**{title}**  ")
+            for label_values in sorted(histogram.counts.keys()):
+                count: int = sum(histogram.counts[label_values])
+                average: float = histogram.sums[label_values] / count
+                lines.append(f"{'/'.join(label_values) or 'all'}: {count}x, avg {average * 1000:.0f}ms, "
+                             f"p95 {histogram.quantile(.95, *label_values) * 1000:.0f}ms  ")
+        return "\n".join(lines) if lines else "No metrics recorded yet"
+
+    async def start_server(self, host: str = "127.0.0.1", port: int = 9090):
+        """
+        Serve the metrics on http://host:port/metrics
+        :param host: address to listen on
+        :param port: port to listen on
+        :return:
+        """
+
+        from aiohttp import web
+
+        async def handle_metrics(request):
+            return web.Response(text=self.render(), content_type="text/plain", charset="utf-8",
+                                headers={"X-Content-Type-Options": "nosniff"})
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        self.__server = web.AppRunner(app)
+        await self.__server.setup()
+        await web.TCPSite(self.__server, host, port).start()
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def stop_server(self):
+        """
+        Stop serving the metrics
+        :return:
+        """
+
+        if self.__server is not None:
+            await self.__server.cleanup()
+            self.__server = None
+
+
+metrics: Metrics = Metrics()
+"""the metrics of the bot, recorded by all components"""
@@ -1,13 +1,20 @@
-import os.path
-from os import remove, path
-import pickle
-from typing import List, Any, Dict, Callable, Union, Hashable
+from os import path
+from typing import List, Any, Awaitable, Dict, Callable, Union, Hashable, FrozenSet, Iterable
 import yaml
 from chat_functions import send_text_to_room
-from asyncio import sleep
+from timers import CronSchedule
+from process_pool import process_pool, CPUBudgetExceeded
+from thread_pool import thread_pool
+from http_client import HttpClient, http_client
+from response_cache import response_cache
+from plugin_storage import PluginDataBackend, PickleBackend
+from member_cache import member_cache
+from typing_notifications import typing_manager
+from functools import wraps
+from time import time
+import random
 import logging
-from nio import AsyncClient, JoinedMembersResponse, RoomMember, RoomSendResponse
-from fuzzywuzzy import fuzz
+from nio import AsyncClient, RoomMember, RoomSendResponse
 logger = logging.getLogger(__name__)
 
 
@@ -24,11 +31,17 @@ class Plugin:
         self.commands: Dict[str, PluginCommand] = {}
         self.help_texts: Dict[str, str] = {}
         self.hooks: Dict[str, List[PluginHook]] = {}
-        self.timers: List[Callable] = []
+        self.timers: List[PluginTimer] = []
         self.rooms: List[str] = []
+        self.__room_set: FrozenSet[str] = frozenset()
 
         self.plugin_data_filename: str = f"plugins/{self.name}.pkl"
         self.plugin_data: Dict[str, Any] = {}
+        """items of the plugin's data read or stored so far"""
+        self.data_backend: PluginDataBackend = PickleBackend(self.plugin_data_filename)
+
+        self.http: HttpClient = http_client
+        """HTTP client shared by all plugins: `await plugin.http.get(url, params=...)` returns a completely read response"""
 
         self.config_items_filename: str = f"plugins/{self.name}.yaml"
         self.config_items: Dict[str, Any] = {}
@@ -36,7 +49,7 @@ class Plugin:
 
     def is_valid_for_room(self, room_id: str) -> bool:
 
-        if self.rooms == [] or room_id in self.rooms:
+        if not self.__room_set or room_id in self.__room_set:
             return True
         else:
             return False
@@ -56,21 +69,63 @@ class Plugin:
 
         return command_help
 
-    def add_command(self, command: str, method: Callable, help_text: str, room_id: List[str] = None):
+    def add_command(self, command: str, method: Callable, help_text: str, room_id: List[str] = None, execution: str = "async",
+                    reply_delay: int = 0):
+        """
+        Add a command to the plugin
+        :param command: the command word
+        :param method: the method called when the command is encountered
+        :param help_text: a short help text
+        :param room_id: optional list of rooms the command is valid for
+        :param execution:   "async" (default): method is a coroutine function called with the command
+                            "process": method is a module-level (picklable) function called with the command's arguments
+                            in the shared process pool, its result is sent as reply. Use this for CPU-heavy commands.
+        :param reply_delay: "process" only: delay of the reply with typing notification, 1..1000ms, see message()
+        :return:
+        """
+
+        if execution == "process":
+            method = self.__process_command(method, reply_delay)
+        elif execution != "async":
+            logger.error(f"Error adding command {command} - unknown execution mode {execution}")
+            return
 
-        plugin_command = PluginCommand(command, method, help_text, room_id)
+        plugin_command = PluginCommand(command, method, help_text, room_id, self.name, execution)
         if command not in self.commands.keys():
             self.commands[command] = plugin_command
             self.help_texts[command] = help_text
             # Add rooms from command to the rooms the plugin is valid for
             if room_id:
                 for room in room_id:
-                    if room not in self.rooms:
+                    if room not in self.__room_set:
                         self.rooms.append(room)
+                        self.__room_set = frozenset(self.rooms)
             logger.debug(f"Added command {command} to rooms {room_id}")
         else:
             logger.error(f"Error adding command {command} - command already exists")
 
+    def __process_command(self, compute: Callable, reply_delay: int = 0) -> Callable:
+        """
+        Wrap a pure function to be run as command in the shared process pool
+        :param compute: module-level function taking the command's arguments (List[str]) and returning the reply (str or None)
+        :param reply_delay: delay of the reply with typing notification in ms, 0 for none
+        :return: coroutine function to be used as the command's method
+        """
+
+        @wraps(compute)
+        async def run_process_command(command):
+            result: str or None
+            try:
+                result = await process_pool.run(compute, command.args)
+            except CPUBudgetExceeded:
+                await self.reply_notice(command, "Sorry, that took too long to compute")
+                return
+
+            if result:
+                await self.reply(command, result, delay=reply_delay)
+
+        return run_process_command
+
     def get_commands(self):
         """
         Extract called methods from commands
@@ -81,9 +136,17 @@ class Plugin:
 
         return self.commands
 
-    def add_hook(self, event_type: str, method: Callable, room_id: List[str] = None):
+    def add_hook(self, event_type: str, method: Callable, room_id: List[str] = None, timeout: float = None):
+        """
+        Hook into received events
+        :param event_type: the event type to hook into, e.g. "m.room.message" or "m.reaction"
+        :param method: the method called with (client, room_id, event) when the event is received
+        :param room_id: optional list of rooms the hook is valid for
+        :param timeout: optional timeout in seconds after which the hook gets cancelled, defaults to the bot's hook_timeout
+        :return:
+        """
 
-        plugin_hook = PluginHook(event_type, method, room_id)
+        plugin_hook = PluginHook(event_type, method, room_id, self.name, timeout)
         if event_type not in self.hooks.keys():
             self.hooks[event_type] = [plugin_hook]
         else:
@@ -94,160 +157,160 @@ class Plugin:
 
         return self.hooks
 
-    def add_timer(self, method: Callable):
+    def add_timer(self, method: Callable, interval: float = 30, cron: str = None, jitter: float = 0, allow_overlap: bool = False):
+        """
+        Register a method for recurring execution
+        :param method: the method called with the AsyncClient as its only argument
+        :param interval: seconds between two executions (ignored if cron is given)
+        :param cron: optional cron-like schedule "minute hour day_of_month month day_of_week", e.g. "0 8 * * 1-5"
+        :param jitter: maximum number of seconds to randomly delay each execution by
+        :param allow_overlap: whether a new execution may start while the previous one is still running
+        :return:
+        """
 
-        self.timers.append(method)
+        try:
+            plugin_timer = PluginTimer(method, self.name, interval, cron, jitter, allow_overlap)
+            # a schedule that never matches would only fail once the timer is due
+            plugin_timer.next_run(time())
+        except ValueError as err:
+            logger.error(f"Error adding timer {method.__name__} - {err}")
+            return
+
+        self.timers.append(plugin_timer)
+        logger.debug(f"Added timer {method.__name__} with {f'schedule {cron}' if cron else f'interval {interval}s'}")
 
-    def get_timers(self) -> List[Callable]:
+    def get_timers(self) -> List["PluginTimer"]:
 
         return self.timers
 
-    def store_data(self, name: str, data: Any) -> bool:
+    def set_data_backend(self, data_backend: PluginDataBackend):
         """
-        Store data in plugins/<pluginname>.dill
+        Set the backend persisting the plugin's data, usually done by the PluginLoader after importing the plugin
+        :param data_backend: the backend to use
+        :return:
+        """
+
+        self.data_backend = data_backend
+        self.plugin_data = {}
+
+    def store_data(self, name: str, data: Any, keys: Iterable[Hashable] = None) -> bool:
+        """
+        Store data using the plugin's data backend (database or plugins/<pluginname>.pkl)
         :param name: Name of the data to store, used as a reference to retrieve it later
         :param data: data to be stored
-        :return:    True, if data was successfully stored
+        :param keys: optional, for dicts: the keys added, changed or removed since the data was last stored,
+                     lets the journal backend write only those entries instead of comparing all of them
+        :return:    True, if data was successfully stored (or queued to be written, if write-behind is enabled)
                     False, if data could not be stored
         """
 
         self.plugin_data[name] = data
-        return self.__save_data()
+        return self.data_backend.store(name, data, keys)
 
     def read_data(self, name: str) -> Any:
         """
-        Read data from self.plugin_data
+        Read data from self.plugin_data, loading it from the plugin's data backend on first access
         :param name: Name of the data to be retrieved
         :return: the previously stored data
         """
 
-        if name in self.plugin_data:
-            return self.plugin_data[name]
-        else:
-            raise KeyError
+        if name not in self.plugin_data:
+            self.plugin_data[name] = self.data_backend.read(name)
+        return self.plugin_data[name]
 
     def clear_data(self, name: str) -> bool:
         """
-        Clear a specific field in self.plugin_data
+        Clear a specific field in the plugin's data
         :param name: name of the field to be cleared
         :return:    True, if successfully cleared
-                    False, if name not contained in self.plugin_data or data could not be saved to disk
+                    False, if name not contained in the plugin's data or data could not be saved to disk
         """
 
-        if name in self.plugin_data:
-            del self.plugin_data[name]
-            return self.__save_data()
-        else:
-            return False
+        self.plugin_data.pop(name, None)
+        return self.data_backend.clear(name)
 
-    def load_data(self) -> Any:
+    def load_data(self) -> Dict[str, Any]:
         """
-        Load plugin_data from file
-        :return: Data read from file to be loaded into self.plugin_data
+        Load all of the plugin's data at once
+        :return: Data read from the plugin's data backend to be loaded into self.plugin_data
         """
 
-        try:
-            return pickle.load(open(self.plugin_data_filename, "rb"))
-
-        except FileNotFoundError:
-            logger.debug(f"File {self.plugin_data_filename} not found, plugin_data will be empty")
-            return {}
-
-        except Exception as err:
-            logger.critical(f"Could not load plugin_data from {self.plugin_data_filename}: {err}")
-            return {}
+        return self.data_backend.load_all()
 
-    def __save_data(self) -> bool:
-        """
-        Save modified plugin_data to disk
-        :return:
-        """
-
-        if self.plugin_data != {}:
-            """there is actual data to save"""
-            try:
-                pickle.dump(self.plugin_data, open(self.plugin_data_filename, "wb"))
-                return True
-            except Exception as err:
-                logger.critical(f"Could not write plugin_data to {self.plugin_data_filename}: {err}")
-                return False
-        else:
-            """no data to save, remove file"""
-            if os.path.isfile(self.plugin_data_filename):
-                try:
-                    remove(self.plugin_data_filename)
-                    return True
-                except Exception as err:
-                    logger.critical(f"Could not remove file {self.plugin_data_filename}: {err}")
-                    return False
-
-    async def message(self, client, room_id, message: str, delay: int = 0) -> str or None:
+    async def message(self, client, room_id, message: str, delay: int = 0, format: str = "markdown") -> str or None:
         """
         Send a message to a room, usually utilized by plugins to respond to commands
         :param client: AsyncClient used to send the message
         :param room_id: room_id to send to message to
         :param message: the actual message
-        :param delay: optional delay with typing notification, 1..1000ms
-        :return: the event_id of the sent message or None in case of an error
+        :param delay: optional delay with typing notification, 1..1000ms.
+                        The message is sent in the background after the delay, without waiting for it
+        :param format: "markdown" (default), "html" (already formatted, sent without conversion) or "plain"
+        :return:    the event_id of the sent message or None in case of an error,
+                    always None for delayed messages
         """
 
         if delay > 0:
             if delay > 1000:
                 delay = 1000
 
-            await client.room_typing(room_id, timeout=delay)
-            await sleep(float(delay/1000))
-            await client.room_typing(room_id, typing_state=False)
+            typing_manager.schedule(client, room_id, delay / 1000,
+                                    lambda: send_text_to_room(client, room_id, message, notice=False, format=format))
+            return None
 
         event_response: RoomSendResponse
-        event_response = await send_text_to_room(client, room_id, message, notice=False)
+        event_response = await send_text_to_room(client, room_id, message, notice=False, format=format)
 
         if event_response:
             return event_response.event_id
         else:
             return None
 
-    async def reply(self, command, message: str, delay: int = 0) -> str or None:
+    async def reply(self, command, message: str, delay: int = 0, format: str = "markdown") -> str or None:
         """
         Simplified version of self.message() to reply to commands
         :param command: the command object passed by the message we're responding to
         :param message: the actual message
-        :param delay: optional delay with typing notification, 1..1000ms
-        :return: the event_id of the sent message or None in case of an error
+        :param delay: optional delay with typing notification, 1..1000ms, see message()
+        :param format: "markdown" (default), "html" or "plain", see message()
+        :return: the event_id of the sent message or None in case of an error (or a delay)
         """
 
-        return await self.message(command.client, command.room.room_id, message, delay)
+        return await self.message(command.client, command.room.room_id, message, delay, format)
 
-    async def notice(self, client, room_id: str, message: str) -> str or None:
+    async def notice(self, client, room_id: str, message: str, format: str = "markdown") -> str or None:
         """
         Send a notice to a room, usually utilized by plugins to post errors, help texts or other messages not warranting pinging users
         :param client: AsyncClient used to send the message
         :param room_id: room_id to send to message to
         :param message: the actual message
+        :param format: "markdown" (default), "html" or "plain", see message()
         :return: the event_id of the sent message or None in case of an error
         """
 
         event_response: RoomSendResponse
-        event_response = await send_text_to_room(client, room_id, message, notice=True)
+        event_response = await send_text_to_room(client, room_id, message, notice=True, format=format)
 
         if event_response:
             return event_response.event_id
         else:
             return None
 
-    async def reply_notice(self, command, message: str) -> str or None:
+    async def reply_notice(self, command, message: str, format: str = "markdown") -> str or None:
         """
         Simplified version of self.notice() to reply to commands
         :param command: the command object passed by the message we're responding to
         :param message: the actual message
+        :param format: "markdown" (default), "html" or "plain", see message()
         :return: the event_id of the sent message or None in case of an error
         """
 
-        return await self.notice(command.client, command.room.room_id, message)
+        return await self.notice(command.client, command.room.room_id, message, format)
 
     async def is_user_in_room(self, command, display_name: str, strictness: str = "loose", fuzziness: int = 75) -> RoomMember or None:
         """
         Try to determine if a diven displayname is currently a member of the room
+        Members are looked up in the local member cache, without requesting the member list from the homeserver
         :param command:
         :param display_name: displayname of the user
         :param strictness: how strict to match the nickname
@@ -260,36 +323,15 @@ class Plugin:
         """
 
         client: AsyncClient = command.client
-        room_members: JoinedMembersResponse = await client.joined_members(command.room.room_id)
-
         room_member: RoomMember
 
         if strictness == "strict" or strictness == "loose":
-            for room_member in room_members.members:
-
-                if strictness == "strict":
-                    if room_member.display_name.lower() == display_name.lower():
-                        return room_member
-
-                else:
-                    """loose matching"""
-                    if room_member.display_name.lower() == display_name.lower():
-                        return room_member
-            else:
-                return None
+            """lookup in the room's displayname index, case-insensitive for both (as strict has always been)"""
+            return await member_cache.find(client, command.room.room_id, display_name)
 
         else:
             """attempt fuzzy matching"""
-            ratios: Dict[int, RoomMember] = {}
-            for room_member in room_members.members:
-                score: int
-                if (score := fuzz.ratio(display_name.lower(), room_member.display_name.lower())) >= fuzziness:
-                    ratios[score] = room_member
-
-            if ratios != {}:
-                return ratios[max(ratios.keys())]
-            else:
-                return None
+            return await member_cache.fuzzy_find(client, command.room.room_id, display_name, fuzziness)
 
     async def link_user(self, command, display_name: str, strictness: str = "loose", fuzziness: int = 75) -> str or None:
         """
@@ -311,6 +353,67 @@ class Plugin:
         else:
             return None
 
+    async def link_users(self, command, display_names: List[str], strictness: str = "loose", fuzziness: int = 75) -> Dict[str, str or None]:
+        """
+        Given a list of displaynames and a command, returns userlinks for all of them at once
+        Fuzzy matching scores all displaynames in one batch against the room's members
+        :param command:
+        :param display_names: displaynames of the users
+        :param strictness: how strict to match the nicknames, see link_user
+        :param fuzziness: if strictness == fuzzy, fuzziness determines the required percentage for a match
+        :return: {display_name: string with the userlink-html-code if found, None otherwise}
+        """
+
+        users: Dict[str, RoomMember or None]
+        if strictness == "fuzzy":
+            users = await member_cache.fuzzy_find_many(command.client, command.room.room_id, display_names, fuzziness)
+        else:
+            users = {display_name: await self.is_user_in_room(command, display_name, strictness)
+                     for display_name in dict.fromkeys(display_names)}
+
+        return {display_name: f"<a href=\"https://matrix.to/#/{user.user_id}\">{display_name}</a>" if user else None
+                for display_name, user in users.items()}
+
+    async def run_blocking(self, method: Callable, *args, **kwargs) -> Any:
+        """
+        Run blocking code (e.g. file I/O or synchronous libraries) in the shared thread pool, keeping the bot responsive
+        :param method: the function to run
+        :param args: positional arguments passed to method
+        :param kwargs: keyword arguments passed to method
+        :return: the result of method
+        """
+
+        return await thread_pool.run(method, *args, plugin_name=self.name, **kwargs)
+
+    def blocking(self, method: Callable) -> Callable:
+        """
+        Decorator turning a blocking function into a coroutine function running it in the shared thread pool:
+        @plugin.blocking
+        def load(filename): ...
+        data = await load(filename)
+        :param method: the function to run
+        :return: coroutine function with the same arguments
+        """
+
+        @wraps(method)
+        async def run_blocking(*args, **kwargs):
+            return await self.run_blocking(method, *args, **kwargs)
+
+        return run_blocking
+
+    async def cached(self, key: Hashable, fetch: Callable[[], Awaitable], ttl: float, stale_ttl: float = 0) -> Any:
+        """
+        Get the result of a slow request (e.g. to an external API) from the shared cache, fetching it only when needed
+        Concurrent calls with the same key share a single fetch
+        :param key: identifies the request within the plugin, e.g. the endpoint and its parameters
+        :param fetch: callable returning an awaitable producing the result, exceptions are passed on and not cached
+        :param ttl: seconds a result is used without fetching it again
+        :param stale_ttl: seconds an expired result is still returned while it's being refreshed in the background
+        :return: the result
+        """
+
+        return await response_cache.get((self.name, key), fetch, ttl, stale_ttl)
+
     def add_config(self, config_item: str, default_value: Any = None, is_required: bool = False) -> bool:
         """
         Add a config value to be searched for in the plugin-specific configuration file upon loading, raise KeyError exception if required config_item can't be
@@ -381,16 +484,129 @@ class Plugin:
 
 class PluginCommand:
 
-    def __init__(self, command: str, method: Callable, help_text: str, room_id: List[str]):
+    def __init__(self, command: str, method: Callable, help_text: str, room_id: List[str], plugin_name: str = "",
+                 execution: str = "async"):
         self.command: str = command
         self.method: Callable = method
         self.help_text: str = help_text
         self.room_id: List[str] = room_id
+        self.plugin_name: str = plugin_name
+        self.execution: str = execution
 
 
 class PluginHook:
 
-    def __init__(self, event_type: str, method: Callable, room_id: List[str]):
+    def __init__(self, event_type: str, method: Callable, room_id: List[str], plugin_name: str = "", timeout: float = None):
         self.event_type: str = event_type
         self.method: Callable = method
         self.room_id: List[str] = room_id
+        self.plugin_name: str = plugin_name
+        self.timeout: float or None = timeout
+
+        self.calls: int = 0
+        self.timeouts: int = 0
+        self.failures: int = 0
+        self.latency_total: float = 0.0
+        self.latency_max: float = 0.0
+
+    def record_latency(self, latency: float):
+        """
+        Record the duration of a single run of the hook
+        :param latency: duration in seconds
+        :return:
+        """
+
+        self.calls += 1
+        self.latency_total += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        :return: call count, timeouts, failures and latencies of the hook
+        """
+
+        return {
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "latency_avg": self.latency_total / self.calls if self.calls else 0.0,
+            "latency_max": self.latency_max,
+        }
+
+
+class PluginTimer:
+
+    def __init__(self, method: Callable, plugin_name: str = "", interval: float = 30, cron: str = None, jitter: float = 0, allow_overlap: bool = False):
+        self.method: Callable = method
+        self.plugin_name: str = plugin_name
+        self.interval: float = interval
+        self.cron: CronSchedule or None = CronSchedule(cron) if cron else None
+        self.jitter: float = jitter
+        self.allow_overlap: bool = allow_overlap
+
+        self.runs: int = 0
+        self.skipped: int = 0
+        self.failures: int = 0
+        self.lag_total: float = 0.0
+        self.lag_max: float = 0.0
+        self.duration_total: float = 0.0
+        self.duration_max: float = 0.0
+
+    def next_run(self, after: float) -> float:
+        """
+        Calculate the next time the timer is due, without jitter
+        :param after: unix timestamp of the last due time (or now)
+        :return: unix timestamp of the next due time
+        :raises ValueError: if the timer's cron schedule never matches
+        """
+
+        if self.cron:
+            return self.cron.next_after(after)
+        else:
+            return after + self.interval
+
+    def get_jitter(self) -> float:
+        """
+        :return: random delay in seconds to add to a single execution of the timer
+        """
+
+        return random.uniform(0, self.jitter) if self.jitter > 0 else 0.0
+
+    def record_lag(self, lag: float):
+        """
+        Record how late an execution of the timer started
+        :param lag: seconds between the due time and the actual start
+        :return:
+        """
+
+        self.runs += 1
+        self.lag_total += lag
+        if lag > self.lag_max:
+            self.lag_max = lag
+
+    def record_duration(self, duration: float):
+        """
+        Record how long an execution of the timer took
+        :param duration: duration in seconds
+        :return:
+        """
+
+        self.duration_total += duration
+        if duration > self.duration_max:
+            self.duration_max = duration
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        :return: run count, skipped runs, failures, lag and duration of the timer
+        """
+
+        return {
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "lag_avg": self.lag_total / self.runs if self.runs else 0.0,
+            "lag_max": self.lag_max,
+            "duration_avg": self.duration_total / self.runs if self.runs else 0.0,
+            "duration_max": self.duration_max,
+        }
@@ -0,0 +1,169 @@
+"""
+    Cheap plugin descriptors, allowing to register a plugin's commands and hooks without importing it
+
+"""
+
+from plugin import Plugin, PluginCommand, PluginHook
+
+from os import path
+from typing import Any, Callable, Dict, FrozenSet, List
+import yaml
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class PluginManifest:
+
+    def __init__(self, filename: str):
+        """
+        Descriptors of all plugins (name, description, commands, hooks), keyed by module name
+        Entries are only valid as long as the plugin's source and configuration files have not been modified
+        :param filename: path of the manifest file
+        """
+
+        self.filename: str = filename
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.modified: bool = False
+
+        if path.exists(self.filename):
+            try:
+                with open(self.filename) as file_stream:
+                    self.entries = yaml.safe_load(file_stream.read()) or {}
+            except (OSError, yaml.YAMLError) as err:
+                logger.warning(f"Could not load plugin manifest {self.filename}: {err}")
+
+    def get(self, module_name: str, mtime: float) -> Dict[str, Any] or None:
+        """
+        Get the descriptor for a plugin module
+        :param module_name: name of the module in the plugins-package
+        :param mtime: current modification time of the plugin's files
+        :return:    the descriptor, if it is up to date
+                    None otherwise
+        """
+
+        entry: Dict[str, Any] or None = self.entries.get(module_name)
+        if entry and entry.get("mtime") == mtime:
+            return entry
+        else:
+            return None
+
+    def update(self, module_name: str, mtime: float, plugin: Plugin):
+        """
+        Store the descriptor of an imported plugin
+        :param module_name: name of the module in the plugins-package
+        :param mtime: current modification time of the plugin's files
+        :param plugin: the imported plugin
+        :return:
+        """
+
+        self.entries[module_name] = {
+            "mtime": mtime,
+            "name": plugin.name,
+            "category": plugin.category,
+            "description": plugin.description,
+            "commands": [{"command": plugin_command.command,
+                          "help_text": plugin_command.help_text,
+                          "room_id": plugin_command.room_id}
+                         for plugin_command in plugin.get_commands().values()],
+            "hooks": [{"event_type": plugin_hook.event_type,
+                       "room_id": plugin_hook.room_id,
+                       "timeout": plugin_hook.timeout}
+                      for plugin_hooks in plugin.get_hooks().values() for plugin_hook in plugin_hooks],
+            "timers": len(plugin.get_timers()),
+        }
+        self.modified = True
+
+    def remove(self, module_name: str):
+        """
+        Remove the descriptor of a plugin module, e.g. if it could not be imported
+        :param module_name: name of the module in the plugins-package
+        :return:
+        """
+
+        if self.entries.pop(module_name, None) is not None:
+            self.modified = True
+
+    def save(self):
+        """
+        Write the manifest to disk, if any descriptor has changed
+        :return:
+        """
+
+        if self.modified:
+            try:
+                with open(self.filename, "w") as file_stream:
+                    yaml.safe_dump(self.entries, file_stream)
+                self.modified = False
+            except OSError as err:
+                logger.warning(f"Could not save plugin manifest {self.filename}: {err}")
+
+
+class LazyPlugin:
+
+    def __init__(self, module_name: str, entry: Dict[str, Any], activate: Callable[[str], Plugin]):
+        """
+        Stand-in for a plugin that has not been imported yet
+        Its commands and hooks import and activate the actual plugin when they are first run
+        :param module_name: name of the module in the plugins-package
+        :param entry: the plugin's descriptor from the PluginManifest
+        :param activate: method importing the plugin by name and returning the actual Plugin
+        """
+
+        self.module_name: str = module_name
+        self.name: str = entry["name"]
+        self.category: str = entry["category"]
+        self.description: str = entry["description"]
+        self.activate: Callable[[str], Plugin] = activate
+
+        self.commands: Dict[str, PluginCommand] = {}
+        self.hooks: Dict[str, List[PluginHook]] = {}
+        self.rooms: List[str] = []
+
+        for command_entry in entry["commands"]:
+            command: str = command_entry["command"]
+            self.commands[command] = PluginCommand(command, self.__command_proxy(command), command_entry["help_text"],
+                                                   command_entry["room_id"], self.name)
+            for room in command_entry["room_id"] or []:
+                if room not in self.rooms:
+                    self.rooms.append(room)
+
+        self.__room_set: FrozenSet[str] = frozenset(self.rooms)
+
+        for hook_entry in entry["hooks"]:
+            event_type: str = hook_entry["event_type"]
+            index: int = len(self.hooks.get(event_type, []))
+            self.hooks.setdefault(event_type, []).append(
+                PluginHook(event_type, self.__hook_proxy(event_type, index), hook_entry["room_id"], self.name, hook_entry["timeout"]))
+
+    def __command_proxy(self, command_name: str) -> Callable:
+
+        async def run_lazy_command(command):
+            plugin: Plugin = self.activate(self.name)
+            await plugin.get_commands()[command_name].method(command)
+
+        return run_lazy_command
+
+    def __hook_proxy(self, event_type: str, index: int) -> Callable:
+
+        async def run_lazy_hook(client, room_id: str, event):
+            plugin: Plugin = self.activate(self.name)
+            await plugin.get_hooks()[event_type][index].method(client, room_id, event)
+
+        return run_lazy_hook
+
+    def is_valid_for_room(self, room_id: str) -> bool:
+
+        return not self.__room_set or room_id in self.__room_set
+
+    def get_commands(self) -> Dict[str, PluginCommand]:
+
+        return self.commands
+
+    def get_hooks(self) -> Dict[str, List[PluginHook]]:
+
+        return self.hooks
+
+    def get_timers(self) -> List:
+
+        return []
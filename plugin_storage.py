@@ -0,0 +1,752 @@
+"""
+    Backends persisting the data plugins store via Plugin.store_data()
+
+"""
+
+from storage import Storage
+
+import asyncio
+from hashlib import blake2b
+from os import fsync, path, remove, rename, replace
+import pickle
+import struct
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Set, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+DELETED = object()
+"""marks an item removed by clear() in a batch of changes"""
+
+
+class PluginDataError(Exception):
+    """Raised when a plugin's existing data can not be read, the plugin must not run on an empty data set instead"""
+    pass
+
+
+def _atomic_write(filename: str, payload: bytes):
+    """
+    Replace a file's contents atomically: write a temporary file, fsync it and rename it over the original
+    :param filename: the file to replace
+    :param payload: the new contents
+    :return:
+    """
+
+    temp_filename: str = f"{filename}.tmp"
+    with open(temp_filename, "wb") as file_stream:
+        file_stream.write(payload)
+        file_stream.flush()
+        fsync(file_stream.fileno())
+    replace(temp_filename, filename)
+
+
+class PluginDataBackend:
+
+    def read(self, name: str) -> Any:
+        """
+        Read a single item of a plugin's data
+        :param name: name of the item
+        :return: the stored item
+        :raises KeyError: if no item has been stored under that name
+        """
+
+        raise NotImplementedError
+
+    def store(self, name: str, data: Any, keys: Iterable[Hashable] = None) -> bool:
+        """
+        Persist a single item of a plugin's data
+        :param name: name of the item
+        :param data: the item, has to be picklable
+        :param keys: for dict items, the keys added, changed or removed since the item was last stored (if known),
+                     backends able to persist single entries only write those
+        :return:    True, if the item was successfully stored
+                    False otherwise
+        """
+
+        raise NotImplementedError
+
+    def clear(self, name: str) -> bool:
+        """
+        Remove a single item of a plugin's data
+        :param name: name of the item
+        :return:    True, if the item was removed
+                    False, if there was no such item or it could not be removed
+        """
+
+        raise NotImplementedError
+
+    def load_all(self) -> Dict[str, Any]:
+        """
+        Read all of a plugin's data at once
+        :return: all stored items, keyed by name
+        """
+
+        raise NotImplementedError
+
+    async def write(self, changes: Dict[str, Any], keys: Dict[str, Set[Hashable]] = None) -> int:
+        """
+        Persist a batch of changes, serializing them in the event loop's thread (plugins may change their data in place)
+        :param changes: changed items keyed by name, DELETED for removed items
+        :param keys: touched keys of dict items, if known, see store()
+        :return: number of bytes written
+        :raises Exception: if the changes could not be persisted
+        """
+
+        raise NotImplementedError
+
+    async def flush(self):
+        """
+        Persist all pending changes, backends writing immediately have none
+        :return:
+        """
+
+        pass
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return: write statistics of the backend, if it keeps any
+        """
+
+        return {}
+
+
+class PickleBackend(PluginDataBackend):
+
+    def __init__(self, filename: str):
+        """
+        Keeps all of a plugin's data in a single pickle file, which is rewritten completely on every change
+        :param filename: path of the pickle file, usually plugins/<pluginname>.pkl
+        """
+
+        self.filename: str = filename
+        self.data: Dict[str, Any] or None = None
+
+    def load_all(self) -> Dict[str, Any]:
+
+        if self.data is None:
+            try:
+                self.data = pickle.load(open(self.filename, "rb"))
+            except FileNotFoundError:
+                logger.debug(f"File {self.filename} not found, plugin_data will be empty")
+                self.data = {}
+            except Exception as err:
+                logger.critical(f"Could not load plugin_data from {self.filename}: {err}")
+                self.data = {}
+
+        return self.data
+
+    def read(self, name: str) -> Any:
+
+        return self.load_all()[name]
+
+    def store(self, name: str, data: Any, keys: Iterable[Hashable] = None) -> bool:
+
+        self.load_all()[name] = data
+        return self.__save()
+
+    def clear(self, name: str) -> bool:
+
+        if name in self.load_all():
+            del self.data[name]
+            return self.__save()
+        else:
+            return False
+
+    def __save(self) -> bool:
+
+        if self.data != {}:
+            """there is actual data to save"""
+            try:
+                _atomic_write(self.filename, pickle.dumps(self.data))
+                return True
+            except Exception as err:
+                logger.critical(f"Could not write plugin_data to {self.filename}: {err}")
+                return False
+        else:
+            """no data to save, remove file"""
+            if path.isfile(self.filename):
+                try:
+                    remove(self.filename)
+                except Exception as err:
+                    logger.critical(f"Could not remove file {self.filename}: {err}")
+                    return False
+            return True
+
+    async def write(self, changes: Dict[str, Any], keys: Dict[str, Set[Hashable]] = None) -> int:
+
+        data: Dict[str, Any] = self.load_all()
+        for name, item in changes.items():
+            if item is DELETED:
+                data.pop(name, None)
+            else:
+                data[name] = item
+
+        loop = asyncio.get_event_loop()
+        if data != {}:
+            # serialize in the event loop's thread, plugins may change their data in place meanwhile
+            payload: bytes = pickle.dumps(data)
+            await loop.run_in_executor(None, _atomic_write, self.filename, payload)
+            return len(payload)
+        else:
+            if path.isfile(self.filename):
+                await loop.run_in_executor(None, remove, self.filename)
+            return 0
+
+
+class SqliteBackend(PluginDataBackend):
+
+    def __init__(self, store: Storage, plugin_name: str, pickle_filename: str or None = None):
+        """
+        Keeps a plugin's data in its own table of the bot's database, one row per item
+        Items are read on first access and written individually, so a change only costs the changed item
+        :param store: the bot's database
+        :param plugin_name: name of the plugin, used for the table name
+        :param pickle_filename: pickle file of the PickleBackend to migrate existing data from (once)
+        """
+
+        self.database: Storage = store
+        self.plugin_name: str = plugin_name
+
+        if store.create_plugin_table(plugin_name) and pickle_filename and path.isfile(pickle_filename):
+            self.__migrate(pickle_filename)
+
+    def __migrate(self, pickle_filename: str):
+
+        """Import the data of an existing pickle file, keeping the file as <filename>.migrated"""
+
+        try:
+            data: Dict[str, Any] = pickle.load(open(pickle_filename, "rb"))
+            self.database.set_plugin_data_many(self.plugin_name, {name: pickle.dumps(item) for name, item in data.items()})
+            rename(pickle_filename, f"{pickle_filename}.migrated")
+            logger.info(f"Migrated {len(data)} items of plugin_data from {pickle_filename} to the database")
+        except Exception as err:
+            logger.critical(f"Could not migrate plugin_data from {pickle_filename}: {err}")
+
+    def read(self, name: str) -> Any:
+
+        value: bytes or None = self.database.get_plugin_data(self.plugin_name, name)
+        if value is None:
+            raise KeyError(name)
+        return pickle.loads(value)
+
+    def store(self, name: str, data: Any, keys: Iterable[Hashable] = None) -> bool:
+
+        try:
+            self.database.set_plugin_data(self.plugin_name, name, pickle.dumps(data))
+            return True
+        except Exception as err:
+            logger.critical(f"Could not write plugin_data {name} of {self.plugin_name} to the database: {err}")
+            return False
+
+    def clear(self, name: str) -> bool:
+
+        try:
+            return self.database.delete_plugin_data(self.plugin_name, name)
+        except Exception as err:
+            logger.critical(f"Could not remove plugin_data {name} of {self.plugin_name} from the database: {err}")
+            return False
+
+    def load_all(self) -> Dict[str, Any]:
+
+        return {name: pickle.loads(value) for name, value in self.database.get_all_plugin_data(self.plugin_name).items()}
+
+    async def write(self, changes: Dict[str, Any], keys: Dict[str, Set[Hashable]] = None) -> int:
+
+        serialized: Dict[str, bytes] = {name: pickle.dumps(item) for name, item in changes.items() if item is not DELETED}
+
+        # the connection belongs to the event loop's thread, writing a few rows is cheap
+        self.database.set_plugin_data_many(self.plugin_name, serialized)
+        for name in changes.keys() - serialized.keys():
+            self.database.delete_plugin_data(self.plugin_name, name)
+
+        return sum(len(value) for value in serialized.values())
+
+
+class JournalBackend(PluginDataBackend):
+
+    def __init__(self, filename_base: str, compact_threshold: int = 256 * 1024, previous: PluginDataBackend = None):
+        """
+        Keeps a plugin's data as a snapshot plus a journal of changes appended since the snapshot was taken
+        Dictionaries are journaled per entry: storing a dict only appends its added, changed and removed entries.
+        If the plugin passes the keys it touched, only those are compared, otherwise all entries are.
+        Once the journal grows beyond compact_threshold (or the snapshot's size), it is compacted into a new snapshot
+        in the background.
+        :param filename_base: path without extension, usually plugins/<pluginname>, the backend uses .snapshot and .journal
+        :param compact_threshold: minimum journal size in bytes triggering a compaction
+        :param previous: backend to import existing data from, if there is neither a snapshot nor a journal yet
+        """
+
+        self.snapshot_filename: str = f"{filename_base}.snapshot"
+        self.journal_filename: str = f"{filename_base}.journal"
+        self.compact_threshold: int = compact_threshold
+
+        self.data: Dict[str, Any] = {}
+        self.__fingerprints: Dict[str, Dict[Hashable, bytes]] = {}
+        """digests of the persisted entries of all dict items, to find the entries changed by store()"""
+        self.__snapshot_size: int = 0
+        self.__journal_size: int = 0
+        self.__compaction: asyncio.Task or None = None
+        self.__journal_lock: asyncio.Lock or None = None
+        """held while appending outside of the event loop's thread or replacing the journal"""
+
+        self.records_appended: int = 0
+        self.bytes_appended: int = 0
+        self.compactions: int = 0
+
+        if path.isfile(self.snapshot_filename) or path.isfile(self.journal_filename):
+            self.__load()
+        elif previous is not None:
+            self.data = previous.load_all()
+            if self.data:
+                _atomic_write(self.snapshot_filename, pickle.dumps(self.data))
+                logger.info(f"Imported {len(self.data)} items of plugin_data into {self.snapshot_filename}")
+
+        for name, item in self.data.items():
+            if isinstance(item, dict):
+                self.__fingerprints[name] = self.__fingerprint(item)
+
+    @staticmethod
+    def __digest(value: Any) -> bytes:
+
+        return blake2b(pickle.dumps(value), digest_size=16).digest()
+
+    def __fingerprint(self, item: Dict) -> Dict[Hashable, bytes]:
+
+        return {key: self.__digest(value) for key, value in item.items()}
+
+    def __load(self):
+
+        """
+        Read the snapshot and replay the journal up to the last readable record, cutting off the rest
+        (e.g. a record truncated by a crash or referring to a class that does not exist anymore)
+        A copy of a journal cut off before its end is kept as <journal>.damaged
+        :raises PluginDataError: if the snapshot can not be read
+        """
+
+        if path.isfile(self.snapshot_filename):
+            with open(self.snapshot_filename, "rb") as file_stream:
+                payload: bytes = file_stream.read()
+            try:
+                self.data = pickle.loads(payload)
+            except Exception as err:
+                raise PluginDataError(f"Could not read {self.snapshot_filename}: {err.__class__.__name__} {err}") from err
+            self.__snapshot_size = len(payload)
+
+        if path.isfile(self.journal_filename):
+            with open(self.journal_filename, "rb") as file_stream:
+                journal: bytes = file_stream.read()
+
+            offset: int = 0
+            while offset < len(journal):
+                try:
+                    length: int = struct.unpack_from("<I", journal, offset)[0]
+                    if offset + 4 + length > len(journal):
+                        raise pickle.UnpicklingError("truncated record")
+                    record: Tuple = pickle.loads(journal[offset + 4:offset + 4 + length])
+                    self.__apply(record)
+                except Exception as err:
+                    logger.critical(f"Discarding {self.journal_filename} from byte {offset} of {len(journal)}, keeping a "
+                                    f"copy as {self.journal_filename}.damaged: {err.__class__.__name__} {err}")
+                    _atomic_write(f"{self.journal_filename}.damaged", journal)
+                    with open(self.journal_filename, "r+b") as file_stream:
+                        file_stream.truncate(offset)
+                    break
+                offset += 4 + length
+
+            self.__journal_size = offset
+
+    def __apply(self, record: Tuple):
+
+        """
+        Apply a journal record to self.data
+        After a compaction, the journal may start with records the snapshot already contains. Such records are
+        superseded by the records following them, so an update of an item that has been removed meanwhile is skipped,
+        an update of an item that has been replaced by another type sets the updated entries.
+        """
+
+        operation: str = record[0]
+        if operation == "set":
+            self.data[record[1]] = record[2]
+        elif operation == "update":
+            if record[1] not in self.data:
+                return
+            item: Any = self.data[record[1]]
+            if not isinstance(item, dict):
+                item = self.data[record[1]] = {}
+            item.update(record[2])
+            for key in record[3]:
+                item.pop(key, None)
+        elif operation == "del":
+            self.data.pop(record[1], None)
+
+    def __build_record(self, name: str, item: Any, keys: Iterable[Hashable] = None) -> Tuple[bytes, Callable[[], None]]:
+        """
+        Serialize the change of an item into a length-prefixed journal record
+        :param name: name of the item
+        :param item: the item, DELETED if it has been removed
+        :param keys: keys of a dict item touched since it was last stored, None to compare all of its entries
+        :return: the record and a function updating the item's fingerprints, to be called once the record is appended
+        """
+
+        record: Tuple
+        commit: Callable[[], None]
+        if item is DELETED:
+            record = ("del", name)
+            commit = lambda: self.__fingerprints.pop(name, None)
+        elif isinstance(item, dict) and name in self.__fingerprints:
+            previous: Dict[Hashable, bytes] = self.__fingerprints[name]
+            touched: Set[Hashable] = previous.keys() | item.keys() if keys is None else set(keys)
+            digests: Dict[Hashable, bytes] = {key: self.__digest(item[key]) for key in touched if key in item}
+            changed: Dict = {key: item[key] for key, digest in digests.items() if previous.get(key) != digest}
+            removed: List = [key for key in touched if key not in item and key in previous]
+            record = ("update", name, changed, removed)
+
+            def commit():
+                previous.update(digests)
+                for key in removed:
+                    previous.pop(key, None)
+        else:
+            record = ("set", name, item)
+            fingerprints: Dict[Hashable, bytes] or None = self.__fingerprint(item) if isinstance(item, dict) else None
+
+            def commit():
+                if fingerprints is None:
+                    self.__fingerprints.pop(name, None)
+                else:
+                    self.__fingerprints[name] = fingerprints
+
+        payload: bytes = pickle.dumps(record)
+        return struct.pack("<I", len(payload)) + payload, commit
+
+    def __append(self, records: bytes):
+
+        with open(self.journal_filename, "ab") as file_stream:
+            file_stream.write(records)
+            file_stream.flush()
+
+    def __appended(self, count: int, size: int):
+
+        """Count appended records and start a compaction once the journal has grown large enough"""
+
+        self.records_appended += count
+        self.bytes_appended += size
+        self.__journal_size += size
+        if self.__journal_size > max(self.compact_threshold, self.__snapshot_size):
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            if self.__compaction is None or self.__compaction.done():
+                self.__compaction = asyncio.ensure_future(self.compact())
+
+    def read(self, name: str) -> Any:
+
+        return self.data[name]
+
+    def store(self, name: str, data: Any, keys: Iterable[Hashable] = None) -> bool:
+
+        try:
+            record, commit = self.__build_record(name, data, keys)
+            self.__append(record)
+        except Exception as err:
+            logger.critical(f"Could not append plugin_data {name} to {self.journal_filename}: {err}")
+            # the persisted entries are unknown now, the next change of the item is journaled in full
+            self.__fingerprints.pop(name, None)
+            return False
+
+        commit()
+        self.data[name] = data
+        self.__appended(1, len(record))
+        return True
+
+    def clear(self, name: str) -> bool:
+
+        if name not in self.data:
+            return False
+
+        try:
+            record, commit = self.__build_record(name, DELETED)
+            self.__append(record)
+        except Exception as err:
+            logger.critical(f"Could not append removal of plugin_data {name} to {self.journal_filename}: {err}")
+            return False
+
+        commit()
+        del self.data[name]
+        self.__appended(1, len(record))
+        return True
+
+    def load_all(self) -> Dict[str, Any]:
+
+        return self.data
+
+    async def write(self, changes: Dict[str, Any], keys: Dict[str, Set[Hashable]] = None) -> int:
+
+        # serialize in the event loop's thread, plugins may change their data in place meanwhile
+        loop = asyncio.get_event_loop()
+        keys = keys or {}
+        built: List[Tuple[bytes, Callable[[], None]]] = [self.__build_record(name, item, keys.get(name))
+                                                         for name, item in changes.items()]
+        records: bytes = b"".join(record for record, commit in built)
+
+        async with self.__get_journal_lock():
+            try:
+                await loop.run_in_executor(None, self.__append, records)
+            except Exception:
+                # the persisted entries are unknown now, the next changes of these items are journaled in full
+                for name in changes.keys():
+                    self.__fingerprints.pop(name, None)
+                raise
+
+            for record, commit in built:
+                commit()
+            for name, item in changes.items():
+                if item is DELETED:
+                    self.data.pop(name, None)
+                else:
+                    self.data[name] = item
+            self.__appended(len(changes), len(records))
+
+        return len(records)
+
+    def __get_journal_lock(self) -> asyncio.Lock:
+
+        if self.__journal_lock is None:
+            self.__journal_lock = asyncio.Lock()
+        return self.__journal_lock
+
+    async def compact(self):
+        """
+        Write the current data as new snapshot and drop the journal records it contains
+        Records appended while the snapshot is written are kept
+        :return:
+        """
+
+        loop = asyncio.get_event_loop()
+        offset: int = self.__journal_size
+        try:
+            payload: bytes = pickle.dumps(self.data)
+            await loop.run_in_executor(None, _atomic_write, self.snapshot_filename, payload)
+
+            # records appended meanwhile are kept, replaying them is safe even if the snapshot contains them (see __apply)
+            tail: bytes = b""
+            async with self.__get_journal_lock():
+                if path.isfile(self.journal_filename):
+                    with open(self.journal_filename, "rb") as file_stream:
+                        file_stream.seek(offset)
+                        tail = file_stream.read()
+                _atomic_write(self.journal_filename, tail)
+        except Exception as err:
+            logger.critical(f"Could not compact {self.journal_filename}: {err}")
+            return
+
+        self.__snapshot_size = len(payload)
+        self.__journal_size = len(tail)
+        self.compactions += 1
+        logger.debug(f"Compacted {self.journal_filename} into a snapshot of {len(payload)} bytes")
+
+    def get_stats(self) -> Dict[str, int]:
+
+        return {
+            "records_appended": self.records_appended,
+            "bytes_appended": self.bytes_appended,
+            "journal_size": self.__journal_size,
+            "snapshot_size": self.__snapshot_size,
+            "compactions": self.compactions,
+        }
+
+
+class WriteBehindBackend(PluginDataBackend):
+
+    def __init__(self, backend: PluginDataBackend, window: float = 2):
+        """
+        Collects changes and persists them in batches using another backend
+        Changes within the same window are coalesced, only the latest version of an item gets written
+        :param backend: the backend actually persisting the data
+        :param window: seconds to wait for further changes after the first unsaved change
+        """
+
+        self.backend: PluginDataBackend = backend
+        self.window: float = window
+
+        self.__pending: Dict[str, Any] = {}
+        self.__pending_keys: Dict[str, Set[Hashable] or None] = {}
+        """keys touched by the pending changes of dict items, None if unknown"""
+        self.__in_flight: Dict[str, Any] = {}
+        self.__flush_handle: asyncio.TimerHandle or None = None
+        self.__lock: asyncio.Lock or None = None
+
+        self.requested_writes: int = 0
+        self.flushes: int = 0
+        self.items_written: int = 0
+        self.bytes_written: int = 0
+        self.failures: int = 0
+
+    def __lookup(self, name: str) -> Any:
+
+        """Find an unsaved item, raises KeyError if there are no unsaved changes for it"""
+
+        if name in self.__pending:
+            return self.__pending[name]
+        return self.__in_flight[name]
+
+    def read(self, name: str) -> Any:
+
+        try:
+            item: Any = self.__lookup(name)
+        except KeyError:
+            return self.backend.read(name)
+
+        if item is DELETED:
+            raise KeyError(name)
+        return item
+
+    def store(self, name: str, data: Any, keys: Iterable[Hashable] = None) -> bool:
+
+        self.requested_writes += 1
+        if keys is None or (name in self.__pending and self.__pending_keys.get(name) is None):
+            self.__pending_keys[name] = None
+        else:
+            self.__pending_keys[name] = self.__pending_keys.get(name, set()) | set(keys)
+        self.__pending[name] = data
+        self.__schedule_flush()
+        return True
+
+    def clear(self, name: str) -> bool:
+
+        try:
+            self.read(name)
+        except KeyError:
+            return False
+
+        self.requested_writes += 1
+        self.__pending[name] = DELETED
+        self.__pending_keys[name] = None
+        self.__schedule_flush()
+        return True
+
+    def load_all(self) -> Dict[str, Any]:
+
+        data: Dict[str, Any] = dict(self.backend.load_all())
+        for name, item in {**self.__in_flight, **self.__pending}.items():
+            if item is DELETED:
+                data.pop(name, None)
+            else:
+                data[name] = item
+
+        return data
+
+    async def write(self, changes: Dict[str, Any], keys: Dict[str, Set[Hashable]] = None) -> int:
+
+        return await self.backend.write(changes, keys)
+
+    def __schedule_flush(self):
+
+        if self.__flush_handle is not None:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # not running inside the event loop (e.g. while importing plugins), write immediately
+            self.__write_now()
+            return
+
+        self.__flush_handle = loop.call_later(self.window, lambda: asyncio.ensure_future(self.flush()))
+
+    def __write_now(self):
+
+        changes: Dict[str, Any] = self.__pending
+        keys: Dict[str, Set[Hashable] or None] = self.__pending_keys
+        self.__pending, self.__pending_keys = {}, {}
+        for name, item in changes.items():
+            if item is DELETED:
+                self.backend.clear(name)
+            else:
+                self.backend.store(name, item, keys.get(name))
+            self.items_written += 1
+
+    async def flush(self):
+        """
+        Persist all pending changes now, including changes made while flushing
+        :return:
+        """
+
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+
+        async with self.__lock:
+            if self.__flush_handle is not None:
+                self.__flush_handle.cancel()
+                self.__flush_handle = None
+
+            while self.__pending:
+                self.__in_flight, self.__pending = self.__pending, {}
+                keys: Dict[str, Set[Hashable]] = {name: touched for name, touched in self.__pending_keys.items()
+                                                  if touched is not None}
+                self.__pending_keys = {}
+                try:
+                    self.bytes_written += await self.backend.write(self.__in_flight, keys)
+                    self.flushes += 1
+                    self.items_written += len(self.__in_flight)
+                except Exception as err:
+                    # keep the changes (unless they have been superseded meanwhile) and retry with the next window
+                    self.failures += 1
+                    logger.critical(f"Could not write plugin_data, retrying in {self.window}s: {err}")
+                    # the touched keys of the failed changes are lost, they are written in full
+                    self.__pending_keys = {name: None for name in {**self.__in_flight, **self.__pending}}
+                    self.__pending = {**self.__in_flight, **self.__pending}
+                    self.__in_flight = {}
+                    self.__flush_handle = asyncio.get_event_loop().call_later(
+                        self.window, lambda: asyncio.ensure_future(self.flush()))
+                    return
+                finally:
+                    self.__in_flight = {}
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return:    requested writes, actually written items and bytes, and writes saved by coalescing changes
+        """
+
+        return {
+            "requested_writes": self.requested_writes,
+            "flushes": self.flushes,
+            "items_written": self.items_written,
+            "bytes_written": self.bytes_written,
+            "writes_saved": self.requested_writes - self.items_written - len(self.__pending),
+            "pending": len(self.__pending),
+            "failures": self.failures,
+            **self.backend.get_stats(),
+        }
+
+
+def create_backend(backend_name: str, plugin_name: str, pickle_filename: str, store: Storage or None = None,
+                   write_behind: float = 0) -> PluginDataBackend:
+    """
+    Create the data backend for a plugin
+    :param backend_name: "sqlite", "pickle" or "journal"
+    :param plugin_name: name of the plugin
+    :param pickle_filename: the plugin's pickle file, used by the pickle backend and migrated by the sqlite backend
+    :param store: the bot's database, required for the sqlite backend
+    :param write_behind: window in seconds to coalesce changes in, 0 to write every change immediately
+    :return: the backend
+    """
+
+    backend: PluginDataBackend
+    if backend_name == "sqlite" and store is not None:
+        backend = SqliteBackend(store, plugin_name, pickle_filename)
+    elif backend_name in ["sqlite", "pickle"]:
+        backend = PickleBackend(pickle_filename)
+    elif backend_name == "journal":
+        # data kept by the other backends so far is imported once
+        previous: PluginDataBackend = PickleBackend(pickle_filename)
+        if store is not None and store.has_plugin_table(plugin_name):
+            previous = SqliteBackend(store, plugin_name)
+        backend = JournalBackend(path.splitext(pickle_filename)[0], previous=previous)
+    else:
+        raise ValueError(f"Unknown plugin_data backend {backend_name}")
+
+    if write_behind > 0:
+        return WriteBehindBackend(backend, write_behind)
+    else:
+        return backend
@@ -3,76 +3,410 @@
 
 """
 
-from plugin import Plugin, PluginCommand, PluginHook
-
-from sys import modules
-from re import match
-from time import time
-import operator
-from typing import List, Dict, Callable
+from plugin import Plugin, PluginCommand, PluginHook, PluginTimer
+from plugin_manifest import PluginManifest, LazyPlugin
+from plugin_storage import create_backend
+from process_pool import process_pool
+from storage import Storage
+
+from dispatcher import Dispatcher
+from fuzzy_matching import CommandIndex
+from metrics import metrics, room_class
+from profiler import profiler
+from routing import RoutingTable
+from timers import TimerScheduler
+
+import asyncio
+import importlib
+import importlib.util
+import sys
+from glob import glob
+from os import path
+from time import monotonic
+from typing import List, Dict, Callable, Set, Tuple
+
+import plugins
 
 import logging
 logger = logging.getLogger(__name__)
 
-from fuzzywuzzy import fuzz
 
-# import all plugins
-try:
-    from plugins import *
-except ImportError as err:
-    logger.critical(f"Error importing plugin: {err.name}: {err}")
-except KeyError as err:
-    logger.critical(f"Error importing plugin: {err}")
+class PluginLoader:
 
+    def __init__(self, dispatcher: Dispatcher = None, hook_timeout: float = 10, lazy_loading: bool = False,
+                 manifest_filename: str = "plugins/manifest.yaml", store: Storage = None,
+                 data_backend: str = "sqlite", data_backend_overrides: Dict[str, str] = None, write_behind: float = 0):
+        self.dispatcher: Dispatcher or None = dispatcher
+        self.hook_timeout: float = hook_timeout
 
-class PluginLoader:
+        # plugins' data is kept in the bot's database, unless configured otherwise (or there is no database)
+        self.store: Storage or None = store
+        self.data_backend: str = data_backend
+        self.data_backend_overrides: Dict[str, str] = data_backend_overrides or {}
+        self.write_behind: float = write_behind
 
-    def __init__(self):
-        # get all loaded plugins from sys.modules and make them available as plugin_list
-        self.__plugin_list: Dict[str, Plugin] = {}
+        self.__plugin_list: Dict[str, Plugin or LazyPlugin] = {}
         self.commands: Dict[str, PluginCommand] = {}
         self.help_texts: Dict[str, str] = {}
         self.hooks: Dict[str, List[PluginHook]] = {}
-        self.timers: List[Callable] = []
-
-        for key in modules.keys():
-            if match("^plugins\.\w*", key):
-                # TODO: this needs to catch exceptions
-                found_plugin: Plugin = modules[key].plugin
-                if isinstance(found_plugin, Plugin):
-                    self.__plugin_list[found_plugin.name] = found_plugin
-
-        for plugin in self.__plugin_list.values():
-
-            """assemble all valid commands and their respective methods"""
-            self.commands.update(plugin.get_commands())
-
-            """assemble all hooks and their respective methods"""
-            event_type: str
-            plugin_hooks: List[PluginHook]
-            plugin_hook: PluginHook
-            for event_type, plugin_hooks in plugin.get_hooks().items():
-                if event_type in self.hooks.keys():
-                    for plugin_hook in plugin_hooks:
-                        self.hooks[event_type].append(plugin_hook)
-                else:
-                    self.hooks[event_type] = plugin_hooks
-
-            """assemble all timers and their respective methods"""
-            self.timers.extend(plugin.get_timers())
-
-            """load the plugin's saved data"""
-            plugin.plugin_data = plugin.load_data()
-            logger.info(f"Loaded plugin {plugin.name}:")
-            if plugin.get_commands() != {}:
-                logger.info(f"  Commands: {', '.join([*plugin.get_commands().keys()])}")
-            if plugin.get_hooks() != {}:
-                logger.info(f"  Hooks:    {', '.join([*plugin.get_hooks().keys()])}")
-            if plugin.get_timers():
-                timers: List[str] = []
-                for timer in plugin.get_timers():
-                    timers.append(timer.__name__)
-                logger.info(f"  Timers:   {', '.join(timers)}")
+        self.timers: List[PluginTimer] = []
+        self.timer_scheduler: TimerScheduler or None = None
+
+        self.startup_times: Dict[str, Dict[str, float or str]] = {}
+        """time spent on loading each plugin: {plugin_name: {"mode": "imported"/"lazy"/"activated", "seconds": float}}"""
+
+        self.__plugin_modules: Dict[str, str] = {}
+        """module name of each plugin: {plugin_name: module_name}"""
+
+        self.__source_mtimes: Dict[str, float] = {}
+        """modification time of each plugin module when it was loaded: {module_name: mtime}"""
+
+        self.__watch_task: asyncio.Task or None = None
+
+        self.on_sync_filter_change: Callable[[], None] or None = None
+        """called when hooks are (un-)registered for new event types at runtime, so the sync filter has to be rebuilt"""
+        self.__hook_event_types: Set[str] = set()
+        """event types of the registered hooks when the dispatch tables were last built"""
+
+        # with lazy loading, plugins are registered from their descriptors and only imported when first used
+        self.manifest: PluginManifest or None = PluginManifest(manifest_filename) if lazy_loading else None
+
+        module_name: str
+        for module_name in plugins.__all__:
+            start: float = monotonic()
+            mtime: float = self.__get_source_mtime(module_name)
+            self.__source_mtimes[module_name] = mtime
+            entry: Dict or None = self.manifest.get(module_name, mtime) if self.manifest else None
+
+            found_plugin: Plugin or LazyPlugin or None
+            if entry and not entry["timers"]:
+                found_plugin = LazyPlugin(module_name, entry, self.activate_plugin)
+                mode: str = "lazy"
+            else:
+                # plugins with timers are always imported, their timers need to run from the start
+                found_plugin = self.__import_plugin(module_name)
+                mode = "imported"
+                if self.manifest:
+                    if found_plugin:
+                        self.manifest.update(module_name, mtime, found_plugin)
+                    else:
+                        self.manifest.remove(module_name)
+
+            if found_plugin:
+                self.__plugin_modules[found_plugin.name] = module_name
+                self.__register_plugin(found_plugin)
+                self.startup_times[found_plugin.name] = {"mode": mode, "seconds": monotonic() - start}
+
+        if self.manifest:
+            self.manifest.save()
+
+        logger.info("Plugin startup times:")
+        for plugin_name, startup_time in self.startup_times.items():
+            logger.info(f"  {plugin_name}: {startup_time['seconds'] * 1000:.1f}ms ({startup_time['mode']})")
+
+        self.command_index: CommandIndex
+        self.command_routes: RoutingTable
+        self.hook_routes: Dict[str, RoutingTable]
+        self.build_dispatch_tables()
+
+    @staticmethod
+    def __get_source_mtime(module_name: str) -> float:
+
+        """Return the latest modification time of a plugin's module and configuration file"""
+
+        plugin_path: str = path.dirname(plugins.__file__)
+        mtimes: List[float] = [path.getmtime(path.join(plugin_path, f"{module_name}.py"))]
+        if path.exists(path.join(plugin_path, f"{module_name}.yaml")):
+            mtimes.append(path.getmtime(path.join(plugin_path, f"{module_name}.yaml")))
+
+        return max(mtimes)
+
+    def __import_plugin(self, module_name: str) -> Plugin or None:
+
+        """Import a plugin module and load the plugin's saved data"""
+
+        try:
+            module = importlib.import_module(f"plugins.{module_name}")
+            found_plugin: Plugin = module.plugin
+        except ImportError as err:
+            logger.critical(f"Error importing plugin {module_name}: {err.name}: {err}")
+            return None
+        except Exception as err:
+            logger.critical(f"Error importing plugin {module_name}: {err}")
+            return None
+
+        if not isinstance(found_plugin, Plugin):
+            logger.critical(f"Error importing plugin {module_name}: plugin is not an instance of Plugin")
+            return None
+
+        if not self.__attach_data_backend(found_plugin):
+            return None
+
+        return found_plugin
+
+    def __attach_data_backend(self, plugin: Plugin) -> bool:
+
+        """
+        Set up the backend persisting the plugin's data, migrating existing pickle files to the database
+        A plugin whose data can not be read is not loaded, instead of silently continuing with another (empty) backend
+        :return:    True, if the backend has been set up
+                    False otherwise
+        """
+
+        backend_name: str = self.data_backend_overrides.get(plugin.name, self.data_backend)
+        try:
+            plugin.set_data_backend(create_backend(backend_name, plugin.name, plugin.plugin_data_filename, self.store,
+                                                   self.write_behind))
+            return True
+        except Exception as err:
+            logger.critical(f"Could not set up {backend_name} data backend for plugin {plugin.name}, not loading it: {err}")
+            return False
+
+    def __register_plugin(self, plugin: Plugin or LazyPlugin):
+
+        """Add a plugin's commands, hooks and timers"""
+
+        self.__plugin_list[plugin.name] = plugin
+
+        """assemble all valid commands and their respective methods"""
+        self.commands.update(plugin.get_commands())
+
+        """assemble all hooks and their respective methods"""
+        event_type: str
+        plugin_hooks: List[PluginHook]
+        for event_type, plugin_hooks in plugin.get_hooks().items():
+            self.hooks.setdefault(event_type, []).extend(plugin_hooks)
+
+        """assemble all timers and their respective methods"""
+        self.timers.extend(plugin.get_timers())
+        if self.timer_scheduler:
+            for timer in plugin.get_timers():
+                self.timer_scheduler.add(timer)
+
+        logger.info(f"{'Registered' if isinstance(plugin, LazyPlugin) else 'Loaded'} plugin {plugin.name}:")
+        if plugin.get_commands() != {}:
+            logger.info(f"  Commands: {', '.join([*plugin.get_commands().keys()])}")
+        if plugin.get_hooks() != {}:
+            logger.info(f"  Hooks:    {', '.join([*plugin.get_hooks().keys()])}")
+        if plugin.get_timers():
+            timers: List[str] = []
+            for timer in plugin.get_timers():
+                timers.append(timer.method.__name__)
+            logger.info(f"  Timers:   {', '.join(timers)}")
+
+    def __unregister_plugin(self, plugin_name: str):
+
+        """Remove all commands, hooks and timers of a plugin"""
+
+        self.__plugin_list.pop(plugin_name, None)
+        self.commands = {name: plugin_command for name, plugin_command in self.commands.items() if plugin_command.plugin_name != plugin_name}
+        self.hooks = {event_type: [plugin_hook for plugin_hook in event_hooks if plugin_hook.plugin_name != plugin_name]
+                      for event_type, event_hooks in self.hooks.items()}
+        self.hooks = {event_type: event_hooks for event_type, event_hooks in self.hooks.items() if event_hooks}
+
+        for timer in [timer for timer in self.timers if timer.plugin_name == plugin_name]:
+            self.timers.remove(timer)
+            if self.timer_scheduler:
+                self.timer_scheduler.remove(timer)
+
+    def activate_plugin(self, plugin_name: str) -> Plugin:
+
+        """Import a lazily registered plugin and replace its stand-in by the actual plugin"""
+
+        found_plugin: Plugin or LazyPlugin = self.__plugin_list[plugin_name]
+        if not isinstance(found_plugin, LazyPlugin):
+            return found_plugin
+
+        start: float = monotonic()
+        imported_plugin: Plugin or None = self.__import_plugin(found_plugin.module_name)
+        if imported_plugin is None:
+            raise ImportError(f"Could not activate plugin {plugin_name}", name=found_plugin.module_name)
+
+        self.__unregister_plugin(plugin_name)
+        self.__register_plugin(imported_plugin)
+        self.build_dispatch_tables()
+        self.startup_times[plugin_name] = {"mode": "activated", "seconds": monotonic() - start}
+        logger.info(f"Activated plugin {plugin_name} in {self.startup_times[plugin_name]['seconds'] * 1000:.1f}ms")
+
+        return imported_plugin
+
+    async def reload_plugin(self, name: str) -> bool:
+
+        """
+        Re-import a single plugin module and replace the plugin's commands, hooks and timers, keeping its plugin_data.
+        The module is executed into a fresh module object, so a failing import leaves the running plugin untouched.
+        :param name: name of the plugin or its module, a module not loaded yet gets loaded
+        :return:    True, if the plugin has been (re-)loaded
+                    False otherwise
+        """
+
+        module_name: str = self.__plugin_modules.get(name, name)
+        full_name: str = f"plugins.{module_name}"
+        old_plugin: Plugin or LazyPlugin or None = self.__plugin_list.get(self.__get_plugin_name(module_name))
+
+        spec = importlib.util.find_spec(full_name)
+        if spec is None:
+            logger.error(f"Could not reload plugin {name}: module {full_name} not found")
+            return False
+
+        start: float = monotonic()
+        try:
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            new_plugin: Plugin = module.plugin
+            if not isinstance(new_plugin, Plugin):
+                raise TypeError("plugin is not an instance of Plugin")
+        except Exception as err:
+            logger.critical(f"Error reloading plugin {name}, keeping the running version: {err}")
+            return False
+
+        # persist all changes of the running version, reading them anew restores them using the reloaded classes
+        if isinstance(old_plugin, Plugin):
+            await old_plugin.data_backend.flush()
+
+        old_module = sys.modules.get(full_name)
+        sys.modules[full_name] = module
+        setattr(plugins, module_name, module)
+        if not self.__attach_data_backend(new_plugin):
+            logger.critical(f"Error reloading plugin {name}, keeping the running version")
+            if old_module is not None:
+                sys.modules[full_name] = old_module
+                setattr(plugins, module_name, old_module)
+            else:
+                del sys.modules[full_name]
+                delattr(plugins, module_name)
+            return False
+
+        if old_plugin:
+            self.__unregister_plugin(old_plugin.name)
+        self.__plugin_modules[new_plugin.name] = module_name
+
+        # worker processes keep running the code of the plugin's previous version
+        if any(plugin_command.execution == "process" for plugin_command in new_plugin.get_commands().values()):
+            process_pool.recycle()
+
+        self.__source_mtimes[module_name] = self.__get_source_mtime(module_name)
+        self.__register_plugin(new_plugin)
+        self.build_dispatch_tables()
+
+        if self.manifest:
+            self.manifest.update(module_name, self.__source_mtimes[module_name], new_plugin)
+            self.manifest.save()
+
+        self.startup_times[new_plugin.name] = {"mode": "reloaded", "seconds": monotonic() - start}
+        logger.info(f"Reloaded plugin {new_plugin.name} in {self.startup_times[new_plugin.name]['seconds'] * 1000:.1f}ms")
+        return True
+
+    def __get_plugin_name(self, module_name: str) -> str or None:
+
+        """Find the name of the plugin provided by a module"""
+
+        for plugin_name, plugin_module_name in self.__plugin_modules.items():
+            if plugin_module_name == module_name:
+                return plugin_name
+        return None
+
+    def start_watching(self, interval: float = 5):
+
+        """Watch the plugins-directory and reload modified (or load new) plugins automatically"""
+
+        if self.__watch_task is None or self.__watch_task.done():
+            self.__watch_task = asyncio.ensure_future(self.__watch(interval))
+
+    async def __watch(self, interval: float):
+
+        plugin_path: str = path.dirname(plugins.__file__)
+        while True:
+            await asyncio.sleep(interval)
+            module_name: str
+            for module_name in sorted(self.__list_modules(plugin_path)):
+                try:
+                    mtime: float = self.__get_source_mtime(module_name)
+                except OSError:
+                    # file vanished while scanning
+                    continue
+                if self.__source_mtimes.get(module_name) != mtime:
+                    logger.info(f"Plugin module {module_name} modified, reloading")
+                    self.__source_mtimes[module_name] = mtime
+                    await self.reload_plugin(module_name)
+
+    @staticmethod
+    def __list_modules(plugin_path: str) -> List[str]:
+
+        return [path.basename(filename)[:-3] for filename in glob(path.join(plugin_path, "*.py"))
+                if not filename.endswith("__init__.py")]
+
+    async def flush_data(self):
+
+        """Persist the pending data changes of all plugins, e.g. before shutting down"""
+
+        await asyncio.gather(*[plugin.data_backend.flush() for plugin in self.__plugin_list.values()
+                               if isinstance(plugin, Plugin)])
+
+    def get_data_stats(self) -> Dict[str, Dict[str, int]]:
+
+        """Write statistics of all plugins with data backends keeping statistics, keyed by plugin name"""
+
+        return {plugin.name: plugin.data_backend.get_stats() for plugin in self.__plugin_list.values()
+                if isinstance(plugin, Plugin) and plugin.data_backend.get_stats()}
+
+    def get_startup_times(self) -> Dict[str, Dict[str, float or str]]:
+
+        return self.startup_times
+
+    def build_dispatch_tables(self):
+
+        """(Re-)build the command index and per-room routing tables from the currently registered commands and hooks"""
+
+        self.command_index = CommandIndex(self.commands.keys())
+        self.command_routes = RoutingTable(self.commands.values())
+        self.hook_routes = {event_type: RoutingTable(event_hooks) for event_type, event_hooks in self.hooks.items()}
+
+        # the sync filter only contains the event types hooked when it was built (e.g. before a reload)
+        event_types: Set[str] = set(self.hooks.keys())
+        if event_types != self.__hook_event_types:
+            added: Set[str] = event_types - self.__hook_event_types
+            self.__hook_event_types = event_types
+            if self.on_sync_filter_change:
+                if added:
+                    logger.info(f"Hooks registered for {', '.join(sorted(added))}, updating the sync filter")
+                self.on_sync_filter_change()
+
+    def get_sync_filter(self, encryption_enabled: bool = False) -> Dict:
+
+        """
+        Build a sync filter only requesting what the registered commands and hooks actually use
+        :param encryption_enabled: whether encrypted events have to be synced, too
+        :return: the filter definition, in the format expected by the client-server API
+        """
+
+        # commands are received as room messages, hooks define their own event types
+        timeline_types: List[str] = ["m.room.message", *[event_type for event_type in self.hooks.keys() if event_type != "m.room.message"]]
+        if encryption_enabled:
+            timeline_types.append("m.room.encrypted")
+
+        # state changes within the timeline are still needed to keep the room state (names, members) up to date
+        timeline_types.extend(["m.room.create", "m.room.member", "m.room.name", "m.room.canonical_alias", "m.room.encryption"])
+
+        return {
+            "presence": {"not_types": ["*"]},
+            "account_data": {"not_types": ["*"]},
+            "room": {
+                "state": {"lazy_load_members": True},
+                "timeline": {"types": timeline_types, "lazy_load_members": True},
+                "ephemeral": {"not_types": ["*"]},
+                "account_data": {"not_types": ["*"]},
+            },
+        }
+
+    def has_hooks(self, event_type: str, room_id: str) -> bool:
+
+        """Check if any hook for event_type is valid for the given room"""
+
+        try:
+            return self.hook_routes[event_type].has_handlers(room_id)
+        except KeyError:
+            return False
 
     def get_plugins(self) -> Dict[str, Plugin]:
 
@@ -95,10 +429,20 @@ class PluginLoader:
 
         return self.commands
 
-    def get_timers(self) -> List[Callable]:
+    def get_timers(self) -> List[PluginTimer]:
 
         return self.timers
 
+    async def __run_plugin_method(self, handler: PluginCommand or PluginHook, *args):
+
+        """Run a command's or hook's method, limited by the dispatcher's per-plugin concurrency"""
+
+        if self.dispatcher:
+            async with self.dispatcher.plugin_slot(handler.plugin_name):
+                await handler.method(*args)
+        else:
+            await handler.method(*args)
+
     async def run_command(self, command):
 
         logger.debug(f"Running Command {command.command} with args {command.args}")
@@ -106,54 +450,102 @@ class PluginLoader:
         command_start = command.command.split()[0].lower()
         run_command: str = ""
 
-        if command_start in self.commands.keys():
-            run_command = command_start
-
-        # Command not found, try fuzzy matching
-        else:
-            ratios: Dict[str, int] = {}
-            for key in self.commands.keys():
-                if fuzz.ratio(command_start, key) > 60:
-                    ratios[key] = fuzz.ratio(command_start, key)
-
-            # Sort matching commands by match percentage and get the highest match
-            if ratios != {}:
-                run_command = sorted(ratios.items(), key=operator.itemgetter(1), reverse=True)[0][0]
+        # Try exact match first, fall back to fuzzy matching
+        resolved_command: str or None
+        if resolved_command := self.command_index.resolve(command_start):
+            run_command = resolved_command
 
         # check if we did actually find a matching command
         if run_command != "":
-            if self.commands[run_command].room_id is None or command.room.room_id in self.commands[run_command].room_id:
+            if self.command_routes.contains(self.commands[run_command], command.room.room_id):
+
+                plugin_command: PluginCommand = self.commands[run_command]
+                labels: Tuple[str, str, str] = (plugin_command.plugin_name, run_command, room_class(command.room))
+                outcome: str = "ok"
+                start: float = monotonic()
 
                 # Make sure, exceptions raised by plugins do not kill the bot
                 try:
-                    await self.commands[run_command].method(command)
+                    await self.__run_plugin_method(plugin_command, command)
                 except Exception as err:
+                    outcome = "error"
                     logger.critical(f"Plugin failed to catch exception caused by {command_start}: {err}")
+                finally:
+                    duration: float = monotonic() - start
+                    metrics.command_duration.observe(duration, *labels)
+                    metrics.commands.inc(*labels, outcome)
+                    profiler.record(plugin_command.plugin_name, duration)
 
     async def run_hooks(self, client, event_type: str, room, event):
 
-        if event_type in self.hooks.keys():
-            event_hooks: List[PluginHook] = self.hooks[event_type]
+        """Run all hooks valid for the event concurrently, each one limited by its timeout"""
+
+        if event_type in self.hook_routes.keys():
+            event_hooks = self.hook_routes[event_type].get(room.room_id)
+            if len(event_hooks) == 1:
+                await self.__run_hook(event_hooks[0], client, room, event)
+            elif event_hooks:
+                await asyncio.gather(*[self.__run_hook(event_hook, client, room, event) for event_hook in event_hooks])
+
+    async def __run_hook(self, event_hook: PluginHook, client, room, event):
 
-            event_hook: PluginHook
+        """Run a single hook, cancelling it if it exceeds its timeout"""
+
+        timeout: float = event_hook.timeout if event_hook.timeout is not None else self.hook_timeout
+        labels: Tuple[str, str, str] = (event_hook.plugin_name, event_hook.event_type, room_class(room))
+        outcome: str = "ok"
+        start: float = monotonic()
+
+        # Make sure, exceptions raised by plugins do not kill the bot
+        try:
+            await asyncio.wait_for(self.__run_plugin_method(event_hook, client, room.room_id, event), timeout)
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            event_hook.timeouts += 1
+            logger.warning(f"Hook {event_hook.method.__name__} of plugin {event_hook.plugin_name} timed out after {timeout}s on {room.room_id}")
+        except Exception as err:
+            outcome = "error"
+            event_hook.failures += 1
+            logger.critical(f"Plugin failed to catch exception caused by hook {event_hook.method} on"
+                            f" {room} for {event}: {err}")
+        finally:
+            duration: float = monotonic() - start
+            event_hook.record_latency(duration)
+            metrics.hook_duration.observe(duration, *labels)
+            metrics.hooks.inc(*labels, outcome)
+            profiler.record(event_hook.plugin_name, duration)
+
+    def get_hook_stats(self) -> Dict[str, Dict[str, float]]:
+
+        """Return call counts, timeouts, failures and latencies of all hooks, keyed by <event_type>:<plugin>.<method>"""
+
+        hook_stats: Dict[str, Dict[str, float]] = {}
+        for event_type, event_hooks in self.hooks.items():
             for event_hook in event_hooks:
-                if event_hook.room_id is None or room.room_id in event_hook.room_id:
-                    # Make sure, exceptions raised by plugins do not kill the bot
-                    try:
-                        await event_hook.method(client, room.room_id, event)
-                    except Exception as err:
-                        logger.critical(f"Plugin failed to catch exception caused by hook {event_hook.method} on"
-                                        f" {room} for {event}: {err}")
-
-    async def run_timers(self, client, timestamp: float) -> float:
-
-        """Do not run timers more often than every 30s"""
-        if time() >= timestamp+30:
-            for timer in self.get_timers():
-                try:
-                    await timer(client)
-                except Exception as err:
-                    logger.critical(f"Plugin failed to catch exception in {timer}: {err}")
-            return time()
+                hook_stats[f"{event_type}:{event_hook.plugin_name}.{event_hook.method.__name__}"] = event_hook.get_stats()
+
+        return hook_stats
+
+    def start_timers(self, client):
+
+        """Start running all registered timers in the background, independent of sync responses"""
+
+        if self.timer_scheduler is None:
+            self.timer_scheduler = TimerScheduler(client, self.timers)
+        self.timer_scheduler.start()
+
+    async def stop_timers(self):
+
+        """Stop running timers"""
+
+        if self.timer_scheduler:
+            await self.timer_scheduler.stop()
+
+    def get_timer_stats(self) -> Dict[str, Dict[str, float]]:
+
+        """Return runs, lag and run duration of all timers, keyed by <plugin>.<method>"""
+
+        if self.timer_scheduler:
+            return self.timer_scheduler.get_stats()
         else:
-            return timestamp
+            return {}
@@ -1,6 +1,6 @@
 from os.path import dirname, basename, isfile, join
 import glob
 
-# add all modules in this directory, allowing 'import plugins' statement in pluginloader
+# list all modules in this directory, allowing the pluginloader to import them one by one (or lazily)
 modules = glob.glob(join(dirname(__file__), "*.py"))
 __all__ = [basename(f)[:-3] for f in modules if isfile(f) and not f.endswith('__init__.py')]
@@ -0,0 +1,115 @@
+from plugin import Plugin
+from metrics import metrics
+from profiler import profiler, MODES
+
+import asyncio
+import re
+
+import logging
+logger = logging.getLogger(__name__)
+
+plugin = Plugin("botmaster", "Administration", "Commands reserved for the bot's botmasters")
+
+
+def setup():
+
+    plugin.add_command("reload", reload_command, "Reload a plugin without restarting the bot: `reload <pluginname>`")
+    plugin.add_command("stats", stats_command, "Show latencies of commands, hooks, timers and sent messages")
+    plugin.add_command("profile", profile_command, "Profile commands and hooks for a number of seconds or events: "
+                                                   "`profile [cprofile|sample] [<seconds>s|<events>]` (default: `cprofile 30s`), "
+                                                   "`profile stop` to stop early")
+
+
+def is_botmaster(command) -> bool:
+    """
+    Check if the command has been sent by one of the configured botmasters
+    :param command:
+    :return:    True, if the sender is a botmaster
+                False otherwise
+    """
+
+    return command.event.sender in command.config.botmasters
+
+
+async def reload_command(command):
+    """
+    Reload a single plugin, keeping its data and the running sync
+    :param command:
+    :return:
+    """
+
+    if not is_botmaster(command):
+        await plugin.reply_notice(command, "Only botmasters may reload plugins")
+        return
+
+    if len(command.args) != 1:
+        await plugin.reply_notice(command, "Usage: `reload <pluginname>`")
+        return
+
+    if await command.plugin_loader.reload_plugin(command.args[0]):
+        await plugin.reply_notice(command, f"Plugin {command.args[0]} reloaded")
+    else:
+        await plugin.reply_notice(command, f"Could not reload plugin {command.args[0]}, see log for details")
+
+
+async def stats_command(command):
+    """
+    Post an overview of the metrics recorded since the bot has been started
+    :param command:
+    :return:
+    """
+
+    if not is_botmaster(command):
+        await plugin.reply_notice(command, "Only botmasters may view statistics")
+        return
+
+    await plugin.reply_notice(command, metrics.summary())
+
+
+async def profile_command(command):
+    """
+    Profile all commands and hooks in the background and post a summary per plugin once done
+    :param command:
+    :return:
+    """
+
+    if not is_botmaster(command):
+        await plugin.reply_notice(command, "Only botmasters may profile the bot")
+        return
+
+    if command.args == ["stop"]:
+        if not profiler.stop():
+            await plugin.reply_notice(command, "No profiling session running")
+        return
+
+    mode: str = "cprofile"
+    seconds: float or None = 30
+    max_events: int or None = None
+    for arg in command.args:
+        if arg in MODES:
+            mode = arg
+        elif match := re.fullmatch(r"(\d+)s", arg):
+            seconds, max_events = int(match.group(1)), None
+        elif arg.isdigit():
+            seconds, max_events = None, int(arg)
+        else:
+            await plugin.reply_notice(command, "Usage: `profile [cprofile|sample] [<seconds>s|<events>]` or `profile stop`")
+            return
+
+    try:
+        finished: asyncio.Future = profiler.start(mode, seconds, max_events)
+    except (RuntimeError, ValueError) as err:
+        await plugin.reply_notice(command, str(err))
+        return
+
+    limit: str = f"{seconds}s" if seconds is not None else f"{max_events} events"
+    await plugin.reply_notice(command, f"Profiling ({mode}) for {limit}")
+
+    async def report():
+        await plugin.reply_notice(command, await finished)
+
+    # the room's further events have to be processed (and profiled) while waiting for the results
+    asyncio.ensure_future(report())
+
+
+setup()
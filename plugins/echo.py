@@ -1,11 +1,10 @@
-from chat_functions import send_typing
 from plugin import Plugin
 
 
 async def echo(command):
     """Echo back the command's arguments"""
     response = " ".join(command.args)
-    await send_typing(command.client, command.room.room_id, response)
+    await plugin.reply(command, response, delay=200)
 
 
 plugin = Plugin("echo", "General", "A very simple Echo plugin")
@@ -6,12 +6,13 @@ __author__ = "Dingo"
 from plugin import Plugin
 import re
 import random
-from chat_functions import send_typing
+from typing import List
 
 
-async def pick(command):
+def pick(args: List[str]) -> str or None:
+    """Pick an item, run in the shared process pool as expanding many ranges takes a while"""
 
-    message = " ".join(command.args)
+    message = " ".join(args)
     message = message.replace(" and say:", ":")
     try:
         pickstring, saystring = re.split(r": ", message, 1)
@@ -115,8 +116,8 @@ async def pick(command):
     else:
         return None
 
-    await send_typing(command.client, command.room.room_id, msg)
+    return msg
 
 plugin = Plugin("pick", "General", "Plugin to provide a simple, randomized !pick")
-plugin.add_command("pick", pick, "aids you in those really important life decisions")
+plugin.add_command("pick", pick, "aids you in those really important life decisions", execution="process", reply_delay=200)
 
@@ -126,17 +126,21 @@ class Quote:
             """optionally replace nicknames by userlinks"""
             if plugin.read_data("nick_links"):
                 nick: str
-                nick_link: str
-                for nick in nick_list:
-                    if nick_link := await plugin.link_user(command, nick, strictness="fuzzy", fuzziness=55):
+                nick_link: str or None
+                for nick, nick_link in (await plugin.link_users(command, nick_list, strictness="fuzzy", fuzziness=55)).items():
+                    if nick_link:
                         quote_text = quote_text.replace(f"&lt;{nick}&gt;", nick_link)
 
         else:
+            nick_links: Dict[str, str or None] = {}
+            if plugin.read_data("nick_links"):
+                nick_links = await plugin.link_users(command, [line.nick for line in self.lines], strictness="fuzzy", fuzziness=80)
+
             line: QuoteLine
             for line in self.lines:
                 if plugin.read_data("nick_links"):
-                    nick_link: str
-                    if nick_link := await plugin.link_user(command, line.nick, strictness="fuzzy", fuzziness=80):
+                    nick_link: str or None
+                    if nick_link := nick_links[line.nick]:
                         quote_text += f"{nick_link} {line.message}  \n"
                     else:
                         quote_text += f"&lt;{line.nick}&gt; {line.message}  \n"
@@ -509,12 +513,12 @@ async def quote_add_or_replace(command, quote_id: int = 0) -> Quote or None:
 
     if quote_id == 0:
         quotes[new_quote.id] = new_quote
-        plugin.store_data("quotes", quotes)
+        plugin.store_data("quotes", quotes, [new_quote.id])
         return quotes[new_quote.id]
     else:
         quotes[quote_id].lines = new_quote.lines
         quotes[quote_id].text = new_quote.text
-        plugin.store_data("quotes", quotes)
+        plugin.store_data("quotes", quotes, [quote_id])
         return quotes[quote_id]
 
 
@@ -539,7 +543,7 @@ async def quote_delete_command(command):
         try:
             if not quotes[quote_id].deleted:
                 quotes[quote_id].deleted = True
-                plugin.store_data("quotes", quotes)
+                plugin.store_data("quotes", quotes, [quote_id])
                 await plugin.reply_notice(command, f"Quote {quote_id} deleted")
         except KeyError:
             await plugin.reply_notice(command, f"Quote {quote_id} not found")
@@ -568,7 +572,7 @@ async def quote_restore_command(command):
         try:
             if quotes[quote_id].deleted:
                 quotes[quote_id].deleted = False
-                plugin.store_data("quotes", quotes)
+                plugin.store_data("quotes", quotes, [quote_id])
                 await plugin.reply_notice(command, f"Quote {quote_id} restored")
         except KeyError:
             await plugin.reply_notice(command, f"Quote {quote_id} not found")
@@ -626,7 +630,7 @@ async def quote_add_reaction(client: AsyncClient, room_id: str, event: UnknownEv
         quote_object: Quote = await find_quote_by_id(quotes, quote_id)
         await quote_object.quote_add_reaction(reaction)
         quotes[quote_id] = quote_object
-        plugin.store_data("quotes", quotes)
+        plugin.store_data("quotes", quotes, [quote_id])
 
 
 async def upgrade_quotes(command):
@@ -5,16 +5,16 @@ __author__ = "Dingo"
 
 from plugin import Plugin
 import random
-from chat_functions import send_typing
+from typing import List
 
 
-async def roll(command):
+def roll(args: List[str]) -> str:
+    """Roll the dice, run in the shared process pool as rolling up to 100000 dice takes a while"""
 
-    if not command.args:
-        await send_typing(command.client, command.room.room_id, "No argument given.")
-        return None
+    if not args:
+        return "No argument given."
     try:
-        number, rest = command.args[0].lower().split("d", 1)
+        number, rest = args[0].lower().split("d", 1)
         if number.strip() == "":
             number = 1
         else:
@@ -47,16 +47,13 @@ async def roll(command):
             modifier = 0
 
     except ValueError:
-        await send_typing(command.client, command.room.room_id, "Malformed argument! Use 1d6, 3d10 etc.")
-        return None
+        return "Malformed argument! Use 1d6, 3d10 etc."
     if number == 0 or sides == 0:
-        await send_typing(command.client, command.room.room_id, "Number of dice or sides per die are zero! Please use only nonzero numbers.")
-        return None
+        return "Number of dice or sides per die are zero! Please use only nonzero numbers."
     random.seed()
     roll_list = []
     if number > 100000:
-        await send_typing(command.client, command.room.room_id, "Number of dice too large! Try a more reasonable number. (5 digits are fine)")
-        return None
+        return "Number of dice too large! Try a more reasonable number. (5 digits are fine)"
     for _ in range(number):
         roll_list.append(random.randint(lowest_value, sides))
     if len(roll_list) > 50:
@@ -68,7 +65,7 @@ async def roll(command):
     if len(roll_list) == 1:
         result_list = ""
 
-    await send_typing(command.client, command.room.room_id, "**Result:** " + str(sum(roll_list) + modifier) + result_list)
+    return "**Result:** " + str(sum(roll_list) + modifier) + result_list
 
 plugin = Plugin("roll", "General", "Plugin to provide a simple, randomized !roll of dice")
-plugin.add_command("roll", roll, "the dice giveth and the dice taketh away")
+plugin.add_command("roll", roll, "the dice giveth and the dice taketh away", execution="process", reply_delay=200)
@@ -1,47 +1,74 @@
 # -*- coding: utf8 -*-
 from plugin import Plugin
-import requests
+from http_client import HttpRequestError, HttpResponse
 import humanize
 
 plugin = Plugin("sonarr", "TV-Shows", "Provides commands to query sonarr's API")
 
 
+class SonarrError(Exception):
+    """Raised when sonarr's API did not return the requested data"""
+    pass
+
+
 def setup():
     plugin.add_config("api_base", is_required=True)
     plugin.add_config("api_key", is_required=True)
     plugin.add_config("room_id", None, is_required=False)
+    # seconds the list of series is reused, and served while being refreshed in the background afterwards
+    plugin.add_config("series_cache_ttl", 300, is_required=False)
+    plugin.add_config("series_cache_stale_ttl", 3600, is_required=False)
     plugin.add_command("series", series, "Get a list of currently tracked series", [plugin.read_config("room_id")])
 
 
-async def series(command):
+async def fetch_series_table() -> str:
+    """
+    Fetch all series from sonarr and render them as a table
+    :return: the html table
+    :raises SonarrError: if sonarr could not be reached or returned an error
+    """
 
     api_path = "/series"
     api_parameters = {"apikey": plugin.read_config("api_key")}
 
-    shows = requests.get(plugin.read_config("api_base") + api_path, params=api_parameters)
+    try:
+        shows: HttpResponse = await plugin.http.get(plugin.read_config("api_base") + api_path, params=api_parameters)
+    except HttpRequestError as err:
+        raise SonarrError(f"Could not reach sonarr: {err}")
 
-    if shows.status_code == 200:
-        message = "<table><tr>"
-        cols = ["Title", "Seasons", "Episodes on Disk", "Size", "Status", "Rating"]
+    if shows.status != 200:
+        raise SonarrError(f"Response Code: {str(shows.status)}")
+
+    message = "<table><tr>"
+    cols = ["Title", "Seasons", "Episodes on Disk", "Size", "Status", "Rating"]
+    for col in cols:
+        message = message + f"<td><b>{col}</b></td>"
+    message = message + "</tr>"
+    sorted_shows = sorted(shows.json(), key=lambda i: i['title'])
+    for show in sorted_shows:
+        cols = [f"<a href=\"https://www.imdb.com/title/{show['imdbId']}\">{show['title']}</a>",
+                f"{str(show['seasonCount'])}",
+                f"{str(show['episodeCount'])}",
+                f"{str(humanize.naturalsize(show['sizeOnDisk']))}",
+                f"{str(show['status'])}",
+                f"{str(show['ratings']['value'])}"]
+        message = message + "<tr>"
         for col in cols:
-            message = message + f"<td><b>{col}</b></td>"
+            message = message + "<td>" + col + "</td>"
         message = message + "</tr>"
-        sorted_shows = sorted(shows.json(), key=lambda i: i['title'])
-        for show in sorted_shows:
-            cols = [f"<a href=\"https://www.imdb.com/title/{show['imdbId']}\">{show['title']}</a>",
-                    f"{str(show['seasonCount'])}",
-                    f"{str(show['episodeCount'])}",
-                    f"{str(humanize.naturalsize(show['sizeOnDisk']))}",
-                    f"{str(show['status'])}",
-                    f"{str(show['ratings']['value'])}"]
-            message = message + "<tr>"
-            for col in cols:
-                message = message + "<td>" + col + "</td>"
-            message = message + "</tr>"
-        message = message + "</table>"
-        await plugin.reply(command, message)
-
-    else:
-        await plugin.reply_notice(command, f"Response Code: {str(shows.status_code)}")
+    message = message + "</table>"
+    return message
+
+
+async def series(command):
+
+    try:
+        message = await plugin.cached("series", fetch_series_table, plugin.read_config("series_cache_ttl"),
+                                      plugin.read_config("series_cache_stale_ttl"))
+    except SonarrError as err:
+        await plugin.reply_notice(command, str(err))
+        return
+
+    await plugin.reply(command, message, format="html")
 
 setup()
@@ -1,15 +1,22 @@
 from plugin import Plugin
-from chat_functions import send_typing
 import random
 import os.path
 
+from typing import List
 
-async def spruch(command):
+plugin = Plugin("spruch", "General", "Plugin to provide a simple, randomized !spruch")
+
+
+@plugin.blocking
+def read_sprueche() -> List[str]:
     with open(os.path.join(os.path.dirname(__file__), "spruchdb.txt")) as spruchdb:
-        sprueche = spruchdb.readlines()
+        return spruchdb.readlines()
+
+
+async def spruch(command):
+    sprueche = await read_sprueche()
 
     message = random.choice(sprueche)
-    await send_typing(command.client, command.room.room_id, message)
+    await plugin.reply(command, message, delay=200)
 
-plugin = Plugin("spruch", "General", "Plugin to provide a simple, randomized !spruch")
 plugin.add_command("spruch", spruch, "famous quotes from even more famous people")
@@ -3,6 +3,7 @@ from plugin import Plugin
 from chat_functions import send_text_to_room
 from nio import AsyncClient
 
+import inspect
 import os.path
 import pickle
 from re import sub
@@ -18,11 +19,17 @@ except ImportError as err:
     logger.fatal(f"Module {err.name} not found")
     raise ImportError(name="translate")
 
+if not (inspect.iscoroutinefunction(googletrans.Translator.detect) and inspect.iscoroutinefunction(googletrans.Translator.translate)):
+    logger.fatal("googletrans with an asynchronous API is required, see requirements.txt")
+    raise ImportError(name="translate")
+
 allowed_rooms: List = ["!hIWWJKHWQMUcrVPRqW:pack.rocks", "!iAxDarGKqYCIKvNSgu:pack.rocks"]
 default_source: List = ['any']
 default_dest: str = 'en'
 default_bidirectional: bool = False
 roomsfile: str = os.path.join(os.path.dirname(__file__), os.path.basename(__file__)[:-3] + ".pickle")
+cache_ttl: int = 86400
+"""seconds detected languages and translations of a message are reused, e.g. for repeated messages"""
 
 """
 roomsdb = {
@@ -34,6 +41,23 @@ roomsdb = {
 }
 """
 
+plugin = Plugin("translate", "General", "Provide near-realtime translations of all room-messages via Google Translate")
+
+
+@plugin.blocking
+def load_rooms() -> dict:
+    try:
+        with open(roomsfile, "rb") as file:
+            return pickle.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+@plugin.blocking
+def save_rooms(roomsdb: dict):
+    with open(roomsfile, "wb") as file:
+        pickle.dump(roomsdb, file)
+
 
 async def switch(command):
     """Switch translation for room-messages on or off
@@ -43,12 +67,8 @@ async def switch(command):
 
     """
 
-    try:
-        roomsdb: dict = pickle.load(open(roomsfile, "rb"))
-        enabled_rooms_list: list = roomsdb.keys()
-    except FileNotFoundError:
-        roomsdb: dict = {}
-        enabled_rooms_list: list = []
+    roomsdb: dict = await load_rooms()
+    enabled_rooms_list: list = roomsdb.keys()
 
     if len(command.args) == 0:
         source_langs: list = default_source
@@ -70,13 +90,13 @@ async def switch(command):
 
     if command.room.room_id in enabled_rooms_list:
         del roomsdb[command.room.room_id]
-        pickle.dump(roomsdb, (open(roomsfile, "wb")))
+        await save_rooms(roomsdb)
         await send_text_to_room(command.client, command.room.room_id, "Translations disabled", notice=False)
     elif command.room.room_id in allowed_rooms:
         if dest_lang in googletrans.LANGUAGES.keys():
             if source_langs == ['any'] or all(elem in googletrans.LANGUAGES.keys() for elem in source_langs):
                 roomsdb[command.room.room_id] = {"source_langs": source_langs, "dest_lang": dest_lang, "bidirectional": bidirectional}
-                pickle.dump(roomsdb, (open(roomsfile, "wb")))
+                await save_rooms(roomsdb)
 
                 if bidirectional:
                     message = "Bidirectional translations (" + source_langs[0] + "<=>" + dest_lang + ") enabled - " \
@@ -88,19 +108,44 @@ async def switch(command):
                 await send_text_to_room(command.client, command.room.room_id, message, notice=False)
 
 
+async def detect_language(message: str) -> str:
+    """
+    Detect the language of a message, googletrans sends its requests asynchronously, without blocking the event loop
+    :param message: the message
+    :return: the language code
+    """
+
+    async def fetch():
+        async with googletrans.Translator() as translator:
+            return (await translator.detect(message)).lang
+
+    return await plugin.cached(("detect", message), fetch, cache_ttl)
+
+
+async def translate_text(message: str, dest_lang: str) -> str:
+    """
+    Translate a message, see detect_language
+    :param message: the message
+    :param dest_lang: code of the language to translate to
+    :return: the translated message
+    """
+
+    async def fetch():
+        async with googletrans.Translator() as translator:
+            return (await translator.translate(message, dest=dest_lang)).text
+
+    return await plugin.cached(("translate", message, dest_lang), fetch, cache_ttl)
+
+
 async def translate(client: AsyncClient, room_id: str, message: str):
 
-    try:
-        roomsdb = pickle.load(open(roomsfile, "rb"))
-    except FileNotFoundError:
-        roomsdb = {}
+    roomsdb = await load_rooms()
 
     if room_id in allowed_rooms and room_id in roomsdb.keys():
         # Remove special characters before translation
         message = sub('[^A-z0-9\-\.\?!:\sÄäÜüÖö]+', '', message)
-        trans = googletrans.Translator()
         logger.debug(f"Detecting language for message: {message}")
-        message_source_lang = trans.detect(message).lang
+        message_source_lang = await detect_language(message)
         if roomsdb[room_id]["bidirectional"]:
             languages = [roomsdb[room_id]["source_langs"][0], roomsdb[room_id["dest_lang"]]]
             if message_source_lang in languages:
@@ -108,15 +153,14 @@ async def translate(client: AsyncClient, room_id: str, message: str):
                 dest_lang = set(languages).difference([message_source_lang])
                 if len(dest_lang) == 1:
                     dest_lang = dest_lang.pop()
-                    translated = trans.translate(message, dest=dest_lang).text
+                    translated = await translate_text(message, dest_lang)
                     await send_text_to_room(client, room_id, translated)
         else:
             if message_source_lang != roomsdb[room_id]["dest_lang"] and (roomsdb[room_id]["source_langs"] == ['any'] or message_source_lang in roomsdb[room_id]["source_langs"]):
-                translated = trans.translate(message, dest=roomsdb[room_id]["dest_lang"]).text
+                translated = await translate_text(message, roomsdb[room_id]["dest_lang"])
                 await send_text_to_room(client, room_id, translated)
 
 
-plugin = Plugin("translate", "General", "Provide near-realtime translations of all room-messages via Google Translate")
 plugin.add_command("translate", switch, "`translate [[bi] source_lang... dest_lang]` - translate text from "
                                         "one or more source_lang to dest_lang", allowed_rooms)
 plugin.add_hook("m.room.message", translate, allowed_rooms)
@@ -0,0 +1,153 @@
+"""
+    Shared process pool for CPU-heavy parts of plugin commands
+
+"""
+
+import asyncio
+import multiprocessing
+import random
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class CPUBudgetExceeded(Exception):
+    """Raised inside a worker process when a call used up its CPU time budget"""
+    pass
+
+
+def _init_worker():
+    """Make sure workers forked from the same (fork-)server don't share its random state"""
+
+    random.seed()
+
+
+def _budget_exceeded(signum, frame):
+
+    raise CPUBudgetExceeded()
+
+
+def _run_with_budget(method: Callable, cpu_budget: float, args: tuple) -> Any:
+    """
+    Run method in the worker process, raising CPUBudgetExceeded once it used more than cpu_budget seconds of CPU time
+    :param method: a picklable (module-level) function
+    :param cpu_budget: CPU time budget in seconds, 0 for no limit
+    :param args: arguments passed to method
+    :return: the result of method
+    """
+
+    # ITIMER_PROF counts CPU time (user and system) of the worker process, not available on windows
+    if cpu_budget > 0 and hasattr(signal, "setitimer"):
+        signal.signal(signal.SIGPROF, _budget_exceeded)
+        signal.setitimer(signal.ITIMER_PROF, cpu_budget)
+        try:
+            return method(*args)
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+    else:
+        return method(*args)
+
+
+class ProcessPool:
+
+    def __init__(self, max_workers: int = 2, cpu_budget: float = 5):
+        """
+        Lazily started pool of worker processes shared by all plugins
+        :param max_workers: number of worker processes
+        :param cpu_budget: default CPU time budget per call in seconds
+        """
+
+        self.max_workers: int = max_workers
+        self.cpu_budget: float = cpu_budget
+        self.__executor: ProcessPoolExecutor or None = None
+
+        # forking the bot itself could copy locks held by its threads (e.g. of the thread pool) into the workers,
+        # workers are started from a fresh fork server (or interpreter) instead, importing plugins from their files
+        self.__context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+        self.calls: int = 0
+        self.budget_exceeded: int = 0
+        self.failures: int = 0
+
+    async def run(self, method: Callable, *args, cpu_budget: float = None) -> Any:
+        """
+        Run a picklable function in one of the worker processes without blocking the event loop
+        :param method: a module-level function, its arguments and result have to be picklable
+        :param args: arguments passed to method
+        :param cpu_budget: optional CPU time budget in seconds, overriding the pool's default
+        :return: the result of method
+        :raises CPUBudgetExceeded: if the call used up its CPU time budget
+        """
+
+        self.__start_executor()
+
+        self.calls += 1
+        budget: float = self.cpu_budget if cpu_budget is None else cpu_budget
+        try:
+            return await asyncio.get_event_loop().run_in_executor(self.__executor, _run_with_budget, method, budget, args)
+        except CPUBudgetExceeded:
+            self.budget_exceeded += 1
+            logger.warning(f"{method.__name__} exceeded its CPU time budget of {budget}s")
+            raise
+        except BrokenProcessPool:
+            # a worker died, start a new pool with the next call
+            self.failures += 1
+            self.__executor = None
+            raise
+        except Exception:
+            self.failures += 1
+            raise
+
+    def __start_executor(self):
+
+        if self.__executor is None:
+            self.__executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self.__context,
+                                                  initializer=_init_worker)
+
+    async def start(self):
+        """
+        Start all worker processes now instead of on the first calls, which would have to wait for them
+        :return:
+        """
+
+        self.__start_executor()
+        loop = asyncio.get_event_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.__executor, _init_worker) for _ in range(self.max_workers)])
+
+    def recycle(self):
+        """
+        Replace the worker processes with new ones on the next call, e.g. after a plugin with process commands has
+        been reloaded, as workers keep running the plugin code they imported first
+        Calls already submitted are finished by the old workers
+        :return:
+        """
+
+        if self.__executor:
+            logger.info("Recycling the worker processes")
+        self.shutdown()
+
+    def shutdown(self):
+        """
+        Stop all worker processes
+        :return:
+        """
+
+        if self.__executor:
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return: number of calls, calls exceeding their budget and failed calls
+        """
+
+        return {"calls": self.calls, "budget_exceeded": self.budget_exceeded, "failures": self.failures}
+
+
+process_pool: ProcessPool = ProcessPool()
+"""the pool shared by all plugins, configured in main.py"""
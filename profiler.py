@@ -0,0 +1,265 @@
+"""
+    On-demand profiling of the commands and hooks run by plugins, started by botmasters for a number of seconds or events
+
+"""
+
+import asyncio
+import cProfile
+import os
+import pstats
+import sys
+import threading
+from datetime import datetime
+from time import monotonic
+from typing import Dict, List, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+MODES: Tuple[str, ...] = ("cprofile", "sample")
+"""cprofile: deterministic profiling of all calls, sample: periodically sample the event loop's stack (less overhead)"""
+
+FunctionKey = Tuple[str, int, str]
+"""(filename, first line, function name), as used by pstats"""
+
+
+class ProfilingSession:
+
+    def __init__(self, mode: str, seconds: float or None, max_events: int or None):
+        """
+        A single profiling run
+        :param mode: "cprofile" or "sample"
+        :param seconds: stop after this many seconds, None for no time limit
+        :param max_events: stop after this many commands and hooks, None for no limit
+        """
+
+        self.mode: str = mode
+        self.seconds: float or None = seconds
+        self.max_events: int or None = max_events
+        self.started: float = monotonic()
+        self.duration: float = 0.0
+
+        self.events: int = 0
+        self.plugin_events: Dict[str, int] = {}
+        self.plugin_times: Dict[str, float] = {}
+        """wall-clock time spent in each plugin's commands and hooks"""
+
+        self.finished: asyncio.Future = asyncio.get_event_loop().create_future()
+        self.timer: asyncio.TimerHandle or None = None
+
+
+class Sampler(threading.Thread):
+
+    def __init__(self, thread_id: int, interval: float):
+        """
+        Samples the stack of another thread in regular intervals
+        :param thread_id: ident of the thread to sample (the one running the event loop)
+        :param interval: seconds between two samples
+        """
+
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.thread_id: int = thread_id
+        self.interval: float = interval
+        self.samples: int = 0
+        self.stacks: Dict[Tuple[FunctionKey, ...], int] = {}
+        """number of samples of each stack (outermost function first)"""
+        self.__stop_event: threading.Event = threading.Event()
+
+    def run(self):
+
+        while not self.__stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack: List[FunctionKey] = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            self.samples += 1
+            key: Tuple[FunctionKey, ...] = tuple(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def stop(self):
+
+        self.__stop_event.set()
+        self.join()
+
+
+class Profiler:
+
+    def __init__(self, directory: str = "profiles", plugin_directory: str = "plugins", sample_interval: float = 0.005,
+                 top: int = 5):
+        """
+        Profiles the bot while botmasters investigate which plugin slows it down
+        Only one session can be active at a time, its results are written to directory and summarized per plugin
+        :param directory: where to write the results (pstats files for cprofile, collapsed stacks for sample)
+        :param plugin_directory: directory holding the plugins, used to attribute functions to plugins
+        :param sample_interval: seconds between two samples in "sample" mode
+        :param top: number of functions listed per plugin in the summary
+        """
+
+        self.directory: str = directory
+        self.plugin_directory: str = os.path.abspath(plugin_directory)
+        self.sample_interval: float = sample_interval
+        self.top: int = top
+
+        self.session: ProfilingSession or None = None
+        self.__profile: cProfile.Profile or None = None
+        self.__sampler: Sampler or None = None
+
+    def start(self, mode: str = "cprofile", seconds: float or None = 30, max_events: int or None = None) -> asyncio.Future:
+        """
+        Start profiling
+        :param mode: "cprofile" or "sample"
+        :param seconds: stop after this many seconds, None for no time limit
+        :param max_events: stop after this many commands and hooks, None for no limit
+        :return: future resolving to the summary of the session once it has been stopped
+        """
+
+        if self.session is not None:
+            raise RuntimeError("A profiling session is already running")
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode}, expected one of {', '.join(MODES)}")
+        if seconds is None and max_events is None:
+            raise ValueError("A profiling session needs a time or event limit")
+
+        self.session = ProfilingSession(mode, seconds, max_events)
+        if seconds is not None:
+            self.session.timer = asyncio.get_event_loop().call_later(seconds, self.stop)
+
+        if mode == "cprofile":
+            self.__profile = cProfile.Profile()
+            self.__profile.enable()
+        else:
+            self.__sampler = Sampler(threading.get_ident(), self.sample_interval)
+            self.__sampler.start()
+
+        logger.info(f"Started profiling ({mode}, seconds: {seconds}, events: {max_events})")
+        return self.session.finished
+
+    def record(self, plugin_name: str, duration: float):
+        """
+        Count a command or hook run during the current session, if any
+        :param plugin_name: name of the plugin the command or hook belongs to
+        :param duration: seconds spent running it
+        :return:
+        """
+
+        session: ProfilingSession or None = self.session
+        if session is None:
+            return
+
+        session.events += 1
+        session.plugin_events[plugin_name] = session.plugin_events.get(plugin_name, 0) + 1
+        session.plugin_times[plugin_name] = session.plugin_times.get(plugin_name, 0.0) + duration
+        if session.max_events is not None and session.events >= session.max_events:
+            self.stop()
+
+    def stop(self) -> bool:
+        """
+        Stop the current session, write its results and resolve its future with the summary
+        :return:    True, if a session has been stopped
+                    False, if no session was running
+        """
+
+        session: ProfilingSession or None = self.session
+        if session is None:
+            return False
+
+        self.session = None
+        session.duration = monotonic() - session.started
+        if session.timer is not None:
+            session.timer.cancel()
+
+        filename: str
+        function_times: Dict[FunctionKey, float]
+        if self.__profile is not None:
+            self.__profile.disable()
+            filename = self.__dump_cprofile(self.__profile)
+            function_times = {key: value[3] for key, value in pstats.Stats(self.__profile).stats.items()}
+            self.__profile = None
+        else:
+            self.__sampler.stop()
+            filename = self.__dump_samples(self.__sampler)
+            function_times = self.__sampled_times(self.__sampler, session.duration)
+            self.__sampler = None
+
+        logger.info(f"Stopped profiling after {session.duration:.1f}s and {session.events} events, results in {filename}")
+        if not session.finished.done():
+            session.finished.set_result(self.summarize(session, function_times, filename))
+        return True
+
+    def __filename(self, extension: str) -> str:
+
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.{extension}")
+
+    def __dump_cprofile(self, profile: cProfile.Profile) -> str:
+
+        filename: str = self.__filename("pstats")
+        profile.dump_stats(filename)
+        return filename
+
+    def __dump_samples(self, sampler: Sampler) -> str:
+
+        """Write the sampled stacks in the collapsed format read by flamegraph tools"""
+
+        filename: str = self.__filename("folded")
+        with open(filename, "w") as file:
+            for stack, count in sampler.stacks.items():
+                file.write(";".join(f"{name} ({os.path.basename(path)}:{line})" for path, line, name in stack) + f" {count}\n")
+        return filename
+
+    @staticmethod
+    def __sampled_times(sampler: Sampler, duration: float) -> Dict[FunctionKey, float]:
+
+        """Estimate the cumulative time of each function from the share of samples it appeared in"""
+
+        # samples are taken less often than requested while the event loop holds the GIL, so use their share
+        per_sample: float = duration / max(sampler.samples, 1)
+        times: Dict[FunctionKey, float] = {}
+        for stack, count in sampler.stacks.items():
+            for function in set(stack):
+                times[function] = times.get(function, 0.0) + count * per_sample
+        return times
+
+    def plugin_of(self, filename: str) -> str or None:
+        """
+        Find the plugin a source file belongs to
+        :param filename: path of the source file
+        :return:    name of the plugin (module or package name)
+                    None, if the file is not part of a plugin
+        """
+
+        path: str = os.path.abspath(filename)
+        if not path.startswith(self.plugin_directory + os.sep):
+            return None
+        return os.path.relpath(path, self.plugin_directory).split(os.sep)[0].split(".")[0]
+
+    def summarize(self, session: ProfilingSession, function_times: Dict[FunctionKey, float], filename: str) -> str:
+        """
+        Summarize a session per plugin
+        :param session: the finished session
+        :param function_times: cumulative seconds spent in each function
+        :param filename: file holding the full results
+        :return: markdown summary listing each plugin's time and its top functions by cumulative time
+        """
+
+        plugin_functions: Dict[str, List[Tuple[float, FunctionKey]]] = {}
+        for key, cumulative in function_times.items():
+            if (plugin_name := self.plugin_of(key[0])) is not None:
+                plugin_functions.setdefault(plugin_name, []).append((cumulative, key))
+
+        lines: List[str] = [f"Profiled ({session.mode}) for {session.duration:.1f}s and {session.events} events, "
+                            f"results in `{filename}`  "]
+        plugin_names: List[str] = sorted(set(session.plugin_times) | set(plugin_functions),
+                                         key=lambda name: session.plugin_times.get(name, 0.0), reverse=True)
+        for plugin_name in plugin_names:
+            lines.append(f"**{plugin_name}**: {session.plugin_events.get(plugin_name, 0)} events, "
+                         f"{session.plugin_times.get(plugin_name, 0.0) * 1000:.0f}ms  ")
+            for cumulative, (path, line, name) in sorted(plugin_functions.get(plugin_name, []), reverse=True)[:self.top]:
+                lines.append(f"- `{name}` ({os.path.basename(path)}:{line}): {cumulative * 1000:.1f}ms cumulative")
+        return "\n".join(lines)
+
+
+profiler: Profiler = Profiler()
+"""the profiler controlled by the botmasters' profile command"""
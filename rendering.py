@@ -0,0 +1,102 @@
+"""
+    Rendering of outgoing messages into the body and formatted_body of m.room.message events
+
+"""
+
+from collections import OrderedDict
+from html import unescape
+import re
+from typing import Dict, Tuple
+
+from markdown import Markdown
+
+import logging
+logger = logging.getLogger(__name__)
+
+FORMATS: Tuple[str, ...] = ("markdown", "html", "plain")
+"""markdown: convert the message to html, html: the message already is html, plain: send the message as is"""
+
+_tag_pattern = re.compile(r"<[^>]+>")
+_break_pattern = re.compile(r"<br\s*/?>|</p>|</tr>|</li>", re.IGNORECASE)
+_cell_pattern = re.compile(r"</t[dh]>", re.IGNORECASE)
+
+
+class Renderer:
+
+    def __init__(self, cache_size: int = 256):
+        """
+        Converts messages using a single, reusable Markdown instance, remembering recently converted messages
+        (e.g. help texts or other static responses)
+        :param cache_size: number of converted messages to keep
+        """
+
+        self.cache_size: int = cache_size
+        self.__markdown: Markdown = Markdown()
+        self.__cache: OrderedDict = OrderedDict()
+        """LRU of message -> html"""
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.skipped: int = 0
+
+    def markdown_to_html(self, message: str) -> str:
+        """
+        Convert a markdown message to html
+        :param message: the message
+        :return: the html
+        """
+
+        if message in self.__cache:
+            self.hits += 1
+            self.__cache.move_to_end(message)
+            return self.__cache[message]
+
+        self.misses += 1
+        html: str = self.__markdown.reset().convert(message)
+
+        self.__cache[message] = html
+        if len(self.__cache) > self.cache_size:
+            self.__cache.popitem(last=False)
+
+        return html
+
+    @staticmethod
+    def html_to_text(html: str) -> str:
+        """
+        Build the plain text fallback of a html message by removing all tags
+        :param html: the html
+        :return: the plain text
+        """
+
+        text: str = _cell_pattern.sub(" ", _break_pattern.sub("\n", html))
+        return unescape(_tag_pattern.sub("", text)).strip()
+
+    def render(self, message: str, message_format: str = "markdown") -> Tuple[str, str or None]:
+        """
+        Render a message for sending
+        :param message: the message
+        :param message_format: "markdown", "html" or "plain"
+        :return: (body, formatted_body), formatted_body being None for plain messages
+        """
+
+        if message_format == "markdown":
+            return message, self.markdown_to_html(message)
+
+        self.skipped += 1
+        if message_format == "html":
+            return self.html_to_text(message), message
+        elif message_format == "plain":
+            return message, None
+        else:
+            raise ValueError(f"Unknown message format {message_format}, expected one of {', '.join(FORMATS)}")
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return: cache hits and misses of markdown conversions, messages not needing any conversion
+        """
+
+        return {"hits": self.hits, "misses": self.misses, "skipped": self.skipped, "cached": len(self.__cache)}
+
+
+renderer: Renderer = Renderer()
+"""the renderer used for all outgoing messages"""
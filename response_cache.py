@@ -0,0 +1,149 @@
+"""
+    Cache for results of slow external requests (e.g. API calls of plugins), shared by all plugins
+
+"""
+
+import asyncio
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry:
+
+    def __init__(self, value: Any, ttl: float, stale_ttl: float):
+        """
+        A cached result
+        :param value: the result
+        :param ttl: seconds the result is fresh
+        :param stale_ttl: seconds the result may be served while being refreshed after it expired
+        """
+
+        self.value: Any = value
+        self.expires: float = monotonic() + ttl
+        self.stale_until: float = self.expires + stale_ttl
+
+
+class ResponseCache:
+
+    def __init__(self, max_entries: int = 1024):
+        """
+        Remembers results for a given time, refreshing expired results in the background (stale-while-revalidate)
+        Concurrent requests for the same key share a single fetch, the least recently used entries are evicted first
+        :param max_entries: maximum number of cached results
+        """
+
+        self.max_entries: int = max_entries
+        self.__entries: OrderedDict = OrderedDict()
+        """LRU of key -> CacheEntry"""
+        self.__fetches: Dict[Hashable, asyncio.Future] = {}
+        """fetches currently running, by key"""
+
+        self.hits: int = 0
+        self.stale_hits: int = 0
+        self.misses: int = 0
+        self.coalesced: int = 0
+        self.refreshes: int = 0
+        self.evictions: int = 0
+        self.errors: int = 0
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable], ttl: float, stale_ttl: float = 0) -> Any:
+        """
+        Get a result from the cache, fetching it if needed
+        :param key: identifies the result, e.g. (plugin name, endpoint)
+        :param fetch: callable returning an awaitable producing the result, exceptions are passed on and not cached
+        :param ttl: seconds a fetched result is fresh
+        :param stale_ttl: seconds an expired result is still served while it's being refreshed in the background
+        :return: the (possibly stale) result
+        """
+
+        now: float = monotonic()
+        entry: CacheEntry or None = self.__entries.get(key)
+        if entry is not None:
+            if now < entry.expires:
+                self.hits += 1
+                self.__entries.move_to_end(key)
+                return entry.value
+            if now < entry.stale_until:
+                self.stale_hits += 1
+                self.__entries.move_to_end(key)
+                if key not in self.__fetches:
+                    self.refreshes += 1
+                    self.__start_fetch(key, fetch, ttl, stale_ttl).add_done_callback(self.__log_refresh_error)
+                return entry.value
+
+        if key in self.__fetches:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            self.__start_fetch(key, fetch, ttl, stale_ttl)
+        # shield the shared fetch, so a cancelled caller does not cancel it for everyone else
+        return await asyncio.shield(self.__fetches[key])
+
+    def __start_fetch(self, key: Hashable, fetch: Callable[[], Awaitable], ttl: float, stale_ttl: float) -> asyncio.Future:
+
+        async def run():
+            try:
+                value: Any = await fetch()
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                del self.__fetches[key]
+            self.__store(key, CacheEntry(value, ttl, stale_ttl))
+            return value
+
+        task: asyncio.Future = asyncio.ensure_future(run())
+        # mark exceptions as retrieved, in case every caller waiting for the fetch has been cancelled
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self.__fetches[key] = task
+        return task
+
+    def __store(self, key: Hashable, entry: CacheEntry):
+
+        self.__entries[key] = entry
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+            self.evictions += 1
+
+    @staticmethod
+    def __log_refresh_error(task: asyncio.Future):
+
+        """The stale result has been served already, failed refreshes are only logged (and retried on the next get)"""
+
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Could not refresh cached result: {task.exception()}")
+
+    def invalidate(self, key: Hashable):
+        """
+        Drop a cached result, the next get fetches it again
+        :param key: the result's key
+        :return:
+        """
+
+        self.__entries.pop(key, None)
+
+    def clear(self):
+        """
+        Drop all cached results
+        :return:
+        """
+
+        self.__entries.clear()
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return: fresh and stale hits, misses, requests sharing a running fetch, background refreshes, evictions, errors
+        """
+
+        return {"entries": len(self.__entries), "hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses,
+                "coalesced": self.coalesced, "refreshes": self.refreshes, "evictions": self.evictions,
+                "errors": self.errors}
+
+
+response_cache: ResponseCache = ResponseCache()
+"""the cache shared by all plugins, see Plugin.cached"""
@@ -0,0 +1,63 @@
+"""
+    Per-room dispatch tables for commands and hooks
+
+"""
+
+from collections import defaultdict
+from typing import Dict, FrozenSet, Iterable, List, Tuple
+
+
+class RoutingTable:
+
+    def __init__(self, handlers: Iterable):
+        """
+        Precompiled room -> handler mapping for PluginCommands or PluginHooks
+        Handlers without room_id are valid for every room, all others form a per-room overlay
+        :param handlers: PluginCommands or PluginHooks (anything providing room_id), in order of registration
+        """
+
+        handlers = list(handlers)
+
+        self.__global: Tuple = tuple(handler for handler in handlers if handler.room_id is None)
+        self.__global_set: FrozenSet = frozenset(self.__global)
+
+        overlay: Dict[str, List] = defaultdict(list)
+        for handler in handlers:
+            if handler.room_id is not None:
+                for room_id in frozenset(handler.room_id):
+                    overlay[room_id].append(handler)
+
+        # merge global handlers and each room's overlay, keeping the order of registration
+        self.__rooms: Dict[str, Tuple] = {}
+        self.__room_sets: Dict[str, FrozenSet] = {}
+        for room_id, room_handlers in overlay.items():
+            room_set: FrozenSet = self.__global_set.union(room_handlers)
+            self.__rooms[room_id] = tuple(handler for handler in handlers if handler in room_set)
+            self.__room_sets[room_id] = room_set
+
+    def get(self, room_id: str) -> Tuple:
+        """
+        :param room_id: the room to look up handlers for
+        :return: all handlers valid for room_id, in order of registration
+        """
+
+        return self.__rooms.get(room_id, self.__global)
+
+    def contains(self, handler, room_id: str) -> bool:
+        """
+        :param handler: PluginCommand or PluginHook
+        :param room_id: the room to check
+        :return:    True, if handler is valid for room_id
+                    False otherwise
+        """
+
+        return handler in self.__room_sets.get(room_id, self.__global_set)
+
+    def has_handlers(self, room_id: str) -> bool:
+        """
+        :param room_id: the room to check
+        :return:    True, if there is at least one handler valid for room_id
+                    False otherwise
+        """
+
+        return len(self.get(room_id)) > 0
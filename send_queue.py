@@ -0,0 +1,277 @@
+"""
+    Central outbound pipeline for messages sent to rooms: per-room rate limiting, rate limit retries and coalescing
+
+"""
+
+import asyncio
+from collections import deque
+from time import monotonic
+from typing import Any, Deque, Dict, List
+
+from nio import ErrorResponse, RoomSendResponse, SendRetryError
+
+from metrics import metrics, room_class
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: int):
+        """
+        Allows bursts of up to burst messages, refilled by rate messages per second
+        :param rate: messages per second, 0 for no limit
+        :param burst: maximum number of messages sent without waiting
+        """
+
+        self.rate: float = rate
+        self.burst: int = burst
+        self.tokens: float = burst
+        self.updated: float = monotonic()
+
+    def take(self) -> float:
+        """
+        Take a token, if one is available
+        :return:    0, if a token has been taken
+                    seconds until the next token is available otherwise
+        """
+
+        if self.rate <= 0:
+            return 0
+
+        now: float = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        else:
+            return (1 - self.tokens) / self.rate
+
+
+class OutgoingMessage:
+
+    def __init__(self, client, room_id: str, content: Dict[str, Any]):
+        """
+        A message waiting in a room's send queue
+        :param client: AsyncClient used to send the message
+        :param room_id: the room to send the message to
+        :param content: content of the m.room.message event
+        """
+
+        self.client = client
+        self.room_id: str = room_id
+        self.content: Dict[str, Any] = content
+        self.queued_at: float = monotonic()
+        self.result: asyncio.Future = asyncio.get_event_loop().create_future()
+
+    def is_notice(self) -> bool:
+
+        return self.content.get("msgtype") == "m.notice"
+
+    def can_merge(self, other: "OutgoingMessage") -> bool:
+        """
+        Check if another message can be appended to this one
+        :param other: the following message
+        :return:    True, if both are notices of the same format
+                    False otherwise
+        """
+
+        return (self.is_notice() and other.is_notice() and self.client is other.client
+                and ("formatted_body" in self.content) == ("formatted_body" in other.content))
+
+
+class SendQueue:
+
+    def __init__(self, rate: float = 1, burst: int = 5, coalesce_window: float = 0, max_retries: int = 3,
+                 max_merged_length: int = 16384):
+        """
+        One queue and worker per room, sending messages in order while keeping each room below rate messages per second
+        When the homeserver rate limits the bot (M_LIMIT_EXCEEDED), all rooms pause for the given retry_after_ms,
+        as homeservers apply rate limits per user
+        :param rate: messages per second per room, 0 for no limit
+        :param burst: messages sent to a room without waiting
+        :param coalesce_window: seconds to wait for further notices to the same room to merge into a single event,
+                                0 to send every notice as an event of its own
+                                (merged notices share the homeserver's response, and so the event id)
+        :param max_retries: number of retries of rate limited messages
+        :param max_merged_length: maximum length of the body of merged notices
+        """
+
+        self.rate: float = rate
+        self.burst: int = burst
+        self.coalesce_window: float = coalesce_window
+        self.max_retries: int = max_retries
+        self.max_merged_length: int = max_merged_length
+
+        self.__queues: Dict[str, Deque[OutgoingMessage]] = {}
+        self.__workers: Dict[str, asyncio.Task] = {}
+        self.__buckets: Dict[str, TokenBucket] = {}
+        self.__paused_until: float = 0
+
+        self.queued: int = 0
+        self.sent: int = 0
+        self.failed: int = 0
+        self.rate_limited: int = 0
+        self.coalesced: int = 0
+        self.queue_latency_total: float = 0.0
+        self.queue_latency_max: float = 0.0
+
+    async def send(self, client, room_id: str, content: Dict[str, Any]) -> RoomSendResponse or None:
+        """
+        Queue a message and wait until it has been sent
+        :param client: AsyncClient used to send the message
+        :param room_id: the room to send the message to
+        :param content: content of the m.room.message event
+        :return:    the response of the homeserver (shared by merged notices, if coalescing is enabled)
+                    None, if the message could not be sent to an encrypted room
+        """
+
+        message: OutgoingMessage = OutgoingMessage(client, room_id, content)
+        if room_id not in self.__queues:
+            self.__queues[room_id] = deque()
+        self.__queues[room_id].append(message)
+        self.queued += 1
+
+        if room_id not in self.__workers:
+            self.__workers[room_id] = asyncio.ensure_future(self.__work(room_id, self.__queues[room_id]))
+
+        return await message.result
+
+    async def __work(self, room_id: str, queue: Deque[OutgoingMessage]):
+        """
+        Send all messages queued for a room, one after another. The worker ends as soon as the queue is empty.
+        :param room_id: the room to send messages to
+        :param queue: the room's queue
+        :return:
+        """
+
+        try:
+            while queue:
+                head: OutgoingMessage = queue[0]
+                if self.coalesce_window > 0 and head.is_notice():
+                    await asyncio.sleep(max(0.0, head.queued_at + self.coalesce_window - monotonic()))
+
+                await self.__wait_for_token(room_id)
+
+                batch: List[OutgoingMessage] = [queue.popleft()]
+                length: int = len(head.content.get("body", ""))
+                while self.coalesce_window > 0 and queue and batch[-1].can_merge(queue[0]) \
+                        and length + len(queue[0].content.get("body", "")) <= self.max_merged_length:
+                    length += len(queue[0].content.get("body", ""))
+                    batch.append(queue.popleft())
+
+                now: float = monotonic()
+                for message in batch:
+                    self.queue_latency_total += now - message.queued_at
+                    self.queue_latency_max = max(self.queue_latency_max, now - message.queued_at)
+                self.coalesced += len(batch) - 1
+
+                try:
+                    response: RoomSendResponse or None = await self.__send(head.client, room_id, self.__merge(batch))
+                    for message in batch:
+                        if not message.result.done():
+                            message.result.set_result(response)
+                except Exception as err:
+                    self.failed += 1
+                    for message in batch:
+                        if not message.result.done():
+                            message.result.set_exception(err)
+        finally:
+            # no await between the final check of the queue and removal, so send() can not miss a finished worker
+            del self.__workers[room_id]
+            if not queue:
+                del self.__queues[room_id]
+
+    async def __wait_for_token(self, room_id: str):
+
+        """Wait until the bot is not rate limited anymore and the room's bucket has a token"""
+
+        if room_id not in self.__buckets:
+            self.__buckets[room_id] = TokenBucket(self.rate, self.burst)
+
+        while True:
+            pause: float = self.__paused_until - monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+
+            delay: float = self.__buckets[room_id].take()
+            if delay == 0:
+                return
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def __merge(batch: List[OutgoingMessage]) -> Dict[str, Any]:
+
+        """Combine the contents of consecutive notices into a single notice"""
+
+        if len(batch) == 1:
+            return batch[0].content
+
+        content: Dict[str, Any] = dict(batch[0].content)
+        content["body"] = "\n\n".join(message.content["body"] for message in batch)
+        if "formatted_body" in content:
+            content["formatted_body"] = "\n".join(message.content["formatted_body"] for message in batch)
+        return content
+
+    async def __send(self, client, room_id: str, content: Dict[str, Any]) -> RoomSendResponse or None:
+
+        """Send a message, retrying after the time requested by the homeserver when being rate limited"""
+
+        attempt: int = 0
+        label: str = room_class(client.rooms.get(room_id))
+        while True:
+            start: float = monotonic()
+            try:
+                response = await client.room_send(room_id, "m.room.message", content, ignore_unverified_devices=True)
+            except SendRetryError:
+                logger.exception(f"Unable to send message response to {room_id}")
+                self.failed += 1
+                metrics.sends.inc(label, "error")
+                return None
+            finally:
+                metrics.send_duration.observe(monotonic() - start, label)
+
+            if isinstance(response, ErrorResponse) and response.status_code == "M_LIMIT_EXCEEDED" and attempt < self.max_retries:
+                attempt += 1
+                self.rate_limited += 1
+                metrics.sends.inc(label, "rate_limited")
+                retry_after: float = (response.retry_after_ms or 1000) / 1000
+                logger.warning(f"Rate limited while sending to {room_id}, retrying in {retry_after}s")
+                self.__paused_until = max(self.__paused_until, monotonic() + retry_after)
+                await asyncio.sleep(retry_after)
+                continue
+
+            if isinstance(response, ErrorResponse):
+                self.failed += 1
+                metrics.sends.inc(label, "error")
+            else:
+                self.sent += 1
+                metrics.sends.inc(label, "ok")
+            return response
+
+    def get_queue_depths(self) -> Dict[str, int]:
+        """
+        :return: number of queued messages for each room with a running worker
+        """
+
+        return {room_id: len(queue) for room_id, queue in self.__queues.items()}
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        :return: queue and sending statistics
+        """
+
+        return {
+            "queued": self.queued,
+            "sent": self.sent,
+            "failed": self.failed,
+            "rate_limited": self.rate_limited,
+            "coalesced": self.coalesced,
+            "waiting": sum(self.get_queue_depths().values()),
+            "queue_latency_total": self.queue_latency_total,
+            "queue_latency_max": self.queue_latency_max,
+        }
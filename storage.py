@@ -1,5 +1,6 @@
 import sqlite3
 import os.path
+import re
 import logging
 
 latest_db_version = 0
@@ -25,13 +26,19 @@ class Storage(object):
         else:
             self._initial_setup()
 
+    def _connect(self):
+        """Connect to the database, using write-ahead logging so writes don't block readers"""
+        self.conn = sqlite3.connect(self.db_path)
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("PRAGMA journal_mode=WAL")
+        self.cursor.execute("PRAGMA synchronous=NORMAL")
+
     def _initial_setup(self):
         """Initial setup of the database"""
         logger.info("Performing initial database setup...")
 
         # Initialize a connection to the database
-        self.conn = sqlite3.connect(self.db_path)
-        self.cursor = self.conn.cursor()
+        self._connect()
 
         # Sync token table
         self.cursor.execute("CREATE TABLE sync_token ("
@@ -39,10 +46,181 @@ class Storage(object):
                             "token TEXT NOT NULL"
                             ")")
 
+        self._create_sync_filter_table()
+
         logger.info("Database setup complete")
 
     def _run_migrations(self):
         """Execute database migrations"""
         # Initialize a connection to the database
-        self.conn = sqlite3.connect(self.db_path)
-        self.cursor = self.conn.cursor()
+        self._connect()
+
+        # Tables added after the initial release
+        self._create_sync_filter_table()
+
+    def _create_sync_filter_table(self):
+        """Create the table holding the ids of uploaded sync filters, if it does not exist yet"""
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS sync_filter ("
+                            "filter_hash TEXT PRIMARY KEY, "
+                            "filter_id TEXT NOT NULL"
+                            ")")
+
+    def get_sync_token(self) -> str or None:
+        """Get the token of the last processed sync
+
+        Returns:
+            str: The sync token, or None if the bot has never synced before
+        """
+        self.cursor.execute("SELECT token FROM sync_token WHERE dedupe_id = 1")
+        row = self.cursor.fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def set_sync_token(self, token):
+        """Store the token of the last processed sync, allowing to resume syncing from it after a restart
+
+        Args:
+            token (str): The next_batch token of the last processed sync
+        """
+        self.cursor.execute("INSERT OR REPLACE INTO sync_token (dedupe_id, token) VALUES (1, ?)", (token,))
+        self.conn.commit()
+
+    def get_filter_id(self, filter_hash):
+        """Get the id of a previously uploaded sync filter
+
+        Args:
+            filter_hash (str): Hash of the filter (and the user it was uploaded for)
+
+        Returns:
+            str: The filter_id assigned by the homeserver, or None if the filter has not been uploaded yet
+        """
+        self.cursor.execute("SELECT filter_id FROM sync_filter WHERE filter_hash = ?", (filter_hash,))
+        row = self.cursor.fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def set_filter_id(self, filter_hash, filter_id):
+        """Store the id of an uploaded sync filter
+
+        Args:
+            filter_hash (str): Hash of the filter (and the user it was uploaded for)
+
+            filter_id (str): The filter_id assigned by the homeserver
+        """
+        self.cursor.execute("INSERT OR REPLACE INTO sync_filter (filter_hash, filter_id) VALUES (?, ?)", (filter_hash, filter_id))
+        self.conn.commit()
+
+    @staticmethod
+    def _plugin_table(plugin_name):
+        """Get the name of the table holding a plugin's data
+
+        Args:
+            plugin_name (str): Name of the plugin
+
+        Returns:
+            str: The quoted table name
+        """
+        if not re.fullmatch(r"\w+", plugin_name):
+            raise ValueError(f"Invalid plugin name {plugin_name}")
+        return f'"plugin_{plugin_name}"'
+
+    def has_plugin_table(self, plugin_name):
+        """Check if a table holding a plugin's data exists
+
+        Args:
+            plugin_name (str): Name of the plugin
+
+        Returns:
+            bool: True if the table exists
+        """
+        self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (f"plugin_{plugin_name}",))
+        return self.cursor.fetchone() is not None
+
+    def create_plugin_table(self, plugin_name):
+        """Create the table holding a plugin's data, if it does not exist yet
+
+        Args:
+            plugin_name (str): Name of the plugin
+
+        Returns:
+            bool: True if the table has been created, False if it already existed
+        """
+        if self.has_plugin_table(plugin_name):
+            return False
+
+        self.cursor.execute(f"CREATE TABLE {self._plugin_table(plugin_name)} ("
+                            "key TEXT PRIMARY KEY, "
+                            "value BLOB NOT NULL"
+                            ")")
+        self.conn.commit()
+        return True
+
+    def get_plugin_data(self, plugin_name, key):
+        """Get a single item of a plugin's data
+
+        Args:
+            plugin_name (str): Name of the plugin
+
+            key (str): Name of the item
+
+        Returns:
+            bytes: The pickled item, or None if no such item exists
+        """
+        self.cursor.execute(f"SELECT value FROM {self._plugin_table(plugin_name)} WHERE key = ?", (key,))
+        row = self.cursor.fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def get_all_plugin_data(self, plugin_name):
+        """Get all items of a plugin's data
+
+        Args:
+            plugin_name (str): Name of the plugin
+
+        Returns:
+            dict: The pickled items, keyed by name
+        """
+        self.cursor.execute(f"SELECT key, value FROM {self._plugin_table(plugin_name)}")
+        return dict(self.cursor.fetchall())
+
+    def set_plugin_data(self, plugin_name, key, value):
+        """Store a single item of a plugin's data
+
+        Args:
+            plugin_name (str): Name of the plugin
+
+            key (str): Name of the item
+
+            value (bytes): The pickled item
+        """
+        self.cursor.execute(f"INSERT OR REPLACE INTO {self._plugin_table(plugin_name)} (key, value) VALUES (?, ?)", (key, value))
+        self.conn.commit()
+
+    def set_plugin_data_many(self, plugin_name, items):
+        """Store multiple items of a plugin's data in a single transaction
+
+        Args:
+            plugin_name (str): Name of the plugin
+
+            items (dict): The pickled items, keyed by name
+        """
+        self.cursor.executemany(f"INSERT OR REPLACE INTO {self._plugin_table(plugin_name)} (key, value) VALUES (?, ?)", items.items())
+        self.conn.commit()
+
+    def delete_plugin_data(self, plugin_name, key):
+        """Remove a single item of a plugin's data
+
+        Args:
+            plugin_name (str): Name of the plugin
+
+            key (str): Name of the item
+
+        Returns:
+            bool: True if the item has been removed, False if no such item existed
+        """
+        self.cursor.execute(f"DELETE FROM {self._plugin_table(plugin_name)} WHERE key = ?", (key,))
+        self.conn.commit()
+        return self.cursor.rowcount > 0
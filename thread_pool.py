@@ -0,0 +1,123 @@
+"""
+    Shared thread pool for blocking parts of plugin code (file I/O, synchronous libraries)
+
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Any, Callable, Dict, List
+
+from metrics import metrics
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ThreadPool:
+
+    def __init__(self, max_workers: int = 4, name: str = "plugin-blocking"):
+        """
+        Lazily started pool of named worker threads shared by all plugins
+        Calls beyond max_workers wait in the pool's queue, the time they waited is recorded per plugin
+        :param max_workers: number of worker threads
+        :param name: prefix of the threads' names
+        """
+
+        self.max_workers: int = max_workers
+        self.name: str = name
+        self.__executor: ThreadPoolExecutor or None = None
+        self.__lock: threading.Lock = threading.Lock()
+
+        self.calls: int = 0
+        self.failures: int = 0
+        self.queued: int = 0
+        """calls waiting for a worker thread"""
+        self.running: int = 0
+        self.max_queue_depth: int = 0
+        self.wait_total: float = 0.0
+        self.wait_max: float = 0.0
+
+    async def run(self, method: Callable, *args, plugin_name: str = "", **kwargs) -> Any:
+        """
+        Run a blocking function in one of the worker threads without blocking the event loop
+        :param method: the function
+        :param args: positional arguments passed to method
+        :param plugin_name: name of the calling plugin, used as label of the metrics
+        :param kwargs: keyword arguments passed to method
+        :return: the result of method
+        """
+
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+
+        submitted: float = monotonic()
+        started: List[float] = []
+        abandoned: List[bool] = []
+        """set by the awaiting side if it stopped waiting before a worker picked the call up"""
+
+        def call():
+            # runs in the worker thread
+            with self.__lock:
+                if abandoned:
+                    return None
+                started.append(monotonic())
+                self.queued -= 1
+                self.running += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                with self.__lock:
+                    self.running -= 1
+
+        with self.__lock:
+            self.calls += 1
+            self.queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queued)
+
+        future: asyncio.Future = asyncio.get_event_loop().run_in_executor(self.__executor, call)
+        try:
+            return await future
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            with self.__lock:
+                if not started:
+                    # stopped waiting (e.g. timed out or cancelled on shutdown) before a worker picked the call up,
+                    # the worker will skip it
+                    abandoned.append(True)
+                    self.queued -= 1
+            wait: float
+            if started:
+                wait = started[0] - submitted
+                metrics.blocking_duration.observe(monotonic() - started[0], plugin_name)
+            else:
+                future.cancel()
+                wait = monotonic() - submitted
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            metrics.blocking_wait.observe(wait, plugin_name)
+
+    def shutdown(self):
+        """
+        Stop the worker threads once they finished their current calls
+        :return:
+        """
+
+        if self.__executor:
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        :return: number of calls, failed calls, calls waiting for and running on a worker thread, time spent waiting
+        """
+
+        return {"calls": self.calls, "failures": self.failures, "queued": self.queued, "running": self.running,
+                "max_queue_depth": self.max_queue_depth, "wait_total": self.wait_total, "wait_max": self.wait_max}
+
+
+thread_pool: ThreadPool = ThreadPool()
+"""the pool shared by all plugins, configured in main.py"""
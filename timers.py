@@ -0,0 +1,251 @@
+"""
+    Scheduling of timers registered by plugins, independent of sync responses
+
+"""
+
+import asyncio
+import heapq
+from datetime import datetime, timedelta
+from time import time, monotonic
+from typing import Dict, List, Set, Tuple
+
+from metrics import metrics
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class CronSchedule:
+
+    field_ranges: List[Tuple[int, int]] = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+    """valid values for minute, hour, day of month, month, day of week (0 and 7 being sunday)"""
+
+    def __init__(self, expression: str):
+        """
+        A cron-like schedule, e.g. "*/15 8-18 * * 1-5"
+        Supports *, lists (1,2,3), ranges (1-5) and steps (*/5, 10-30/10) in all of the five fields
+        :param expression: minute hour day_of_month month day_of_week
+        """
+
+        self.expression: str = expression
+        fields: List[str] = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Invalid cron expression {expression}: expected 5 fields, got {len(fields)}")
+
+        parsed: List[Set[int]] = [self.__parse_field(field, *field_range) for field, field_range in zip(fields, self.field_ranges)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+
+        # cron uses 0 and 7 for sunday, python's isoweekday() 7 and %7 gives 0
+        self.weekdays: Set[int] = {weekday % 7 for weekday in weekdays}
+
+        # if both day of month and day of week are restricted, either of them has to match
+        self.days_restricted: bool = fields[2] != "*"
+        self.weekdays_restricted: bool = fields[4] != "*"
+
+    @staticmethod
+    def __parse_field(field: str, lowest: int, highest: int) -> Set[int]:
+        """
+        Parse a single field of a cron expression
+        :param field: the field to parse
+        :param lowest: lowest valid value
+        :param highest: highest valid value
+        :return: set of all values matching the field
+        """
+
+        values: Set[int] = set()
+        for part in field.split(","):
+            step: int = 1
+            if "/" in part:
+                part, step_str = part.split("/", 1)
+                step = int(step_str)
+                if step < 1:
+                    raise ValueError(f"Invalid step in cron field {field}")
+
+            if part == "*":
+                start, end = lowest, highest
+            elif "-" in part:
+                start_str, end_str = part.split("-", 1)
+                start, end = int(start_str), int(end_str)
+            else:
+                start = int(part)
+                end = highest if step != 1 else start
+
+            if start < lowest or end > highest or start > end:
+                raise ValueError(f"Invalid value in cron field {field}, allowed: {lowest}-{highest}")
+
+            values.update(range(start, end + 1, step))
+
+        return values
+
+    def __day_matches(self, moment: datetime) -> bool:
+
+        day_match: bool = moment.day in self.days
+        weekday_match: bool = moment.isoweekday() % 7 in self.weekdays
+
+        if self.days_restricted and self.weekdays_restricted:
+            return day_match or weekday_match
+        else:
+            return day_match and weekday_match
+
+    def next_after(self, timestamp: float) -> float:
+        """
+        Find the next point in time (local time) matching the schedule
+        :param timestamp: unix timestamp to start searching from (exclusive)
+        :return: unix timestamp of the next matching minute
+        """
+
+        moment: datetime = datetime.fromtimestamp(timestamp).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit: datetime = moment + timedelta(days=366 * 5)
+
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self.__day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+
+        raise ValueError(f"Cron expression {self.expression} never matches")
+
+
+class TimerScheduler:
+
+    def __init__(self, client, timers: List = None):
+        """
+        Heap-based scheduler running plugin timers as its own asyncio task
+        :param client: AsyncClient passed to the timers' methods
+        :param timers: PluginTimers to schedule
+        """
+
+        self.client = client
+        self.__heap: List[Tuple[float, int, float, object]] = []
+        """(time to run, sequence, due time without jitter, timer)"""
+        self.__sequence: int = 0
+        self.__timers: Set = set()
+        self.__running: Dict[object, asyncio.Task] = {}
+        self.__wakeup: asyncio.Event or None = None
+        self.__task: asyncio.Task or None = None
+
+        for timer in timers or []:
+            self.add(timer)
+
+    def add(self, timer):
+        """
+        Schedule a PluginTimer, starting from now
+        :param timer: the PluginTimer to schedule
+        :return:
+        """
+
+        self.__timers.add(timer)
+        self.__schedule(timer, time())
+
+    def remove(self, timer):
+        """
+        Stop scheduling a PluginTimer, a currently running execution is not interrupted
+        :param timer: the PluginTimer to remove
+        :return:
+        """
+
+        self.__timers.discard(timer)
+
+    def __schedule(self, timer, after: float, now: float = None):
+        """
+        Push the next execution of a timer, jitter only delays the execution, not the timer's schedule
+        :param timer: the PluginTimer
+        :param after: the previous due time (without jitter), or now for the first execution
+        :param now: current time, missed executions before it are skipped instead of caught up on
+        :return:
+        """
+
+        try:
+            due: float = timer.next_run(after)
+            if now is not None and due <= now:
+                due = timer.next_run(now)
+        except ValueError as err:
+            logger.critical(f"Stopped timer {timer.method.__name__} of {timer.plugin_name}: {err}")
+            self.__timers.discard(timer)
+            return
+
+        self.__sequence += 1
+        heapq.heappush(self.__heap, (due + timer.get_jitter(), self.__sequence, due, timer))
+        if self.__wakeup:
+            self.__wakeup.set()
+
+    def start(self):
+        """
+        Start the scheduler task, if it is not running already
+        :return:
+        """
+
+        if self.__task is None or self.__task.done():
+            self.__wakeup = asyncio.Event()
+            self.__task = asyncio.ensure_future(self.__run())
+
+    async def stop(self):
+        """
+        Stop the scheduler and cancel all currently running timers
+        :return:
+        """
+
+        tasks: List[asyncio.Task] = list(self.__running.values())
+        if self.__task:
+            tasks.append(self.__task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.__task = None
+
+    async def __run(self):
+
+        while True:
+            now: float = time()
+            while self.__heap and self.__heap[0][0] <= now:
+                run_at, _, due, timer = heapq.heappop(self.__heap)
+                if timer not in self.__timers:
+                    # timer has been removed
+                    continue
+
+                if timer in self.__running and not timer.allow_overlap:
+                    timer.skipped += 1
+                    logger.debug(f"Skipping timer {timer.method.__name__}, previous run still active")
+                else:
+                    self.__running[timer] = asyncio.ensure_future(self.__run_timer(timer, run_at))
+
+                # schedule from the due time to avoid drift, but don't try to catch up on missed runs
+                self.__schedule(timer, due, now)
+
+            delay: float or None = self.__heap[0][0] - time() if self.__heap else None
+            self.__wakeup.clear()
+            try:
+                await asyncio.wait_for(self.__wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def __run_timer(self, timer, run_at: float):
+
+        timer.record_lag(max(0.0, time() - run_at))
+        outcome: str = "ok"
+        start: float = monotonic()
+        try:
+            await timer.method(self.client)
+        except Exception as err:
+            outcome = "error"
+            timer.failures += 1
+            logger.critical(f"Plugin failed to catch exception in {timer.method}: {err}")
+        finally:
+            timer.record_duration(monotonic() - start)
+            metrics.timer_duration.observe(monotonic() - start, timer.plugin_name, timer.method.__name__)
+            metrics.timers.inc(timer.plugin_name, timer.method.__name__, outcome)
+            if self.__running.get(timer) is asyncio.current_task():
+                del self.__running[timer]
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        :return: statistics of all scheduled timers, keyed by <plugin>.<method>
+        """
+
+        return {f"{timer.plugin_name}.{timer.method.__name__}": timer.get_stats() for timer in self.__timers}
@@ -0,0 +1,135 @@
+"""
+    Typing notifications shown while delayed replies are waiting to be sent, handled in the background
+
+"""
+
+import asyncio
+from time import monotonic
+from typing import Awaitable, Callable, Dict, Set
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class TypingManager:
+
+    def __init__(self, margin: float = 1):
+        """
+        Schedules delayed replies and shows a single typing notification per room while any of them is pending
+        Overlapping replies to the same room share one start and one stop of the notification
+        :param margin: seconds the notification is kept up beyond the latest pending reply
+        """
+
+        self.margin: float = margin
+
+        self.__pending: Dict[str, int] = {}
+        """number of replies waiting to be sent to each room"""
+        self.__typing_until: Dict[str, float] = {}
+        """point in time the current typing notification of each room expires"""
+        self.__last_reply: Dict[str, asyncio.Task] = {}
+        self.__last_typing_call: Dict[str, asyncio.Task] = {}
+        self.__tasks: Set[asyncio.Task] = set()
+
+        self.scheduled: int = 0
+        self.sent: int = 0
+        self.failed: int = 0
+        self.typing_calls: int = 0
+        self.coalesced: int = 0
+
+    def schedule(self, client, room_id: str, delay: float, send: Callable[[], Awaitable]) -> asyncio.Task:
+        """
+        Send a reply after showing a typing notification for delay seconds, without waiting for it
+        Replies to the same room are sent in the order they have been scheduled
+        :param client: AsyncClient used for the typing notification
+        :param room_id: the room the reply goes to
+        :param delay: seconds to show the typing notification before sending
+        :param send: callable returning an awaitable sending the reply
+        :return: the task sending the reply
+        """
+
+        self.scheduled += 1
+        deadline: float = monotonic() + delay
+        self.__pending[room_id] = self.__pending.get(room_id, 0) + 1
+
+        if self.__typing_until.get(room_id, 0) < deadline:
+            # start (or extend) the notification
+            self.__typing_until[room_id] = deadline + self.margin
+            self.__typing(client, room_id, True, int((delay + self.margin) * 1000))
+        else:
+            self.coalesced += 1
+
+        task: asyncio.Task = asyncio.ensure_future(self.__deliver(client, room_id, delay, send, self.__last_reply.get(room_id)))
+        self.__last_reply[room_id] = task
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+        return task
+
+    async def __deliver(self, client, room_id: str, delay: float, send: Callable[[], Awaitable], previous: asyncio.Task or None):
+
+        try:
+            await asyncio.sleep(delay)
+            if previous is not None and not previous.done():
+                await asyncio.wait([previous])
+            await send()
+            self.sent += 1
+        except Exception as err:
+            self.failed += 1
+            logger.error(f"Failed to send delayed reply to {room_id}: {err}")
+        finally:
+            self.__pending[room_id] -= 1
+            if self.__pending[room_id] == 0:
+                # last pending reply of the room, stop the notification
+                del self.__pending[room_id]
+                del self.__typing_until[room_id]
+                del self.__last_reply[room_id]
+                self.__typing(client, room_id, False)
+
+    def __typing(self, client, room_id: str, typing_state: bool, timeout: int = 30000):
+
+        """Send a typing notification in the background, after all previous ones for the room"""
+
+        previous: asyncio.Task or None = self.__last_typing_call.get(room_id)
+
+        async def call():
+            if previous is not None and not previous.done():
+                await asyncio.wait([previous])
+            try:
+                await client.room_typing(room_id, typing_state=typing_state, timeout=timeout)
+                self.typing_calls += 1
+            except Exception as err:
+                logger.debug(f"Could not send typing notification to {room_id}: {err}")
+            finally:
+                if self.__last_typing_call.get(room_id) is task:
+                    del self.__last_typing_call[room_id]
+
+        task: asyncio.Task = asyncio.ensure_future(call())
+        self.__last_typing_call[room_id] = task
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    async def join(self):
+        """
+        Wait until all scheduled replies and typing notifications have been sent
+        :return:
+        """
+
+        while self.__tasks:
+            await asyncio.gather(*self.__tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return: scheduled, sent and failed replies, typing notifications sent and saved by coalescing
+        """
+
+        return {
+            "scheduled": self.scheduled,
+            "sent": self.sent,
+            "failed": self.failed,
+            "pending": sum(self.__pending.values()),
+            "typing_calls": self.typing_calls,
+            "coalesced": self.coalesced,
+        }
+
+
+typing_manager: TypingManager = TypingManager()
+"""the manager used for all delayed replies"""